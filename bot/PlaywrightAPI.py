@@ -1,5 +1,239 @@
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, List, Optional, Set
+
 from playwright.async_api import async_playwright
 import gui
+from utility.debug import percentile
+
+"""
+Playwright browser and a pool of warm pages for running tag javascript.
+
+Every tag with javascript used to open a new context and page, run its
+snippets, and close them again.  The pool keeps a few browser contexts
+open, each with a page ready to go, and bounds how many tags can run
+javascript at once.  A page is only used for one checkout, so tags never
+see each other's globals; the context it lived in is reused until it has
+served POOL_MAX_USES pages, then closed.
+"""
+
+POOL_SIZE = 4
+POOL_MAX_USES = 50
+# Seconds one snippet may run for before its context is thrown away.
+SNIPPET_TIMEOUT = 5.0
+# V8 heap limit for the browser's renderers, in megabytes.
+JS_HEAP_MB = 128
+SNIPPET_CACHE_SIZE = 512
+# Snippets that touch any of these can give a different answer each run.
+NONDETERMINISTIC = re.compile(
+    r"\b(Math\s*\.\s*random|Date|performance|crypto|fetch|XMLHttpRequest|"
+    r"setTimeout|setInterval|navigator|location|document|window|globalThis)\b"
+)
+
+
+def snippets_key(snippets: List[str]) -> Optional[str]:
+    """Cache key for running snippets in order on a fresh page.
+
+    Later snippets can use globals set by earlier ones, so the key covers
+    the whole sequence.  None if any snippet could give a different
+    answer each run.
+    """
+    if any(NONDETERMINISTIC.search(snippet) for snippet in snippets):
+        return None
+    digest = hashlib.sha256()
+    for snippet in snippets:
+        digest.update(snippet.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class PooledContext:
+    """A browser context with one page waiting to be checked out."""
+
+    def __init__(self, context: Any):
+        self.context = context
+        self.page = None
+        self.uses = 0
+
+    async def fresh_page(self):
+        self.page = await self.context.new_page()
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except Exception as e:
+            gui.gprint(e)
+
+
+class PagePool:
+    """Warm browser pages shared by every tag that runs javascript.
+
+    Args:
+        browser (Any): The playwright Browser to make contexts in.
+        size (int, optional): Contexts open at once, and so tags running at once. Defaults to POOL_SIZE.
+        max_uses (int, optional): Pages a context serves before it's replaced. Defaults to POOL_MAX_USES.
+        timeout (float, optional): Seconds each snippet may run. Defaults to SNIPPET_TIMEOUT.
+    """
+
+    def __init__(
+        self,
+        browser: Any,
+        size: int = POOL_SIZE,
+        max_uses: int = POOL_MAX_USES,
+        timeout: float = SNIPPET_TIMEOUT,
+    ):
+        self.browser = browser
+        self.size = size
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle: List[PooledContext] = []
+        self.refilling: Set[asyncio.Task] = set()
+        self.cache: "OrderedDict[str, Any]" = OrderedDict()
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self.runs: Deque[float] = deque(maxlen=1000)
+        self.evals: Deque[float] = deque(maxlen=1000)
+        self.evaluations = 0
+        self.cache_hits = 0
+        self.timeouts = 0
+        self.recycled = 0
+
+    async def new_slot(self) -> PooledContext:
+        slot = PooledContext(await self.browser.new_context())
+        await slot.fresh_page()
+        return slot
+
+    async def warm(self):
+        """Open every context ahead of the first tag."""
+        while len(self.idle) < self.size:
+            self.idle.append(await self.new_slot())
+
+    async def refill(self):
+        """Replace a recycled context, so the next tag doesn't wait for one."""
+        try:
+            slot = await self.new_slot()
+        except Exception as e:
+            gui.gprint(e)
+            return
+        if len(self.idle) < self.size:
+            self.idle.append(slot)
+        else:
+            await slot.close()
+
+    @asynccontextmanager
+    async def page(self):
+        """Check out a page nobody else has used.
+
+        The page's context is closed instead of reused if anything went
+        wrong in it, such as a snippet timing out or crashing the renderer.
+        """
+        start = time.perf_counter()
+        async with self.slots:
+            slot = self.idle.pop() if self.idle else await self.new_slot()
+            self.waits.append(time.perf_counter() - start)
+            healthy = False
+            try:
+                yield slot.page
+                healthy = True
+            finally:
+                slot.uses += 1
+                if len(self.idle) >= self.size:
+                    # A refill got here first.
+                    await slot.close()
+                elif healthy and slot.uses < self.max_uses:
+                    try:
+                        await slot.page.close()
+                        await slot.fresh_page()
+                        self.idle.append(slot)
+                    except Exception as e:
+                        gui.gprint(e)
+                        await self.recycle(slot)
+                else:
+                    await self.recycle(slot)
+
+    async def recycle(self, slot: PooledContext):
+        # Closing the context also kills a page stuck in a loop.
+        self.recycled += 1
+        await slot.close()
+        self.refilling = {t for t in self.refilling if not t.done()}
+        self.refilling.add(asyncio.create_task(self.refill()))
+
+    async def evaluate(self, page: Any, snippet: str) -> Any:
+        """Run one snippet on page, giving up after the pool's timeout."""
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(page.evaluate(snippet), self.timeout)
+        finally:
+            self.evaluations += 1
+            self.evals.append(time.perf_counter() - start)
+
+    async def run_snippets(self, snippets: List[str]) -> List[Any]:
+        """Evaluate snippets in order on one fresh page, or get them from the cache.
+
+        If a snippet times out or fails, it and every snippet after it get
+        an error message as their result, and nothing is cached.
+
+        Args:
+            snippets (List[str]): Javascript expressions.
+
+        Returns:
+            List[Any]: The result of each snippet.
+        """
+        start = time.perf_counter()
+        key = snippets_key(snippets)
+        if key is not None and key in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            results = list(self.cache[key])
+        else:
+            results = []
+            failure = None
+            try:
+                async with self.page() as page:
+                    for snippet in snippets:
+                        results.append(await self.evaluate(page, snippet))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                failure = "[timed out]"
+            except Exception as e:
+                gui.gprint(e)
+                failure = "[error]"
+            if failure is not None:
+                results += [failure] * (len(snippets) - len(results))
+            elif key is not None:
+                self.cache[key] = list(results)
+                if len(self.cache) > SNIPPET_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        self.runs.append(time.perf_counter() - start)
+        return results
+
+    async def close(self):
+        for task in self.refilling:
+            task.cancel()
+        for slot in self.idle:
+            await slot.close()
+        self.idle = []
+
+    def status_string(self) -> str:
+        def spread(values: Deque[float]) -> str:
+            values = list(values)
+            return (
+                f"p50 {percentile(values, 0.5) * 1000:.0f}ms, "
+                f"p99 {percentile(values, 0.99) * 1000:.0f}ms"
+            )
+
+        return (
+            f"{len(self.idle)}/{self.size} pages idle, {self.recycled} contexts recycled.\n"
+            f"Tags: {len(self.runs)} recent, {spread(self.runs)}, "
+            f"{self.cache_hits} from cache.\n"
+            f"Waiting for a page: {spread(self.waits)}.\n"
+            f"Snippets: {self.evaluations} run, {spread(self.evals)}, "
+            f"{self.timeouts} timed out."
+        )
 
 
 class PlaywrightMixin:
@@ -8,6 +242,7 @@ class PlaywrightMixin:
     playapi = None
     browser = None
     browser_on = False
+    page_pool: Optional[PagePool] = None
 
     async def start_player(self):
         """Initalize an instance of Playwright"""
@@ -15,20 +250,39 @@ class PlaywrightMixin:
         self.playapi = await async_playwright().start()
         gui.print("Playwright initalized.")
 
+    async def launch_browser(self):
+        return await self.playapi.chromium.launch(
+            args=[f"--js-flags=--max-old-space-size={JS_HEAP_MB}"]
+        )
+
     async def open_browser(self):
         if self.playapi == None:
             raise Exception("Still loading the website stuff!")
         if self.browser == None:
-            self.browser = await self.playapi.chromium.launch()
+            self.browser = await self.launch_browser()
             self.browser_on = True
 
     async def get_browser(self):
         if self.browser == None:
-            self.browser = await self.playapi.chromium.launch()
+            self.browser = await self.launch_browser()
             self.browser_on = True
         return self.browser
 
+    async def get_page_pool(self) -> PagePool:
+        """The shared page pool, made and warmed the first time it's asked for."""
+        if self.page_pool is None:
+            pool = PagePool(await self.get_browser())
+            await pool.warm()
+            if self.page_pool is None:
+                self.page_pool = pool
+            else:
+                await pool.close()
+        return self.page_pool
+
     async def close_browser(self):
+        if self.page_pool != None:
+            await self.page_pool.close()
+            self.page_pool = None
         if self.browser != None:
             await self.browser.close()
             self.browser_on = False
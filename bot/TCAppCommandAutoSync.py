@@ -1,9 +1,11 @@
 from collections.abc import Mapping
+import asyncio
 import discord
 import json
 import logging
+import time
 import traceback
-from typing import Any, Dict, List, Tuple, Union, TYPE_CHECKING
+from typing import Any, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
 from sqlalchemy import Column, Integer, Text, Boolean, ForeignKey, DateTime, Double
 from sqlalchemy.orm import relationship, Mapped
 from sqlalchemy.orm import sessionmaker, Session
@@ -30,6 +32,8 @@ This is to avoid excessive api calls.
 
 """
 GLOBAL_ID = 512
+# Guild trees synced with discord at once during startup.
+MAX_CONCURRENT_SYNCS = 4
 
 logger = logging.getLogger("TCLogger")
 
@@ -119,6 +123,24 @@ class GuildCogToggle(Guild_Sync_Base):
         result = session.execute(statement).scalars().first()
         return result
 
+    @staticmethod
+    def default_enabled(server_id: int, cog: commands.Cog) -> bool:
+        """Whether cog starts out enabled in a server without a toggle for it."""
+        default = True
+        manual = False
+        if hasattr(cog, "manual_enable"):
+            manual = cog.manual_enable
+        if manual:
+            default = False
+        if hasattr(cog, "globalonly"):
+            if cog.globalonly and server_id != GLOBAL_ID:
+                default = False
+            elif cog.globalonly and server_id == GLOBAL_ID:
+                default = True
+        elif server_id == GLOBAL_ID:
+            default = False
+        return default
+
     @classmethod
     def get_or_add(cls, server_id: int, cog: commands.Cog):
         session: Session = DatabaseSingleton.get_session()
@@ -129,29 +151,51 @@ class GuildCogToggle(Guild_Sync_Base):
 
         if result is None:
             print(server_id, cog, result)
-            default = True
-            manual = False
-            if hasattr(cog, "manual_enable"):
-                manual = cog.manual_enable
-            if manual:
-                default = False
-            if hasattr(cog, "globalonly"):
-                if cog.globalonly and server_id != GLOBAL_ID:
-                    print("should not sync.")
-                    default = False
-                elif cog.globalonly and server_id == GLOBAL_ID:
-                    print("WILL SYNC GLOBAL.")
-                    default = True
-            elif server_id == GLOBAL_ID:
-                default = False
             result = cls(
-                server_id=server_id, cog_name=cog.qualified_name, enabled=default
+                server_id=server_id,
+                cog_name=cog.qualified_name,
+                enabled=cls.default_enabled(server_id, cog),
             )
             session.add(result)
             session.commit()
 
         return result
 
+    @classmethod
+    def load_all(
+        cls, server_ids: List[int], cogs: Dict[str, commands.Cog]
+    ) -> Dict[int, Dict[str, bool]]:
+        """Get the enabled state of every cog in every server with one query.
+
+        Toggles that don't exist yet are added with their default state.
+
+        Args:
+            server_ids (List[int]): Servers to get toggles for.
+            cogs (Dict[str, commands.Cog]): The bot's loaded cogs.
+
+        Returns:
+            Dict[int, Dict[str, bool]]: server_id -> cog qualified_name -> enabled.
+        """
+        session: Session = DatabaseSingleton.get_session()
+        wanted = set(server_ids)
+        toggles: Dict[int, Dict[str, bool]] = {sid: {} for sid in wanted}
+        for row in session.execute(select(cls)).scalars():
+            if row.server_id in wanted:
+                toggles[row.server_id][row.cog_name] = row.enabled
+        missing = []
+        for sid in wanted:
+            for cog in cogs.values():
+                if cog.qualified_name not in toggles[sid]:
+                    enabled = cls.default_enabled(sid, cog)
+                    toggles[sid][cog.qualified_name] = enabled
+                    missing.append(
+                        cls(server_id=sid, cog_name=cog.qualified_name, enabled=enabled)
+                    )
+        if missing:
+            session.add_all(missing)
+            session.commit()
+        return toggles
+
     @classmethod
     def edit(cls, server_id: int, cog: commands.Cog, enabled: bool):
         session: Session = DatabaseSingleton.get_session()
@@ -201,6 +245,13 @@ class AppGuildTreeSync(Guild_Sync_Base):
         else:
             return None
 
+    @classmethod
+    def get_all(cls) -> Dict[int, "AppGuildTreeSync"]:
+        """Get every AppGuildTreeSync entry with one query, keyed by server_id."""
+        session: Session = DatabaseSingleton.get_session()
+        rows = session.execute(select(AppGuildTreeSync)).scalars().all()
+        return {row.server_id: row for row in rows}
+
     @classmethod
     def add(cls, server_id):
         """
@@ -494,7 +545,7 @@ class SpecialAppSync:
                 print(name, app_tree)
             dbentry: AppGuildTreeSync = AppGuildTreeSync.get(guildid)
             if not dbentry:
-                print("NO DBENTRY for ", guild.id)
+                print("NO DBENTRY for ", guildid)
                 dbentry = AppGuildTreeSync.add(guildid)
             same, diffscore, score = dbentry.compare_with_command_tree(app_tree)
             gui.gprint(f"Check Results: {name} (ID {guildid}):{score}")
@@ -519,21 +570,30 @@ class SpecialAppSync:
             res = str(traceback.format_exception(None, e, e.__traceback__))
             gui.gprint(res)
 
-    async def add_enabled_cogs_into_guild(self, guild=None, force=False):
+    async def add_enabled_cogs_into_guild(
+        self,
+        guild=None,
+        force=False,
+        toggles: Optional[Dict[str, bool]] = None,
+        entry: Optional[AppGuildTreeSync] = None,
+    ):
         """With a passed in guild, sync all activated cogs for that guild.
         Works on a guild per guild basis in case I need to eventually provide
-        code to sync different app commands between guilds."""
+        code to sync different app commands between guilds.
+
+        toggles and entry are the guild's preloaded cog toggles and AppGuildTreeSync
+        entry, when they aren't passed in they're queried."""
         guildid = GLOBAL_ID
         if guild:
             guildid = guild.id
         if not guild:
             self.tree.clear_commands(guild=None)
-        ignorelist = AppGuildTreeSync.load_list(guildid)
-        onlist = AppGuildTreeSync.load_onlist(guildid)
-        entry = AppGuildTreeSync.get(server_id=guildid)
+        if entry is None:
+            entry = AppGuildTreeSync.get(server_id=guildid)
         if entry:
             if entry.migrated is None:
                 print(guildid, entry.migrated)
+                toggles = None
                 ignorelist = AppGuildTreeSync.load_list(guildid)
                 onlist = AppGuildTreeSync.load_onlist(guildid)
                 for cogname, cog in self.cogs.items():
@@ -545,8 +605,6 @@ class SpecialAppSync:
                 DatabaseSingleton.get_session().commit()
                 print(guildid, entry.migrated)
 
-        gui.dprint(ignorelist)
-
         def syncprint(*lis):
             # print(*lis)
             pass
@@ -594,8 +652,11 @@ class SpecialAppSync:
         # Note, the reason it goes one by one is because it was originally intended
         # to activate/deactivate cogs on a server per server basis.
         for cogname, cog in self.cogs.items():
-            ent = GuildCogToggle.get_or_add(guildid, cog)
-            if not ent.enabled:
+            if toggles is not None and cog.qualified_name in toggles:
+                enabled = toggles[cog.qualified_name]
+            else:
+                enabled = GuildCogToggle.get_or_add(guildid, cog).enabled
+            if not enabled:
                 gui.gprint("skipping cog ", cogname)
                 continue
             if hasattr(cog, "ctx_menus"):
@@ -620,39 +681,143 @@ class SpecialAppSync:
             gui.gprint(e)
             raise Exception()
 
+    def format_guild_tree(
+        self, guild, memo: Dict[Tuple[int, ...], Tuple[Dict[str, Any], str]]
+    ) -> Tuple[Dict[str, Any], str]:
+        """build_and_format_app_commands for guild, plus its json.
+
+        Guilds with the same enabled cogs end up holding the same command
+        objects, so the formatted tree is memoized on the ids of the commands
+        in the guild's tree."""
+        key = tuple(sorted(id(c) for c in self.tree.get_commands(guild=guild)))
+        if key not in memo:
+            app_tree = build_and_format_app_commands(self.tree, guild)
+            memo[key] = (app_tree, json.dumps(app_tree, default=str))
+        return memo[key]
+
     async def all_guild_startup(self, force=False, sync_only=False, no_sync=False):
-        """fetch all available guilds, and sync the command tree."""
+        """fetch all available guilds, and sync the command tree.
+
+        Every AppGuildTreeSync and GuildCogToggle row is loaded up front, each
+        distinct command tree is only formatted once, and only the guilds whose
+        tree changed are synced, a few at a time."""
+        timings: Dict[str, float] = {}
+        clock = time.perf_counter()
+
+        def lap(stage: str):
+            nonlocal clock
+            now = time.perf_counter()
+            timings[stage] = now - clock
+            clock = now
+
         try:
             gui.gprint(f"syncing for global")
             if not sync_only:
                 await self.add_enabled_cogs_into_guild(None, force=force)
             if no_sync == False or sync_only:
                 await self.sync_commands_tree(None, forced=force)
+            lap("global")
+
+            entries = AppGuildTreeSync.get_all()
+            guilds = [
+                g
+                for g in self.guilds
+                if not (g.id in entries and entries[g.id].donotsync)
+            ]
+            skipped = len(self.guilds) - len(guilds)
+            toggles = {}
+            if not sync_only:
+                toggles = GuildCogToggle.load_all([g.id for g in guilds], self.cogs)
+            lap("load")
 
-            # gui.gprint(self.guilds)
-            for guild in self.guilds:
+            for guild in guilds:
                 if force:
                     self.tree.clear_commands(guild=guild)
-                entry = AppGuildTreeSync.get(server_id=guild.id)
-                if entry:
-                    if entry.donotsync:
-                        continue
-
-                gui.gprint(f"syncing for {guild.name}")
                 if not sync_only:
-                    await self.add_enabled_cogs_into_guild(guild, force=force)
-                if no_sync == False or sync_only:
-                    await self.sync_commands_tree(guild, forced=force)
+                    await self.add_enabled_cogs_into_guild(
+                        guild,
+                        force=force,
+                        toggles=toggles.get(guild.id),
+                        entry=entries.get(guild.id),
+                    )
+            lap("build")
 
-            if entry:
-                if entry.donotsync:
-                    gui.gprint(f"nosync for global")
-                    return
+            to_sync: List[Tuple[discord.Guild, AppGuildTreeSync, Dict]] = []
+            memo: Dict[Tuple[int, ...], Tuple[Dict[str, Any], str]] = {}
+            if no_sync == False or sync_only:
+                for guild in guilds:
+                    app_tree, tree_json = self.format_guild_tree(guild, memo)
+                    entry = entries.get(guild.id)
+                    if entry is None:
+                        print("NO DBENTRY for ", guild.id)
+                        entry = AppGuildTreeSync(guild.id)
+                        DatabaseSingleton.get_session().add(entry)
+                        entries[guild.id] = entry
+                    if not force:
+                        if entry.lastsyncdata == tree_json:
+                            continue
+                        same, diffscore, score = entry.compare_with_command_tree(
+                            app_tree
+                        )
+                        self.logs.info(
+                            f"Check Results: {guild.name} (ID {guild.id}):\n differences{diffscore} \n{score}"
+                        )
+                        if same:
+                            continue
+                    to_sync.append((guild, entry, app_tree))
+                DatabaseSingleton.get_session().commit()
+            lap("compare")
+
+            synced, failed = await self.sync_guild_queue(to_sync)
+            lap("sync")
+
+            report = (
+                f"Command tree startup: {len(guilds)} guilds, {skipped} set to not sync, "
+                f"{len(memo)} distinct trees, {synced} synced, {failed} failed. "
+                + ", ".join(f"{k} {v*1000:.0f}ms" for k, v in timings.items())
+            )
+            gui.gprint(report)
+            self.logs.info(report)
 
         except Exception as e:
             res = str(traceback.format_exception(None, e, e.__traceback__))
             gui.gprint("Exception in allgruild", e, res)
-            raise entry
+            raise e
+
+    async def sync_guild_queue(
+        self, to_sync: List[Tuple[discord.Guild, AppGuildTreeSync, Dict]]
+    ) -> Tuple[int, int]:
+        """Sync each guild's command tree with discord, MAX_CONCURRENT_SYNCS at a time.
+
+        The stored tree of a guild is only updated once its sync succeeds.
+
+        Returns:
+            Tuple[int, int]: The number of guilds synced, and the number that failed.
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SYNCS)
+
+        async def sync(guild: discord.Guild):
+            async with semaphore:
+                gui.gprint(f"Starting sync for {guild.name} (ID {guild.id})...")
+                await self.tree.sync(guild=guild)
+
+        results = await asyncio.gather(
+            *(sync(guild) for guild, _, _ in to_sync), return_exceptions=True
+        )
+        synced = failed = 0
+        for (guild, entry, app_tree), result in zip(to_sync, results):
+            if isinstance(result, Exception):
+                failed += 1
+                self.logs.error(
+                    "Sync failed for %s (ID %s)", guild.name, guild.id, exc_info=result
+                )
+                continue
+            synced += 1
+            entry.lastsyncdata = json.dumps(app_tree, default=str)
+            entry.lastsyncdate = datetime.datetime.now()
+        if synced:
+            DatabaseSingleton.get_session().commit()
+        return synced, failed
 
     async def get_tree_dict(self, guild):
         app_tree = build_and_format_app_commands(
@@ -1,11 +1,22 @@
 import asyncio
 from datetime import datetime as dt
-from typing import Any, Callable, Coroutine, Dict, Optional, Type, Literal, TypeVar
+from itertools import count
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Literal,
+    TypeVar,
+)
 import gui
 
 from dateutil.rrule import rrule
 import heapq
-from queue import PriorityQueue
 import logging
 
 _coro = Callable[..., Coroutine[Any, Any, Any]]
@@ -16,12 +27,9 @@ Statuses = Literal["created", "standby", "running"]
 logs = logging.getLogger("TCLogger")
 
 
-class AutoRebalancePriorityQueue(PriorityQueue):
-    """This is a special PriorityQueque that rebalances itself on new items."""
-
-    def rebalance(self):
-        with self.mutex:
-            heapq.heapify(self.queue)
+# Longest the scheduler sleeps without looking at the clock again,
+# in case the system clock jumps.
+MAX_SLEEP_SECONDS = 300
 
 
 class TCTaskRef:
@@ -35,12 +43,6 @@ class TCTaskRef:
     def get_task(self) -> "TCTask":
         return TCTaskManager.get_task(self.name)
 
-    def __lt__(self, other):
-        me = self.get_task()
-        if me != None and other.get_task() is not None:
-            return self.get_task().to_run_next < other.get_task().to_run_next
-        return True
-
 
 logs = logging.getLogger("TCLogger")
 
@@ -230,7 +232,8 @@ class TCTask:
                 if not remove_check:
                     TCTaskManager.set_standby(self.name)
             else:
-                pass
+                # Rescheduled to later after being launched, so put it back.
+                TCTaskManager.get_instance().schedule(self.name)
                 # Print the time until next run
                 # time_until = self.to_run_next - dt.now()
                 # gui.gprint(f"{self.name} not ready. Next run in {time_until}")
@@ -260,9 +263,13 @@ class TCTask:
             The dt of the next time the task should be run.
         """
         # Calculate the next future occurrence
+        now = dt.now()
         next_occurrence = self.time_interval.after(
-            dt.now().replace(second=0, microsecond=0)
+            now.replace(second=0, microsecond=0)
         )
+        if next_occurrence is not None and next_occurrence <= now:
+            # Sub minute rules would otherwise come due again immediately.
+            next_occurrence = self.time_interval.after(now)
         return next_occurrence
 
     def __str__(self) -> str:
@@ -280,9 +287,17 @@ class TCTaskManager:
     Handles running all tasks and organizing a priority queue of all
     the tasks in order.
 
+    The schedule is a heap of (to_run_next, seq, name) tuples.  Rescheduling
+    or removing a task doesn't touch the heap, it just gives the task a new
+    seq in scheduled; entries whose seq no longer matches are skipped when
+    they reach the top.
+
     Attributes:
         tasks (dict): A dictionary of all TCTask objects managed by the manager.
         to_delete(list): a list of TCTask object to delete, since.
+        heap (list): (to_run_next, seq, name) entries, ordered by time.
+        scheduled (dict): The seq of the live heap entry for each standby task.
+        wake (asyncio.Event): Set whenever the schedule changes, so run_tasks stops waiting.
     """
 
     # This is about as fast as I can make it.
@@ -298,9 +313,62 @@ class TCTaskManager:
     def __init__(self):
         self.tasks: Dict[str, TCTask] = {}
         self.to_delete = []
-        self.myqueue: AutoRebalancePriorityQueue[TCTaskRef] = (
-            AutoRebalancePriorityQueue()
-        )
+        self.heap: List[Tuple[dt, int, str]] = []
+        self.scheduled: Dict[str, int] = {}
+        self.seq = count()
+        self.wake = asyncio.Event()
+
+    def schedule(self, name: str):
+        """Push a heap entry for task name at its to_run_next, replacing any earlier entry."""
+        seq = next(self.seq)
+        self.scheduled[name] = seq
+        heapq.heappush(self.heap, (self.tasks[name].to_run_next, seq, name))
+        if len(self.heap) > 2 * len(self.scheduled) + 64:
+            self.compact()
+        self.wake.set()
+
+    def compact(self):
+        """Drop every stale entry from the heap."""
+        self.heap = [e for e in self.heap if self.scheduled.get(e[2]) == e[1]]
+        heapq.heapify(self.heap)
+
+    def peek(self) -> Optional[TCTask]:
+        """Get the next task due, dropping stale entries off the top of the heap."""
+        while self.heap:
+            when, seq, name = self.heap[0]
+            task = self.tasks.get(name, None)
+            if task is None or self.scheduled.get(name) != seq:
+                heapq.heappop(self.heap)
+                continue
+            if when != task.to_run_next:
+                # to_run_next was assigned directly, move the entry.
+                heapq.heappop(self.heap)
+                self.schedule(name)
+                continue
+            return task
+        return None
+
+    def launch_due(self) -> Optional[float]:
+        """Start every task that is due.
+
+        Returns:
+            Optional[float]: Seconds until the next task is due, None if nothing is scheduled.
+        """
+        while True:
+            task = self.peek()
+            if task is None:
+                return None
+            gui.DataStore.set("queuenext", task.time_left_shorter())
+            if task.is_running:
+                # It goes back in the heap once it's on standby again.
+                heapq.heappop(self.heap)
+                self.scheduled.pop(task.name, None)
+                continue
+            if not task.can_i_run():
+                return (task.to_run_next - dt.now()).total_seconds()
+            heapq.heappop(self.heap)
+            self.scheduled.pop(task.name, None)
+            asyncio.create_task(task())
 
     @classmethod
     def get_task(cls, name):
@@ -345,7 +413,8 @@ class TCTaskManager:
         manager = cls.get_instance()
         if name in manager.tasks:
             manager.tasks[name].to_run_next = dat
-            manager.myqueue.rebalance()
+            if name in manager.scheduled:
+                manager.schedule(name)
             return True
         return False
 
@@ -363,7 +432,8 @@ class TCTaskManager:
         if name in manager.tasks:
             manager.tasks[name].time_interval = new_rrule
             manager.tasks[name].to_run_next = manager.tasks[name].next_run()
-            manager.myqueue.rebalance()
+            if name in manager.scheduled:
+                manager.schedule(name)
             return manager.tasks[name].to_run_next
         return False
 
@@ -393,8 +463,9 @@ class TCTaskManager:
         """
         manager = cls.get_instance()
         if name in manager.tasks:
-            logs.warning(f"removing task", name)
+            logs.warning(f"removing task %s", name)
             manager.tasks.pop(name)
+            manager.scheduled.pop(name, None)
             return True
         return False
 
@@ -407,6 +478,7 @@ class TCTaskManager:
         """
         manager = cls.get_instance()
         manager.to_delete.append(name)
+        manager.wake.set()
 
     @classmethod
     def set_running(cls, name):
@@ -432,7 +504,7 @@ class TCTaskManager:
         logs.warning(f"%s is standby", name)
         to_add = manager.tasks[name]
         if ((to_add.status != "standby")) and (not (name in manager.to_delete)):
-            manager.myqueue.put(to_add.get_ref())
+            manager.schedule(name)
             to_add.status = "standby"
         # manager.to_delete.append(name)
 
@@ -486,10 +558,11 @@ class TCTaskManager:
     @staticmethod
     async def run_tasks():
         """
-        Check for the tasks that can be run at this specific time, and runs them.
+        Run every task that is due, then wait until the next task is due
+        or the schedule changes.
         """
-        # Check each task to see if it's time to run
         manager = TCTaskManager.get_instance()
+        manager.wake.clear()
         for name in manager.to_delete:
             task = manager.tasks.get(name, None)
             if task is None:
@@ -498,15 +571,22 @@ class TCTaskManager:
                 TCTaskManager.remove_task(task.name)
         manager.to_delete = []
 
-        while not manager.myqueue.empty():
-            gui.DataStore.set(
-                "queuenext", manager.myqueue.queue[0].get_task().time_left_shorter()
-            )
-            if manager.myqueue.queue[0].get_task().can_i_run():
-                task = manager.myqueue.get().get_task()
-                asyncio.create_task(task())
-            else:
-                break
+        delay = manager.launch_due()
+        if delay is None or delay > MAX_SLEEP_SECONDS:
+            delay = MAX_SLEEP_SECONDS
+        try:
+            await asyncio.wait_for(manager.wake.wait(), timeout=max(delay, 0))
+        except asyncio.TimeoutError:
+            pass
 
-        # Wait for 1 second before checking again
-        await asyncio.sleep(1)
+    @staticmethod
+    async def run_forever():
+        """Keep running tasks as they come due, until cancelled."""
+        while True:
+            try:
+                await TCTaskManager.run_tasks()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logs.error("Task scheduler error", exc_info=e)
+                await asyncio.sleep(1)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime as dt, timedelta
+from typing import Any, Dict, List
+
+from dateutil.rrule import DAILY, rrule
+
+from utility.debug import percentile
+
+from .TCTasks import TCTask, TCTaskManager
+
+"""
+Stress test for the TCTaskManager scheduler.
+
+Schedules a large number of one shot tasks named like TCGuildTask entries
+across a short window, runs the scheduler until they have all fired, and
+reports how late each one started along with the CPU time used.  It swaps in
+a fresh TCTaskManager for the duration, so run it outside the live bot:
+
+    python -m bot.Tasks.scheduler_benchmark
+"""
+
+
+async def scheduler_benchmark(
+    count: int = 50000, window: float = 10.0
+) -> Dict[str, Any]:
+    """Time count tasks spread evenly over the next window seconds.
+
+    Args:
+        count (int, optional): Number of tasks. Defaults to 50000.
+        window (float, optional): Seconds to spread the tasks over. Defaults to 10.0.
+
+    Returns:
+        Dict[str, Any]: Lateness percentiles in milliseconds, wall and cpu seconds.
+    """
+    previous = TCTaskManager._instance
+    TCTaskManager._instance = TCTaskManager()
+    tclogs = logging.getLogger("TCLogger")
+    was_disabled = tclogs.disabled
+    tclogs.disabled = True
+
+    lateness: List[float] = []
+    done = asyncio.Event()
+    start = dt.now() + timedelta(seconds=1)
+    # A recent dtstart keeps rrule.after cheap when each task finishes.
+    interval = rrule(freq=DAILY, dtstart=start.replace(second=0, microsecond=0))
+
+    def make_job(when: dt):
+        async def job():
+            lateness.append((dt.now() - when).total_seconds())
+            if len(lateness) >= count:
+                done.set()
+
+        return job
+
+    try:
+        for i in range(count):
+            when = start + timedelta(seconds=random.uniform(0, window))
+            # Same naming scheme as TCGuildTask.name
+            task = TCTask(f"{1000000 + i}_BENCH", interval, when, run_number=1)
+            task.assign_wrapper(make_job(when))
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        runner = asyncio.create_task(TCTaskManager.run_forever())
+        await asyncio.wait_for(done.wait(), timeout=window + 120)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        runner.cancel()
+    finally:
+        TCTaskManager._instance = previous
+        tclogs.disabled = was_disabled
+
+    def pct(p: float) -> float:
+        return round(percentile(lateness, p) * 1000, 3)
+
+    return {
+        "tasks": count,
+        "p50_ms": pct(0.5),
+        "p99_ms": pct(0.99),
+        "max_ms": pct(1.0),
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+    }
+
+
+if __name__ == "__main__":
+    print(asyncio.run(scheduler_benchmark()))
@@ -134,6 +134,7 @@ class TCBot(
         self.loaded_plugins: Dict[str, Tuple[str, Optional[str]]] = {}
         self.default_error = self.on_command_error
         self.bot_ready = False
+        self.task_scheduler: Optional[asyncio.Task] = None
 
     async def database_on(self):
         """turn the database on."""
@@ -204,6 +205,7 @@ class TCBot(
             gui.gprint("sleeping for ", seconds_until_next_minute)
 
             await asyncio.sleep(seconds_until_next_minute)
+            self.task_scheduler = asyncio.create_task(TCTaskManager.run_forever())
             self.check_tc_tasks.start()
 
             # Start the coroutine
@@ -217,6 +219,8 @@ class TCBot(
         self.post_queue_message.cancel()
         self.delete_queue_message.cancel()
         self.check_tc_tasks.cancel()
+        if self.task_scheduler:
+            self.task_scheduler.cancel()
         self.status_ticker.cancel()
         del self.jsenv
         # close the gui
@@ -491,8 +495,7 @@ class TCBot(
 
     @tasks.loop(seconds=20.0)
     async def check_tc_tasks(self):
-        """run all TcTaskManager Tasks, fires every 20 seconds."""
-        await TCTaskManager.run_tasks()
+        """update the TcTaskManager status panel, fires every 20 seconds."""
         stat, panel = TCTaskManager.get_task_status()
         gui.DataStore.set("schedule", panel)
         self.add_act("taskstatus", stat)
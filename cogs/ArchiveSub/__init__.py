@@ -3,10 +3,12 @@ from .archive_database import (
     ChannelSep,
     ArchivedRPMessage,
     ArchivedRPFile,
+    ArchivedRPBlob,
     HistoryMakers,
     ChannelArchiveStatus,
 )
-from .collect_group_index import iterate_backlog, do_group
+from .archive_search import ArchiveSearch
+from .collect_group_index import iterate_backlog, do_group, StreamingGrouper
 from .lazy_archive import lazy_archive, LazyContext
 from .historycollect import (
     collect_server_history,
@@ -332,7 +332,8 @@ class ArchiveCompiler:
         files = []
         for attach in amess.list_files():
             this_file = attach.to_file()
-            files.append(this_file)
+            if this_file is not None:
+                files.append(this_file)
         pager = commands.Paginator(prefix="", suffix="")
 
         if len(c) > 2000:
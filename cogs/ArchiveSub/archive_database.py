@@ -20,10 +20,10 @@ from sqlalchemy import (
     func,
 )
 from sqlalchemy import LargeBinary, ForeignKey, PrimaryKeyConstraint, insert, distinct
-from sqlalchemy.orm import relationship, column_property
+from sqlalchemy.orm import relationship, column_property, deferred
 from sqlalchemy.orm import Session
 from sqlalchemy.orm import aliased
-from database import DatabaseSingleton, AwareDateTime, add_or_update_all
+from database import DatabaseSingleton, AwareDateTime, upsert_all
 from sqlalchemy import select, event, exc
 
 from sqlalchemy.orm import declarative_base
@@ -37,6 +37,8 @@ context of the ServerRPArchive Cog and it's ArchiveSub subpackage.
 """
 from assetloader import AssetLookup
 from utility import hash_string
+from .attachment_fetch import AttachmentFetcher, archivable_attachments
+from .blob_store import BlobStore
 
 ArchiveBase = declarative_base(name="Archive System Base")
 
@@ -180,6 +182,14 @@ class ChannelArchiveStatus(ArchiveBase):
             self.last_message_time = date
         self.latest_archive_time = date
 
+    def checkpoint(self, message_id: int):
+        """Record message_id as the last message read from this channel.
+
+        Collection resumes after this message, so only call it once every
+        message up to message_id has been stored or skipped."""
+        if self.latest_archive_id is None or message_id > self.latest_archive_id:
+            self.latest_archive_id = message_id
+
     def mod_active(self, incr):
         self.active_count += incr
 
@@ -703,6 +713,7 @@ class ArchivedRPMessage(ArchiveBase):
         for key, value in kwargs.items():
             setattr(profile, key, value)
         session.commit()
+        return profile
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
@@ -963,10 +974,16 @@ class ArchivedRPMessage(ArchiveBase):
 
     def remove_file(self, server_id, filename):
         session = DatabaseSingleton.get_session()
+        if self.server_id != server_id:
+            return False
         for file in self.files:
-            if file.server_id == server_id and file.filename == filename:
+            if file.filename == filename:
+                content_hash = file.content_hash
                 session.delete(file)
                 session.commit()
+                if content_hash:
+                    ArchivedRPBlob.recount([content_hash])
+                    ArchivedRPBlob.prune()
                 return True
         return False
 
@@ -988,44 +1005,28 @@ class ArchivedRPMessage(ArchiveBase):
 
     @staticmethod
     def search_messages(
-        server_id: int, substring: str, **kwargs
+        server_id: int, substring: str, limit: int = 100, **kwargs
     ) -> List["ArchivedRPMessage"]:
         """
         Search messages in the database.
 
-        This method searches for messages in the database that contains the given substring.
-        Optionally, it also allows for searching by other attributes of the 'ArchivedRPMessage' class.
+        This method searches the ArchivedRPSearch full text index for messages whose content
+        or embed matches every word in substring, best matches first.
 
         Args:
             server_id (int): Identifier for the server where the message was sent.
-            substring (str): Substring to be searched in content of the messages.
-            **kwargs: Arbitrary keyword arguments for additional search criteria.
+            substring (str): Words to be searched in content of the messages.
+            limit (int, optional): Maximum number of messages to return. Defaults to 100.
+            **kwargs: author, channel, after, or before filters, see ArchiveSearch.search.
 
         Returns:
-            List['ArchivedRPMessage']: List of messages containing the substring in the specified server.
+            List['ArchivedRPMessage']: List of matching messages in the specified server.
 
         """
-        session: Session = DatabaseSingleton.get_session()
-        query = (
-            session.query(ArchivedRPMessage)
-            .join(ArchivedRPEmbed, isouter=True)
-            .filter(
-                (ArchivedRPMessage.server_id == server_id)
-                & (
-                    or_(
-                        func.lower(ArchivedRPMessage.content).contains(
-                            func.lower(substring)
-                        ),
-                        func.lower(ArchivedRPEmbed.embed_json).contains(
-                            func.lower(substring)
-                        ),
-                    )
-                )
-            )
-        )
-        for key, value in kwargs.items():
-            query = query.filter(getattr(ArchivedRPMessage, key) == value)
-        return query.all()
+        from .archive_search import ArchiveSearch
+
+        results = ArchiveSearch.search(server_id, substring, per_page=limit, **kwargs)
+        return [message for message, _, _ in results]
 
     def simplerep(self):
         return f"({self.message_id}: from {self.get_chan_sep()}, on <t:{int(self.created_at.timestamp())}:F>)"
@@ -1044,21 +1045,165 @@ class ArchivedRPFile(ArchiveBase):
     )
     file_number = Column(Integer)
     filename = Column(String)
-    bytes = Column(LargeBinary)
+    # Only set on files archived before the blob store, see migrate_to_blob_store.
+    bytes = deferred(Column(LargeBinary))
+    content_hash = Column(String, nullable=True)
+    size = Column(Integer, nullable=True)
     description = Column(String)
     spoiler = Column(Boolean, default=False)
     # archived_rp_message = relationship('ArchivedRPMessage', backref='files')
 
     __table_args__ = (PrimaryKeyConstraint("message_id", "file_number"),)
 
-    def to_file(self):
+    def to_file(self) -> Optional[discord.File]:
+        """Get a discord.File for this attachment, or None if its blob is missing.
+
+        Blob store files are streamed from disk when the file is sent,
+        rather than read into memory up front."""
+        if self.content_hash:
+            if not BlobStore.exists(self.content_hash):
+                gui.gprint(
+                    f"{self.filename} on message {self.message_id} is missing "
+                    f"blob {self.content_hash}"
+                )
+                return None
+            fp = BlobStore.path(self.content_hash)
+        else:
+            fp = io.BytesIO(self.bytes)
         return discord.File(
-            io.BytesIO(self.bytes),
+            fp,
             filename=self.filename,
             spoiler=self.spoiler,
             description=self.description,
         )
 
+    @staticmethod
+    def count_unmigrated() -> int:
+        """Count files that still keep their bytes inside the database."""
+        session: Session = DatabaseSingleton.get_session()
+        return (
+            session.query(func.count(ArchivedRPFile.message_id))
+            .filter(
+                (ArchivedRPFile.content_hash == None) & (ArchivedRPFile.bytes != None)
+            )
+            .scalar()
+        )
+
+    @staticmethod
+    def migrate_to_blob_store(batch_size: int = 200) -> int:
+        """Move one batch of in database file bytes to the blob store.
+
+        Args:
+            batch_size (int, optional): Files to move per call. Defaults to 200.
+
+        Returns:
+            int: Number of files moved.  0 once nothing is left to migrate.
+        """
+        session: Session = DatabaseSingleton.get_session()
+        stmt = (
+            select(
+                ArchivedRPFile.message_id,
+                ArchivedRPFile.file_number,
+                ArchivedRPFile.bytes,
+            )
+            .filter(
+                (ArchivedRPFile.content_hash == None) & (ArchivedRPFile.bytes != None)
+            )
+            .limit(batch_size)
+        )
+        updates, hashes = [], set()
+        for message_id, file_number, data in session.execute(stmt).all():
+            content_hash, size = BlobStore.put(data)
+            hashes.add(content_hash)
+            updates.append(
+                {
+                    "message_id": message_id,
+                    "file_number": file_number,
+                    "content_hash": content_hash,
+                    "size": size,
+                    "bytes": None,
+                }
+            )
+        if updates:
+            session.execute(update(ArchivedRPFile), updates)
+            session.commit()
+            ArchivedRPBlob.recount(hashes)
+        return len(updates)
+
+
+class ArchivedRPBlob(ArchiveBase):
+    """Reference count for every file in the BlobStore."""
+
+    __tablename__ = "ArchivedRPBlobs"
+
+    content_hash = Column(String, primary_key=True)
+    size = Column(Integer, default=0)
+    refcount = Column(Integer, default=0)
+
+    @staticmethod
+    def recount(content_hashes=None):
+        """Set the refcount of each hash to the number of ArchivedRPFiles using it.
+
+        Args:
+            content_hashes (optional): Hashes to recount.  Every blob is recounted if None.
+        """
+        session: Session = DatabaseSingleton.get_session()
+        if content_hashes is not None:
+            content_hashes = [h for h in content_hashes if h]
+            if not content_hashes:
+                return
+            upsert_all(
+                session,
+                ArchivedRPBlob,
+                [{"content_hash": h, "refcount": 0} for h in content_hashes],
+                update=False,
+            )
+        refs = (
+            select(func.count(ArchivedRPFile.message_id))
+            .where(ArchivedRPFile.content_hash == ArchivedRPBlob.content_hash)
+            .scalar_subquery()
+        )
+        size = (
+            select(func.max(ArchivedRPFile.size))
+            .where(ArchivedRPFile.content_hash == ArchivedRPBlob.content_hash)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(ArchivedRPBlob)
+            .values(refcount=refs, size=func.coalesce(size, ArchivedRPBlob.size))
+            .execution_options(synchronize_session=False)
+        )
+        if content_hashes is not None:
+            stmt = stmt.where(ArchivedRPBlob.content_hash.in_(content_hashes))
+        session.execute(stmt)
+        session.commit()
+
+    @staticmethod
+    def prune() -> int:
+        """Delete every blob nothing refers to anymore, on disk and in the table.
+
+        Blobs put within BlobStore's grace period are kept, since the files
+        using them may not be committed and counted yet.
+
+        Returns:
+            int: Number of blobs removed.
+        """
+        session: Session = DatabaseSingleton.get_session()
+        unused = (
+            session.query(ArchivedRPBlob.content_hash)
+            .filter(ArchivedRPBlob.refcount <= 0)
+            .all()
+        )
+        hashes = [h for (h,) in unused if BlobStore.delete_if_stale(h)]
+        if hashes:
+            session.execute(
+                delete(ArchivedRPBlob)
+                .where(ArchivedRPBlob.content_hash.in_(hashes))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return len(hashes)
+
 
 class ArchivedRPEmbed(ArchiveBase):
     """represents (one) embed saved in a JSON string."""
@@ -1092,6 +1237,19 @@ def create_archived_rp_file(arpm, file_num, vekwargs):
     return None
 
 
+def attachment_file_kwargs(attach: discord.Attachment, data: bytes) -> dict:
+    """Store a downloaded attachment in the BlobStore and get its ArchivedRPFile fields."""
+    content_hash, size = BlobStore.put(data)
+    return {
+        "filename": attach.filename,
+        "bytes": None,
+        "content_hash": content_hash,
+        "size": size,
+        "description": attach.description,
+        "spoiler": attach.is_spoiler(),
+    }
+
+
 def create_archived_rp_embed(arpm, embed):
     embed_dict = embed.to_dict()
     json_string = json.dumps(embed_dict)
@@ -1155,7 +1313,6 @@ def create_history_pickle_dict(message, over=None):
 class HistoryMakers:
     @staticmethod
     async def get_history_message(thisMessagev, active=False):
-        fsize = 0
         session = DatabaseSingleton.get_session()
         thisMessage = thisMessagev
         over = None
@@ -1192,34 +1349,31 @@ class HistoryMakers:
                 archived_rp_embeds.append(embedv)
                 hasembed = True
 
-        for attach in thisMessage.attachments:
-            if "image" in attach.content_type:
-                if attach.size + fsize < 7000000:
-                    count += 1
-                    fd = await attach.to_file()
-                    bytes = await attach.read()
-                    fdv = {
-                        "filename": fd.filename,
-                        "bytes": bytes,
-                        "description": fd.description,
-                        "spoiler": fd.spoiler,
-                    }
-                    gui.dprint(ms, fdv)
-                    file = create_archived_rp_file(ms, count, vekwargs=fdv)
-                    if file != None:
-                        archived_rp_files.append(file)
-                        # session.add(file)
-                    fsize += attach.size
-        add_or_update_all(session, ArchivedRPMessage, [ms])
-        add_or_update_all(session, ArchivedRPEmbed, archived_rp_embeds)
-        add_or_update_all(session, ArchivedRPFile, archived_rp_files)
+        for attach in archivable_attachments(thisMessage):
+            count += 1
+            fdv = attachment_file_kwargs(attach, await attach.read())
+            file = create_archived_rp_file(ms, count, vekwargs=fdv)
+            if file != None:
+                archived_rp_files.append(file)
+        # ms was already stored by add_or_update.
+        upsert_all(session, ArchivedRPEmbed, archived_rp_embeds, update=False)
+        upsert_all(session, ArchivedRPFile, archived_rp_files, update=False)
 
         session.commit()
+        ArchivedRPBlob.recount({f.content_hash for f in archived_rp_files})
         return ms
 
     @staticmethod
-    async def get_history_message_list(messages):
-        """add list of history messages to result."""
+    async def get_history_message_list(
+        messages, fetcher: Optional[AttachmentFetcher] = None
+    ):
+        """add list of history messages to result.
+
+        Args:
+            messages: discord messages, or dictionaries with the message under "m".
+            fetcher (AttachmentFetcher, optional): Download stage the attachments
+                were already queued in.  Attachments are read directly if None.
+        """
         session = DatabaseSingleton.get_session()
         archived_rp_messages = []
         archived_rp_embeds = []
@@ -1243,34 +1397,31 @@ class HistoryMakers:
                     archived_rp_embeds.append(embedv)
                     hasembed = True
 
-            filecount, fsize = 0, 0
-            for attach in thisMessage.attachments:
+            filecount = 0
+            for attach in archivable_attachments(thisMessage):
                 try:
-                    if "image" in attach.content_type:
-                        if attach.size + fsize < 7000000:
-                            filecount += 1
-                            fd = await attach.to_file()
-                            bytes = await attach.read()
-                            fdv = {
-                                "filename": fd.filename,
-                                "bytes": bytes,
-                                "description": fd.description,
-                                "spoiler": fd.spoiler,
-                            }
-                            rps = create_archived_rp_file(ms, filecount, vekwargs=fdv)
-                            archived_rp_files.append(rps)
-                            fsize += attach.size
+                    if fetcher is not None:
+                        data = await fetcher.get(attach)
+                    else:
+                        data = await attach.read()
+                    filecount += 1
+                    fdv = attachment_file_kwargs(attach, data)
+                    rps = create_archived_rp_file(ms, filecount, vekwargs=fdv)
+                    archived_rp_files.append(rps)
                 except Exception as e:
                     gui.dprint(e)
             if thisMessage.content.isspace() and not filecount <= 0 and not hasembed:
                 # Skip if no content or file.
                 continue
             archived_rp_messages.append(ms)
-        add_or_update_all(session, ArchivedRPMessage, archived_rp_messages)
-        add_or_update_all(session, ArchivedRPEmbed, archived_rp_embeds)
-        add_or_update_all(session, ArchivedRPFile, archived_rp_files)
+        # Existing rows are left alone, so regrabbing history never
+        # clears a message's channel_sep_id or posted_url.
+        upsert_all(session, ArchivedRPMessage, archived_rp_messages, update=False)
+        upsert_all(session, ArchivedRPEmbed, archived_rp_embeds, update=False)
+        upsert_all(session, ArchivedRPFile, archived_rp_files, update=False)
 
         session.commit()
+        ArchivedRPBlob.recount({f.content_hash for f in archived_rp_files})
         return archived_rp_messages
 
     @staticmethod
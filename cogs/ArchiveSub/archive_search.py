@@ -0,0 +1,260 @@
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import gui
+from sqlalchemy import column, event, func, literal_column, select, table, text
+from sqlalchemy.orm import Session
+
+from database import DatabaseSingleton
+from .archive_database import ArchiveBase, ArchivedRPMessage
+
+"""
+Full text search for the RP archive.
+
+ArchivedRPSearch is an SQLite FTS5 table with one row per archived message.
+Its rowid is the message_id and it stores the server_id, so hits are joined
+back to ArchivedRPMessages on (message_id, server_id).  ArchivedRPMessages'
+own rowids can't be used, since VACUUM may renumber them.  Triggers on
+ArchivedRPMessages and ArchivedRPEmbed keep it in sync, so nothing in the
+insert path needs to know about it.  Servers archived before the index
+existed need a single backfill.
+"""
+
+SEARCH_TABLE = "ArchivedRPSearch"
+
+SEARCH_TRIGGERS = ["ai", "ad", "au", "embed_ai", "embed_au", "embed_ad"]
+
+SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS "{SEARCH_TABLE}"
+    USING fts5(content, embed_text, server_id UNINDEXED,
+    tokenize='unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_ai"
+    AFTER INSERT ON "ArchivedRPMessages" BEGIN
+        DELETE FROM "{SEARCH_TABLE}" WHERE rowid = new.message_id;
+        INSERT INTO "{SEARCH_TABLE}"(rowid, content, embed_text, server_id) VALUES (
+            new.message_id,
+            COALESCE(new.content, ''),
+            COALESCE((SELECT embed_json FROM "ArchivedRPEmbed" WHERE message_id = new.message_id), ''),
+            new.server_id
+        );
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_ad"
+    AFTER DELETE ON "ArchivedRPMessages" BEGIN
+        DELETE FROM "{SEARCH_TABLE}" WHERE rowid = old.message_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_au"
+    AFTER UPDATE OF content ON "ArchivedRPMessages" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET content = COALESCE(new.content, '')
+        WHERE rowid = old.message_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_embed_ai"
+    AFTER INSERT ON "ArchivedRPEmbed" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET embed_text = COALESCE(new.embed_json, '')
+        WHERE rowid = new.message_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_embed_au"
+    AFTER UPDATE OF embed_json ON "ArchivedRPEmbed" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET embed_text = COALESCE(new.embed_json, '')
+        WHERE rowid = new.message_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS "{SEARCH_TABLE}_embed_ad"
+    AFTER DELETE ON "ArchivedRPEmbed" BEGIN
+        UPDATE "{SEARCH_TABLE}" SET embed_text = ''
+        WHERE rowid = old.message_id;
+    END""",
+]
+
+REINDEX_ALL = f"""INSERT INTO "{SEARCH_TABLE}"(rowid, content, embed_text, server_id)
+    SELECT m.message_id, COALESCE(m.content, ''), COALESCE(e.embed_json, ''), m.server_id
+    FROM "ArchivedRPMessages" m
+    LEFT JOIN "ArchivedRPEmbed" e ON e.message_id = m.message_id"""
+
+
+@event.listens_for(ArchiveBase.metadata, "after_create")
+def create_search_index(target, connection, **kw):
+    """Create the search table and triggers every time the archive tables are synced.
+
+    A search table from before server_id was stored is keyed by
+    ArchivedRPMessages rowids, so it's dropped and built again from scratch.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    columns = [
+        row[1]
+        for row in connection.exec_driver_sql(
+            f"PRAGMA table_info(\"{SEARCH_TABLE}\")"
+        ).fetchall()
+    ]
+    rebuild = bool(columns) and "server_id" not in columns
+    if rebuild:
+        gui.gprint("search index: rebuilding, it was keyed by rowid")
+        for name in SEARCH_TRIGGERS:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS "{SEARCH_TABLE}_{name}"')
+        connection.exec_driver_sql(f'DROP TABLE "{SEARCH_TABLE}"')
+    for stmt in SEARCH_DDL:
+        connection.exec_driver_sql(stmt)
+    if rebuild:
+        connection.exec_driver_sql(REINDEX_ALL)
+
+
+search_table = table(SEARCH_TABLE, column("rowid"), column("server_id"))
+# Content matches count for twice as much as embed matches.
+rank_col = literal_column(f'bm25("{SEARCH_TABLE}", 1.0, 0.5)')
+snippet_col = literal_column(f"snippet(\"{SEARCH_TABLE}\", -1, '**', '**', '...', 16)")
+
+
+def to_match_query(query: str) -> str:
+    """Turn user input into an FTS5 query.
+
+    Every word becomes a quoted prefix term, so punctuation in the input
+    can't be read as FTS5 syntax and all words have to match."""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+class ArchiveSearch:
+    @staticmethod
+    def _filtered(
+        stmt,
+        server_id: int,
+        match: str,
+        author: Optional[str] = None,
+        channel: Optional[str] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+    ):
+        stmt = (
+            stmt.join(
+                search_table,
+                (search_table.c.rowid == ArchivedRPMessage.message_id)
+                & (search_table.c.server_id == ArchivedRPMessage.server_id),
+            )
+            .where(text(f'"{SEARCH_TABLE}" MATCH :match').bindparams(match=match))
+            .where(ArchivedRPMessage.server_id == server_id)
+        )
+        if author is not None:
+            stmt = stmt.where(ArchivedRPMessage.author == author)
+        if channel is not None:
+            stmt = stmt.where(
+                (ArchivedRPMessage.channel == channel)
+                | (ArchivedRPMessage.thread == channel)
+            )
+        if after is not None:
+            stmt = stmt.where(ArchivedRPMessage.created_at >= after)
+        if before is not None:
+            stmt = stmt.where(ArchivedRPMessage.created_at < before)
+        return stmt
+
+    @staticmethod
+    def search(
+        server_id: int,
+        query: str,
+        author: Optional[str] = None,
+        channel: Optional[str] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        page: int = 0,
+        per_page: int = 25,
+    ) -> List[Tuple[ArchivedRPMessage, str, float]]:
+        """Search the archived messages of a server, best matches first.
+
+        Args:
+            server_id (int): The ID of the server.
+            query (str): Words to look for in message content or embeds.
+            author (str, optional): Only return messages by this author.
+            channel (str, optional): Only return messages from this channel or thread.
+            after (datetime, optional): Only return messages sent on or after this time.
+            before (datetime, optional): Only return messages sent before this time.
+            page (int, optional): Zero based page of results. Defaults to 0.
+            per_page (int, optional): Results per page. Defaults to 25.
+
+        Returns:
+            List[Tuple[ArchivedRPMessage, str, float]]: Each message, a highlighted snippet, and its bm25 rank.
+        """
+        match = to_match_query(query)
+        if not match:
+            return []
+        session: Session = DatabaseSingleton.get_session()
+        stmt = select(ArchivedRPMessage, snippet_col, rank_col)
+        stmt = ArchiveSearch._filtered(
+            stmt, server_id, match, author, channel, after, before
+        )
+        stmt = stmt.order_by(rank_col).limit(per_page).offset(page * per_page)
+        return [tuple(row) for row in session.execute(stmt).all()]
+
+    @staticmethod
+    def count(
+        server_id: int,
+        query: str,
+        author: Optional[str] = None,
+        channel: Optional[str] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+    ) -> int:
+        """Count the results search would return over all pages."""
+        match = to_match_query(query)
+        if not match:
+            return 0
+        session: Session = DatabaseSingleton.get_session()
+        stmt = select(func.count(ArchivedRPMessage.message_id))
+        stmt = ArchiveSearch._filtered(
+            stmt, server_id, match, author, channel, after, before
+        )
+        return session.execute(stmt).scalar()
+
+    @staticmethod
+    def backfill_batch(
+        server_id: int, after_message_id: int = 0, batch_size: int = 5000
+    ) -> Optional[int]:
+        """(Re)index one batch of a server's archived messages.
+
+        Args:
+            server_id (int): The ID of the server.
+            after_message_id (int, optional): Start after this message id. Defaults to 0.
+            batch_size (int, optional): Messages to index. Defaults to 5000.
+
+        Returns:
+            Optional[int]: The last message id indexed, pass it back in for the next batch.
+                None once every message is indexed.
+        """
+        session: Session = DatabaseSingleton.get_session()
+        message_ids = (
+            session.execute(
+                text(
+                    'SELECT message_id FROM "ArchivedRPMessages" '
+                    "WHERE server_id = :sid AND message_id > :after "
+                    "ORDER BY message_id LIMIT :lim"
+                ),
+                {"sid": server_id, "after": after_message_id, "lim": batch_size},
+            )
+            .scalars()
+            .all()
+        )
+        if not message_ids:
+            return None
+        params = {"sid": server_id, "first": message_ids[0], "last": message_ids[-1]}
+        session.execute(
+            text(
+                f'DELETE FROM "{SEARCH_TABLE}" WHERE rowid IN ('
+                'SELECT message_id FROM "ArchivedRPMessages" '
+                "WHERE server_id = :sid AND message_id BETWEEN :first AND :last)"
+            ),
+            params,
+        )
+        session.execute(
+            text(
+                f'INSERT INTO "{SEARCH_TABLE}"(rowid, content, embed_text, server_id) '
+                "SELECT m.message_id, COALESCE(m.content, ''), "
+                "COALESCE(e.embed_json, ''), m.server_id "
+                'FROM "ArchivedRPMessages" m '
+                'LEFT JOIN "ArchivedRPEmbed" e ON e.message_id = m.message_id '
+                "WHERE m.server_id = :sid AND m.message_id BETWEEN :first AND :last"
+            ),
+            params,
+        )
+        session.commit()
+        gui.dprint(
+            f"search index: {server_id} indexed up to message {message_ids[-1]}"
+        )
+        return message_ids[-1]
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import discord
+import gui
+
+"""
+Downloads image attachments for archived messages.
+
+Downloads are started as soon as iter_hist_messages picks up a message, so they
+overlap with paging through the channel history.  Each attachment is read exactly
+once through the bot's own http session, which keeps its connections to the
+discord CDN alive between requests.
+"""
+
+MAX_ATTACH_SIZE = 7000000
+
+
+def archivable_attachments(message: discord.Message) -> List[discord.Attachment]:
+    """Get the image attachments of message that will be stored in the archive.
+
+    Args:
+        message (discord.Message): The message to check.
+
+    Returns:
+        List[discord.Attachment]: Attachments that fit in the per message size limit.
+    """
+    out, fsize = [], 0
+    for attach in message.attachments:
+        if attach.content_type and "image" in attach.content_type:
+            if attach.size + fsize < MAX_ATTACH_SIZE:
+                out.append(attach)
+                fsize += attach.size
+    return out
+
+
+class AttachmentFetcher:
+    """Bounded concurrency download stage for archive attachments.
+
+    Args:
+        limit (int, optional): Maximum number of simultaneous downloads. Defaults to 6.
+    """
+
+    def __init__(self, limit: int = 6):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.pending: Dict[int, asyncio.Task] = {}
+        self.count = 0
+        self.failed = 0
+        self.total_bytes = 0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+
+    async def _download(self, attach: discord.Attachment) -> bytes:
+        async with self.semaphore:
+            if self.first_start is None:
+                self.first_start = time.monotonic()
+            try:
+                data = await attach.read()
+            except Exception:
+                self.failed += 1
+                raise
+            self.count += 1
+            self.total_bytes += len(data)
+            self.last_end = time.monotonic()
+            return data
+
+    def prefetch(self, message: discord.Message):
+        """Start downloading every archivable attachment of message in the background."""
+        for attach in archivable_attachments(message):
+            if attach.id not in self.pending:
+                self.pending[attach.id] = asyncio.create_task(self._download(attach))
+
+    async def get(self, attach: discord.Attachment) -> bytes:
+        """Get the bytes of attach, waiting on the prefetch task if there is one."""
+        task = self.pending.pop(attach.id, None)
+        if task is None:
+            return await self._download(attach)
+        return await task
+
+    def discard(self, messages: List[discord.Message]):
+        """Cancel the downloads queued for messages that won't be stored."""
+        for message in messages:
+            for attach in message.attachments:
+                task = self.pending.pop(attach.id, None)
+                if task is not None:
+                    task.cancel()
+
+    def cancel_all(self):
+        """Cancel every download that was never collected."""
+        for task in self.pending.values():
+            task.cancel()
+        if self.pending:
+            gui.dprint(f"cancelled {len(self.pending)} attachment downloads")
+        self.pending.clear()
+
+    def throughput(self) -> float:
+        """Average download rate in bytes per second."""
+        if self.first_start is None or self.last_end is None:
+            return 0.0
+        elapsed = self.last_end - self.first_start
+        if elapsed <= 0:
+            return 0.0
+        return self.total_bytes / elapsed
+
+    def status_string(self) -> str:
+        mb = self.total_bytes / 1048576
+        rate = self.throughput() / 1048576
+        text = f"{self.count} files, {mb:.2f} MB at {rate:.2f} MB/s"
+        if self.pending:
+            text += f", {len(self.pending)} queued"
+        if self.failed:
+            text += f", {self.failed} failed"
+        return text
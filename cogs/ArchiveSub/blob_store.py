@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Tuple
+
+import gui
+
+"""
+Content addressed storage for archived attachments.
+
+Files are named after the sha256 of their contents and sharded into
+sub directories by the first two hex characters, so the same image
+uploaded twice is only ever written to disk once.
+
+A blob's file is written, or its mtime refreshed if it's already there,
+before the ArchivedRPFile row that uses it is committed and counted.  So
+prune leaves alone any blob put within the last PRUNE_GRACE_SECONDS,
+even if its count is still 0.
+"""
+
+PRUNE_GRACE_SECONDS = 3600.0
+
+
+class BlobStore:
+    root = "./saveData/archive_blobs"
+    # Held by put and delete_if_stale, so a blob can't be checked as stale
+    # and then put again before it's removed.
+    lock = threading.Lock()
+
+    @classmethod
+    def path(cls, content_hash: str) -> str:
+        """Get the path on disk for content_hash."""
+        return os.path.join(cls.root, content_hash[:2], content_hash)
+
+    @classmethod
+    def exists(cls, content_hash: str) -> bool:
+        return os.path.exists(cls.path(content_hash))
+
+    @classmethod
+    def put(cls, data: bytes) -> Tuple[str, int]:
+        """Store data, if it isn't stored already.
+
+        Args:
+            data (bytes): file contents.
+
+        Returns:
+            Tuple[str, int]: The content hash and size of data.
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        target = cls.path(content_hash)
+        with cls.lock:
+            if os.path.exists(target):
+                # Put again, so it's recent for prune.
+                os.utime(target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                temp = f"{target}.{os.getpid()}.tmp"
+                with open(temp, "wb") as f:
+                    f.write(data)
+                os.replace(temp, target)
+        return content_hash, len(data)
+
+    @classmethod
+    def read(cls, content_hash: str) -> bytes:
+        with open(cls.path(content_hash), "rb") as f:
+            return f.read()
+
+    @classmethod
+    def delete(cls, content_hash: str) -> bool:
+        """Remove the file for content_hash from disk."""
+        target = cls.path(content_hash)
+        if os.path.exists(target):
+            os.remove(target)
+            return True
+        gui.dprint(f"blob {content_hash} was already gone.")
+        return False
+
+    @classmethod
+    def delete_if_stale(
+        cls, content_hash: str, grace: float = PRUNE_GRACE_SECONDS
+    ) -> bool:
+        """Remove the file for content_hash unless it was put within grace seconds.
+
+        Returns:
+            bool: True if the file is gone, False if it was kept.
+        """
+        with cls.lock:
+            try:
+                if time.time() - os.path.getmtime(cls.path(content_hash)) < grace:
+                    return False
+            except FileNotFoundError:
+                gui.dprint(f"blob {content_hash} was already gone.")
+                return True
+            os.remove(cls.path(content_hash))
+            return True
@@ -1,7 +1,10 @@
 import asyncio
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 import gui
 from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
 from .archive_database import ArchivedRPMessage, ChannelSep, HistoryMakers
 from database import DatabaseSingleton
 from queue import Queue
@@ -92,6 +95,136 @@ async def iterate_backlog(backlog: List[ArchivedRPMessage], group_id: int, count
     return [], group_id
 
 
+class StreamingGrouper:
+    """Assigns channel_sep_ids to ungrouped messages in a single pass.
+
+    Messages are read once in created_at order, in keyset batches of
+    ``batch_size``.  The bucket/author state lives on the grouper, so it
+    carries across batch and window boundaries, and all writes are sent back
+    with bulk executemany statements instead of one UPDATE per message.
+
+    Grouping matches iterate_backlog: buckets are closed whenever a message
+    falls outside the current ``forceinterval`` minute window, which is
+    anchored to the 15 minute mark before the first message of the window.
+    """
+
+    def __init__(self, server_id: int, group_id: int = 0, forceinterval: int = 720):
+        self.server_id = server_id
+        self.group_id = group_id
+        self.forceinterval = forceinterval
+        self.window_end: Optional[datetime] = None
+        self.buckets: Dict[str, int] = {}
+        self.chars: Dict[str, Tuple[str, int]] = {}
+        self.pending_updates: List[Dict[str, Any]] = []
+        self.pending_seps: List[Dict[str, Any]] = []
+        # (created_at, message_id) of the last message fetched.
+        self.last_key: Optional[Tuple[datetime, int]] = None
+        self.processed = 0
+        self.new_seps = 0
+
+    def _start_window(self, created_at: datetime):
+        start_time = created_at - (
+            created_at - datetime.min.replace(tzinfo=timezone.utc)
+        ) % timedelta(minutes=15)
+        self.window_end = start_time + timedelta(minutes=self.forceinterval)
+        self.buckets.clear()
+        self.chars.clear()
+
+    def _new_bucket(self, row, channelind: str) -> int:
+        self.group_id += 1
+        self.buckets[channelind] = self.group_id
+        self.pending_seps.append(
+            {
+                "channel_sep_id": self.group_id,
+                "server_id": row.server_id,
+                "channel": row.channel,
+                "category": row.category,
+                "thread": row.thread,
+                "created_at": row.created_at,
+                "is_forum": row.forum,
+            }
+        )
+        self.new_seps += 1
+        return self.group_id
+
+    def feed(self, row):
+        """Assign a group to one message row."""
+        if self.window_end is None or row.created_at >= self.window_end:
+            self._start_window(row.created_at)
+        channelind = f"{row.category}-{row.channel}-{row.thread}"
+        gid = self.buckets.get(channelind)
+        if gid is not None:
+            last = self.chars.get(row.author, None)
+            if last and last[0] != channelind and last[1] > gid:
+                # The author moved here from a newer bucket, so split.
+                gid = self._new_bucket(row, channelind)
+        else:
+            gid = self._new_bucket(row, channelind)
+        self.chars[row.author] = (channelind, gid)
+        self.pending_updates.append(
+            {
+                "message_id": row.message_id,
+                "server_id": row.server_id,
+                "channel_sep_id": gid,
+            }
+        )
+        self.processed += 1
+
+    def fetch_batch(self, session: Session, batch_size: int):
+        """Get the next batch of ungrouped messages, oldest first.
+
+        Each batch starts after the last message of the one before, so the
+        messages already read aren't sorted and skipped over again.
+        """
+        stmt = (
+            select(
+                ArchivedRPMessage.message_id,
+                ArchivedRPMessage.server_id,
+                ArchivedRPMessage.author,
+                ArchivedRPMessage.category,
+                ArchivedRPMessage.channel,
+                ArchivedRPMessage.thread,
+                ArchivedRPMessage.created_at,
+                ArchivedRPMessage.forum,
+            )
+            .filter(
+                (ArchivedRPMessage.server_id == self.server_id)
+                & (ArchivedRPMessage.channel_sep_id == None)
+            )
+            .order_by(ArchivedRPMessage.created_at, ArchivedRPMessage.message_id)
+            .limit(batch_size)
+        )
+        if self.last_key is not None:
+            # (created_at, message_id) > last_key, written out so created_at
+            # is bound through AwareDateTime.
+            last_created, last_id = self.last_key
+            stmt = stmt.filter(
+                or_(
+                    ArchivedRPMessage.created_at > last_created,
+                    and_(
+                        ArchivedRPMessage.created_at == last_created,
+                        ArchivedRPMessage.message_id > last_id,
+                    ),
+                )
+            )
+        rows = session.execute(stmt).all()
+        if rows:
+            self.last_key = (rows[-1].created_at, rows[-1].message_id)
+        return rows
+
+    def flush(self, session: Session):
+        """Write all pending ChannelSeps and message assignments."""
+        if self.pending_seps:
+            session.execute(
+                sqlite_insert(ChannelSep).on_conflict_do_nothing(),
+                self.pending_seps,
+            )
+            self.pending_seps = []
+        if self.pending_updates:
+            session.execute(update(ArchivedRPMessage), self.pending_updates)
+            self.pending_updates = []
+
+
 async def do_group(
     server_id,
     group_id=0,
@@ -101,25 +234,26 @@ async def do_group(
     ctx=None,
     glimit=999999999,
     upperlim=None,
+    batch_size=2000,
 ):
     """Groups the collected history messages into 'ChannelSep' objects
 
     Args:
         server_id (str): ID of the server
         group_id (int, optional): ID of the group. Defaults to 0.
-        forceinterval (int, optional): Forced interval time in minutes. Defaults to 240.
+        forceinterval (int, optional): Forced interval time in minutes. Defaults to 720.
         withbacklog (int, optional): Time frame for backlog messages in minutes. Defaults to 240.
         maximumwithother (int, optional): Maximum count of messages that can be grouped with others. Defaults to 200.
         ctx (Context, optional): Context passed for operations like sending messages. Defaults to None.
         glimit (int, optional): Group limit count which decides when to split groups. Defaults to 999999999.
         upperlim (_type_, optional): Upper limit to decide group boundaries. Defaults to None.
+        batch_size (int, optional): Number of messages read and written per batch. Defaults to 2000.
 
     Returns:
         tuple: Number of messages grouped and last used group ID.
     """
 
     count = ArchivedRPMessage().count_messages_without_group(server_id)
-    new_list, new_count = [], 0
 
     status_mess = (
         StatusEditMessage(
@@ -131,49 +265,42 @@ async def do_group(
         if ctx
         else None
     )
-    firsttime, now = (
-        datetime.fromtimestamp(0).replace(tzinfo=timezone.utc),
-        datetime.now(),
-    )
-    length, old_group_id = count, group_id
-    stopcount = 0
-    countlim = 2**64
-    while new_count < count:
-        DatabaseSingleton("voc").commit()
-        get_msg_result = ArchivedRPMessage().get_messages_without_group(server_id, 1)
-        thesemessages = ArchivedRPMessage().get_messages_within_minute_interval(
-            server_id, get_msg_result[0].created_at, forceinterval
+    session: Session = DatabaseSingleton.get_session()
+    DatabaseSingleton("voc").commit()
+    grouper = StreamingGrouper(server_id, group_id, forceinterval)
+    total_time = 0.0
+    while True:
+        with Timer() as timer:
+            rows = grouper.fetch_batch(session, batch_size)
+            if not rows:
+                break
+            for row in rows:
+                grouper.feed(row)
+            grouper.flush(session)
+            session.commit()
+        thiscount = len(rows)
+        total_time += timer.get_time()
+        per_message = timer.get_time() / thiscount
+        toprint = (
+            f"Now at: {grouper.processed}/{count}, {grouper.new_seps} groups. "
+            f"[{thiscount} messages at {per_message * 1000:.4f} ms/message]"
         )
-        thiscount = len(thesemessages)
-        first = thesemessages[0]
-        last = thesemessages[-1]
-        toprint = f"Now at: {new_count}/{count}. [{first.simplerep()}]-{thiscount}-[{last.simplerep()}]"
         gui.dprint(toprint)
-        stopcount += 1
-        if stopcount > countlim:
-            raise RecursionError("something has gone horribly wrong.")
         if status_mess:
             await status_mess.editw(
                 min_seconds=15,
                 content=f"<a:LetWalkR:1118191001731874856> {toprint}.<a:LetWalkR:1118191001731874856> ",
             )
-
-        # for m in thesemessages: backlog.put(m)
-        with Timer() as timer:
-            _, group_id = await iterate_backlog(thesemessages, group_id, thiscount)
-        gui.gprint(f"Group took {timer.get_time()} for {thiscount} messages")
-
-        DatabaseSingleton("voc").commit()
         await asyncio.sleep(0.05)
-        new_count += thiscount
-        gui.dprint(f"Now at: {new_count}/{count}.")
-
-    length = count
 
+    if grouper.processed:
+        gui.gprint(
+            f"Grouped {grouper.processed} messages into {grouper.new_seps} groups in "
+            f"{total_time:.3f}s, {total_time * 1000 / grouper.processed:.4f} ms/message"
+        )
     DatabaseSingleton("voc").commit()
 
-    # ts, group_id = await iterate_backlog(backlog, group_id, length)
     if status_mess:
         await status_mess.delete()
 
-    return length, group_id
+    return grouper.processed, grouper.group_id
@@ -0,0 +1,92 @@
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from utility.debug import Timer
+
+from .archive_database import ArchiveBase, ArchivedRPMessage
+from .collect_group_index import StreamingGrouper
+
+"""
+Benchmark for StreamingGrouper.
+
+Groups count and then ten times count synthetic messages in a scratch
+in-memory SQLite database, the same way do_group does, and reports the time
+per message for each.  Grouping is a single pass, so the two should come out
+close:
+
+    python -m cogs.ArchiveSub.group_benchmark
+"""
+
+SERVER_ID = 1
+
+
+def make_messages(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """count messages from a few authors over a few channels, oldest first."""
+    rng = random.Random(seed)
+    when = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        when += timedelta(minutes=rng.choice([0, 0, 1, 2, 5, 30, 200]))
+        rows.append(
+            {
+                "message_id": i + 1,
+                "server_id": SERVER_ID,
+                "author": f"author{rng.randrange(12)}",
+                "content": "x",
+                "created_at": when,
+                "category": "category",
+                "channel": f"channel{rng.randrange(6)}",
+                "thread": None,
+            }
+        )
+    return rows
+
+
+def group_messages(count: int, batch_size: int = 2000) -> Dict[str, Any]:
+    """Group count synthetic messages, timing the whole loop and just the feeding."""
+    engine = create_engine("sqlite://")
+    ArchiveBase.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(ArchivedRPMessage), make_messages(count))
+        session.commit()
+        grouper = StreamingGrouper(SERVER_ID)
+        feed_time = 0.0
+        with Timer() as total:
+            while True:
+                rows = grouper.fetch_batch(session, batch_size)
+                if not rows:
+                    break
+                with Timer() as feeding:
+                    for row in rows:
+                        grouper.feed(row)
+                feed_time += feeding.get_time()
+                grouper.flush(session)
+                session.commit()
+    engine.dispose()
+    return {
+        "messages": grouper.processed,
+        "groups": grouper.new_seps,
+        "us_per_message": round(total.get_time() / count * 1e6, 2),
+        "feed_us_per_message": round(feed_time / count * 1e6, 2),
+    }
+
+
+def group_benchmark(count: int = 10000) -> List[Dict[str, Any]]:
+    """Group count messages, then ten times as many.
+
+    Args:
+        count (int, optional): Messages in the smaller run. Defaults to 10000.
+
+    Returns:
+        List[Dict[str, Any]]: Messages, groups made, and microseconds per message
+        for the whole loop and for feeding alone, for each run.
+    """
+    return [group_messages(count), group_messages(count * 10)]
+
+
+if __name__ == "__main__":
+    print(group_benchmark())
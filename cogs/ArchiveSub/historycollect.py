@@ -1,10 +1,13 @@
 import gui
 import asyncio
+import math
+import time
 from datetime import datetime, timedelta, timezone
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from utility.globalfunctions import get_server_icon_color
 from .archive_database import HistoryMakers, ChannelArchiveStatus
+from .attachment_fetch import AttachmentFetcher
 from database import ServerArchiveProfile
 import discord
 from queue import Queue
@@ -19,6 +22,58 @@ Collects all messages in non-blacklisted channels, and adds them to the database
 """
 BATCH_SIZE = 50
 LAZYGRAB_LIMIT = 10000
+# channel.history fetches messages 100 at a time.
+HISTORY_PAGE = 100
+HISTORY_REQUESTS_PER_SECOND = 4
+MAX_CONCURRENT_CHANNELS = 4
+
+
+class RateBudget:
+    """Token bucket shared by every channel being collected at once.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (int, optional): Maximum burst size. Defaults to rate, rounded up.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        self.rate = rate
+        self.capacity = capacity or max(math.ceil(rate), 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int = 1):
+        """Wait until tokens are available, then take them."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class ChannelStats:
+    """Throughput of a single channel's collection."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.stored = 0
+        self.start = time.monotonic()
+        self.end: Optional[float] = None
+
+    def rate(self) -> float:
+        elapsed = (self.end or time.monotonic()) - self.start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.stored}/{self.count} stored, {self.rate():.1f} msg/s"
 
 
 class ArchiveContext:
@@ -76,6 +131,23 @@ class ArchiveContext:
         self.lazy = lazy
         if self.lazy:
             self.collect_limit = LAZYGRAB_LIMIT
+        self.fetcher = AttachmentFetcher()
+        self.budget = RateBudget(HISTORY_REQUESTS_PER_SECOND)
+        self.max_concurrent = MAX_CONCURRENT_CHANNELS
+        self.active_channels: Dict[int, ChannelStats] = {}
+        self.channel_stats: List[ChannelStats] = []
+
+    def start_channel(self, cobj: discord.abc.Messageable) -> "ChannelStats":
+        """Start tracking throughput for a channel being collected."""
+        stats = ChannelStats(cobj.name)
+        self.active_channels[cobj.id] = stats
+        return stats
+
+    def finish_channel(self, cobj: discord.abc.Messageable):
+        stats = self.active_channels.pop(cobj.id, None)
+        if stats:
+            stats.end = time.monotonic()
+            self.channel_stats.append(stats)
 
     def evaluate_add(self, thisMessage):
         """Determines whether a message should be added based on scope.
@@ -136,7 +208,7 @@ class ArchiveContext:
             cobj (discord.TextChannel): _description_
         """
         if self.lazy:
-            timev = carch.latest_archive_time
+            timev = self.resume_point(carch, carch.latest_archive_time)
             return {"limit": self.collect_limit, "after": timev, "oldest_first": True}
         lasttime = (
             None
@@ -156,7 +228,22 @@ class ArchiveContext:
                 timev = carch.first_message_time
         else:
             timev = None
-        return {"after": timev, "oldest_first": True}
+        return {"after": self.resume_point(carch, timev), "oldest_first": True}
+
+    def resume_point(self, carch: ChannelArchiveStatus, timev: Optional[datetime]):
+        """Get the later of timev and the channel's checkpointed message.
+
+        Args:
+            carch (ChannelArchiveStatus): Status of the channel being collected.
+            timev (datetime, optional): Time collection would otherwise start after.
+        """
+        if carch.latest_archive_id is None:
+            return timev
+        cursor_time = discord.utils.snowflake_time(carch.latest_archive_id)
+        if timev is None or cursor_time >= timev:
+            gui.dprint(f"resuming {carch.channel_id} after {carch.latest_archive_id}")
+            return discord.Object(id=carch.latest_archive_id)
+        return timev
 
     async def edit_mess(self, pre="", cname="", seconds=15):
         """Edits the status message to update the progress of the archival process.
@@ -179,6 +266,10 @@ class ArchiveContext:
             name=f"Total Messages archived{' this session' if self.lazy else ''}.",
             value=self.total_archived,
         )
+        emb.add_field(name="Attachments", value=self.fetcher.status_string())
+        if self.active_channels:
+            active = "\n".join(str(st) for st in self.active_channels.values())
+            emb.add_field(name="Collecting", value=active[:1024], inline=False)
         if self.lazy:
             emb.add_field(
                 name="Current Unarchived Message Time Span",
@@ -197,6 +288,9 @@ async def iter_hist_messages(
     the context of the archive. The archive context determines things like the time of the last stored message, whether or not to
     update the archive, and other operational parameters.
 
+    The channel's ChannelArchiveStatus cursor is moved forward after every stored batch and every page of history,
+    so a restarted collection picks up where this one stopped.
+
     Parameters:
     cobj (discord.TextChannel): The discord text channel to archive.
     actx (ArchiveContext): The context within which to perform the archive operation.
@@ -219,40 +313,77 @@ async def iter_hist_messages(
     )
     # gui.gprint(cobj.name, " ", lastmess, " ", lasttime, " ", timev)
     reallasttime = None
+    stats = actx.start_channel(cobj)
 
-    # return [];
-    async for thisMessage in cobj.history(**timev):
-        # if(thisMessage.created_at<=actx.last_stored_time and actx.update): break
-        add_check = actx.evaluate_add(thisMessage)
-        reallasttime = thisMessage.id
-        count = count + 1
-        if add_check:
-            thisMessage.content = thisMessage.clean_content
-            actx.alter_latest_time(thisMessage.created_at.timestamp())
-            actx.character_len += len(thisMessage.content)
-            messages.append(thisMessage)
-            carch.increment(thisMessage.created_at)
-            actx.total_archived += 1
-            mlen += 1
-        else:
-            actx.total_ignored += 1
-        if len(messages) % BATCH_SIZE == 0 and len(messages) > 0:
-            hmes = await HistoryMakers.get_history_message_list(messages)
+    async def checkpoint():
+        nonlocal messages
+        if messages:
+            await HistoryMakers.get_history_message_list(messages, actx.fetcher)
             messages = []
-        if mlen % 200 == 0 and mlen > 0:
-            await asyncio.sleep(1)
-            await actx.edit_mess(cobj.name)
-            # await edittime.invoke_if_time(content=f"{mlen} messages so far in this channel, this may take a moment.   \n On channel {chancount}/{chanlen},\n {cobj.name},\n gathered <a:SquareLoading:1143238358303264798>.  This will take a while...")
-            # await statusMess.updatew(f"{mlen} messages so far in this channel, this may take a moment.   \n On channel {chancount}/{chanlen},\n {cobj.name},\n gathered <a:SquareLoading:1143238358303264798>.  This will take a while...")
-    if messages:
-        hmes = await HistoryMakers.get_history_message_list(messages)
-        messages = []
+        if reallasttime:
+            carch.checkpoint(reallasttime)
+        actx.bot.database.commit()
+
+    try:
+        await actx.budget.acquire()
+        async for thisMessage in cobj.history(**timev):
+            # if(thisMessage.created_at<=actx.last_stored_time and actx.update): break
+            add_check = actx.evaluate_add(thisMessage)
+            reallasttime = thisMessage.id
+            count = count + 1
+            stats.count += 1
+            if add_check:
+                thisMessage.content = thisMessage.clean_content
+                actx.alter_latest_time(thisMessage.created_at.timestamp())
+                actx.character_len += len(thisMessage.content)
+                messages.append(thisMessage)
+                actx.fetcher.prefetch(thisMessage)
+                carch.increment(thisMessage.created_at)
+                actx.total_archived += 1
+                mlen += 1
+                stats.stored += 1
+            else:
+                actx.total_ignored += 1
+            if len(messages) >= BATCH_SIZE:
+                await checkpoint()
+            if count % HISTORY_PAGE == 0:
+                # The next message starts a new page of history.
+                await checkpoint()
+                await actx.budget.acquire()
+                await actx.edit_mess(cname=cobj.name)
+        await checkpoint()
+    finally:
+        actx.fetcher.discard(messages)
+        actx.finish_channel(cobj)
     if reallasttime:
         gui.dprint(reallasttime, "vs ", lastmess, " ", lasttime, " ", timev)
+        gui.gprint(f"{cobj.name}: {stats}")
     else:
         gui.gprint(f"Did not need to archive {cobj.name}")
     actx.bot.database.commit()
-    return messages, mlen > 0, count
+    return [], mlen > 0, count
+
+
+async def collect_channels(channels: List[discord.abc.Messageable], actx: ArchiveContext):
+    """Run iter_hist_messages over channels, up to actx.max_concurrent at once.
+
+    Args:
+        channels (List[discord.abc.Messageable]): text channels and threads to collect.
+        actx (ArchiveContext): The shared archive context.
+
+    Returns:
+        bool: True if any channel had new messages to store.
+    """
+    semaphore = asyncio.Semaphore(actx.max_concurrent)
+
+    async def run(chan):
+        async with semaphore:
+            actx.channel_spot += 1
+            _, have, _ = await iter_hist_messages(chan, actx)
+            return have
+
+    results = await asyncio.gather(*(run(chan) for chan in channels))
+    return any(results)
 
 
 async def collect_server_history_lazy(ctx: commands.Context, statmess=None, **kwargs):
@@ -298,13 +429,11 @@ async def collect_server_history_lazy(ctx: commands.Context, statmess=None, **kw
         **kwargs,
     )
 
-    grabstat = False
     gui.gprint(len(channels))
+    targets = []
     for c in channels:
         gui.print(c)
 
-        arch_ctx.channel_spot += 1
-
         channel = guild.get_channel_or_thread(c.channel_id)
         if (not channel) and (c.thread_parent_id is not None):
             try:
@@ -317,10 +446,10 @@ async def collect_server_history_lazy(ctx: commands.Context, statmess=None, **kw
                 await bot.send_error(e, "ex", True)
                 ChannelArchiveStatus.delete_channel_by_id(c.channel_id)
         if channel:
-            await arch_ctx.edit_mess(cname=channel.name, seconds=0)
-            gui.gprint("Channel", channel)
-            mes, have, count = await iter_hist_messages(channel, arch_ctx)
-            grabstat = grabstat or have
+            targets.append(channel)
+
+    await arch_ctx.edit_mess(seconds=0)
+    grabstat = await collect_channels(targets, arch_ctx)
 
     bot.database.commit()
     # await statmess.delete()
@@ -428,13 +557,9 @@ async def collect_server_history(ctx, **kwargs):
         **kwargs,
     )
 
-    current_channel_count = 0
-    current_channel_every = 50
-    totalcharlen = 0
     await arch_ctx.edit_mess(seconds=0)
+    targets = []
     for tup, chan in chantups:
-        arch_ctx.channel_spot += 1
-
         if (
             profile.has_channel(chan.id) == False
             and chan.permissions_for(guild.me).view_channel == True
@@ -454,21 +579,13 @@ async def collect_server_history(ctx, **kwargs):
             for thread in threads:
                 lastmessage_str = f"{tup}, {chan.name}, {thread.name}: {chan.last_message_id}, {thread.last_message_id}"
                 gui.gprint(lastmessage_str)
-                mess, _, _ = await iter_hist_messages(thread, arch_ctx)
-                messages = messages + mess
-                current_channel_count += 1
+                targets.append(thread)
 
             if tup == "textchan":
-                chanmess, _, _ = await iter_hist_messages(chan, arch_ctx)
-                # new_last_time=max(new_last_time,newtime)
-                # ignored+=ign
-                # totalcharlen+=charlen
-                messages = messages + chanmess
-                current_channel_count += 1
-
-            await arch_ctx.edit_mess(f"", chan.name)
-            if current_channel_count % current_channel_every == 0:
-                await asyncio.sleep(1)
+                targets.append(chan)
+
+    arch_ctx.channel_count = len(targets)
+    await collect_channels(targets, arch_ctx)
 
     if statusMessToEdit != None:
         await statusMessToEdit.delete()
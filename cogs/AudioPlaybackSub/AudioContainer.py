@@ -6,22 +6,45 @@ import random
 from typing import Any, Callable, Dict, List
 import urllib
 import discord
-import subprocess
 import re
 import logging
+import time
+from typing import Optional
 
 import yt_dlp  # type: ignore
 import itertools
 import json
 from .MusicUtils import is_url
 from .MusicDatabase import MusicJSONMemoryDB
+from .MediaProbe import MediaProbeCache
 from utility import MessageTemplates, seconds_to_time_string, seconds_to_time_stamp
-import mutagen
 
 logs = logging.getLogger("TCLogger")
 FILE_DEBUG = False
 
 
+def source_expiry(source: str) -> Optional[float]:
+    """Get the unix time a stream url stops working at.
+
+    Stream urls from youtube and similar hosts carry their expiry as an
+    ``expire`` query parameter.
+
+    Args:
+        source (str): The stream url.
+
+    Returns:
+        Optional[float]: The expiry time, or None if the url doesn't say.
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(source).query)
+    expire = query.get("expire")
+    if not expire:
+        return None
+    try:
+        return float(expire[0])
+    except ValueError:
+        return None
+
+
 def speciallistsplitter(
     objects: List[Any],
     resetdata: Callable,
@@ -124,21 +147,43 @@ class AudioContainer:
         self.started_at: datetime.datetime = discord.utils.utcnow()
         self.seekerspot = 0.0
         self.source = None
+        self.source_resolved_at: Optional[float] = None
+        self.source_expires_at: Optional[float] = None
         self.extract_options = {}
 
+    def resolve_source(self) -> str:
+        """Look up the url ffmpeg should play.  BLOCKING OPERATION.
+
+        Raises whatever yt_dlp raises if the lookup fails.
+        """
+        dlp = self.extract_options.get("nodlp", True)
+        if not dlp:
+            return self.url
+        with yt_dlp.YoutubeDL(self.extract_options) as ydl:
+            res = ydl.extract_info(f"{self.url}", download=False)
+            if "entries" in res:  # a playlist or a list of videos
+                info = res["entries"][0]
+            else:  # Just a video
+                info = res
+        return info["url"]
+
+    def set_source(self, source: str):
+        """Store a resolved source along with when it expires."""
+        self.source = source
+        self.source_resolved_at = time.time()
+        self.source_expires_at = source_expiry(source)
+
+    def source_valid_for(self, seconds: float) -> bool:
+        """Check if the source is set and will still work seconds from now."""
+        if self.source is None:
+            return False
+        if self.source_expires_at is None:
+            return True
+        return self.source_expires_at - time.time() > seconds
+
     def get_source(self):
         try:
-            dlp = self.extract_options.get("nodlp", True)
-            if dlp:
-                with yt_dlp.YoutubeDL(self.extract_options) as ydl:
-                    res = ydl.extract_info(f"{self.url}", download=False)
-                    if "entries" in res:  # a playlist or a list of videos
-                        info = res["entries"][0]
-                    else:  # Just a video
-                        info = res
-                self.source = info["url"]
-            else:
-                self.source = self.url
+            self.set_source(self.resolve_source())
         except Exception as e:
             self.state = "Error"
             self.error_value = e
@@ -163,6 +208,10 @@ class AudioContainer:
                     info = res
         else:
             info = entry.infojson
+        self.get_song_from_info(info)
+
+    def get_song_from_info(self, info: Dict):
+        """Get a song from an already extracted yt_dlp info dict."""
         info = sanatize_info(info)
 
         self.json_dict = info
@@ -259,19 +308,12 @@ class AudioContainer:
         info = {}
         options = {"nodlp": True}
 
-        duration_cmd = "ffprobe -i " + self.query + " -show_format -v quiet"
-        output = subprocess.check_output(
-            duration_cmd, shell=True, stderr=subprocess.STDOUT
-        ).decode("utf-8")
-
-        # Find the duration of the audio stream from the ffprobe output
-        duration_match = re.search(r"duration=([\d\.]+)", output)
-        total_length = int(round(float(duration_match.group(1))))
+        duration, title = MediaProbeCache.probe_blocking(self.query)
+        total_length = int(round(duration))
         gui.gprint("Total Length: " + str(total_length) + " seconds")
         self.title, self.duration, self.url = "Your Song", total_length, self.query
-        mdata = mutagen.File(self.query)
-        if mdata:
-            self.title = mdata.get("title")
+        if title:
+            self.title = title
         self.extract_options = options
         # self.source=self.query
         self.state = "Ok"
@@ -299,15 +341,10 @@ class AudioContainer:
             gui.gprint("File not found. Using random file:", random_file)
 
         gui.gprint("File found at:", file_path)
-        # Find the duration of the audio stream from the ffprobe output
-        duration_cmd = "ffprobe -i " + file_path + " -show_format -v quiet"
-        output = subprocess.check_output(
-            duration_cmd, shell=True, stderr=subprocess.STDOUT
-        ).decode("utf-8")
-        duration_match = re.search(r"duration=([\d\.]+)", output)
-        total_length = int(round(float(duration_match.group(1))))
+        # Duration and title tag come from the probe cache, or ffprobe on a miss.
+        duration, title = MediaProbeCache.probe_blocking(file_path)
+        total_length = int(round(duration))
         gui.gprint("Total Length: " + str(total_length) + " seconds")
-        mdata = mutagen.File(file_path)
         self.title, self.duration, self.url = (
             "Your Song",
             total_length,
@@ -315,8 +352,8 @@ class AudioContainer:
         )
         self.extract_options = options
         # self.source="./"+file_path
-        if mdata:
-            self.title = mdata.get("title")
+        if title:
+            self.title = title
         self.type = "file"
         self.state = "Ok"
 
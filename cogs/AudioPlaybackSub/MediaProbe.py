@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import subprocess
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import gui
+
+from .MusicDatabase import MediaProbeEntry
+
+"""
+Cache of ffprobe results for the music player's local and remote files.
+
+The same radio files get queued over and over, and each time used to run
+ffprobe through a shell and open the file with mutagen.  Results are now kept
+in the media_probe_cache table, keyed by path along with the file's mtime and
+size, so a file is only probed again once it changes.  Remote files are keyed
+by url.
+"""
+
+PROBE_ARGS = ["ffprobe", "-v", "quiet", "-show_format", "-of", "json", "-i"]
+PROBE_TIMEOUT = 30
+DISCORD_CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
+
+ProbeRecord = Tuple[float, int, float, Optional[str]]
+
+
+def probe_key(path: str) -> Tuple[str, float, int]:
+    """Get the cache key, mtime and size for a file path or url.
+
+    Discord attachment urls carry signed query parameters that change, but
+    the path is unique to the attachment, so those are keyed without them.
+    """
+    parts = urlsplit(path)
+    if parts.scheme in ("http", "https"):
+        if parts.netloc in DISCORD_CDN_HOSTS:
+            return f"{parts.scheme}://{parts.netloc}{parts.path}", 0.0, 0
+        return path, 0.0, 0
+    stat = os.stat(path)
+    return os.path.normpath(path), stat.st_mtime, stat.st_size
+
+
+def parse_probe(output: bytes) -> Tuple[float, Optional[str]]:
+    """Get the duration and title tag out of ffprobe's json output.
+
+    Raises:
+        ValueError: ffprobe didn't report a duration.
+    """
+    fmt = json.loads(output or b"{}").get("format", {})
+    if "duration" not in fmt:
+        raise ValueError("ffprobe could not read a duration.")
+    tags = {k.lower(): v for k, v in fmt.get("tags", {}).items()}
+    return float(fmt["duration"]), tags.get("title")
+
+
+class MediaProbeCache:
+    """Looks up the duration and title of audio files, probing only on a cache miss."""
+
+    _entries: Optional[Dict[str, ProbeRecord]] = None
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def entries(cls) -> Dict[str, ProbeRecord]:
+        with cls._lock:
+            if cls._entries is None:
+                cls._entries = MediaProbeEntry.get_all()
+            return cls._entries
+
+    @classmethod
+    def lookup(cls, path: str) -> Optional[Tuple[float, Optional[str]]]:
+        """Get the cached duration and title of path, None if it isn't cached or changed."""
+        key, mtime, size = probe_key(path)
+        entry = cls.entries().get(key)
+        if entry is None or entry[0] != mtime or entry[1] != size:
+            cls.misses += 1
+            return None
+        cls.hits += 1
+        return entry[2], entry[3]
+
+    @classmethod
+    def record(
+        cls, path: str, duration: float, title: Optional[str]
+    ) -> Tuple[str, ProbeRecord]:
+        key, mtime, size = probe_key(path)
+        entry = (mtime, size, duration, title)
+        cls.entries()[key] = entry
+        return key, entry
+
+    @classmethod
+    def probe_blocking(cls, path: str) -> Tuple[float, Optional[str]]:
+        """Get the duration and title of path.  BLOCKING OPERATION.
+
+        For code that's already running in a worker thread.
+
+        Args:
+            path (str): A file path or url.
+
+        Returns:
+            Tuple[float, Optional[str]]: Duration in seconds and the title tag.
+        """
+        cached = cls.lookup(path)
+        if cached is not None:
+            return cached
+        result = subprocess.run(
+            PROBE_ARGS + [path],
+            capture_output=True,
+            timeout=PROBE_TIMEOUT,
+            check=True,
+        )
+        duration, title = parse_probe(result.stdout)
+        key, entry = cls.record(path, duration, title)
+        MediaProbeEntry.put_many({key: entry})
+        return duration, title
+
+    @classmethod
+    async def run_probe(cls, path: str) -> Tuple[float, Optional[str]]:
+        proc = await asyncio.create_subprocess_exec(
+            *PROBE_ARGS,
+            path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            output, _ = await asyncio.wait_for(proc.communicate(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, PROBE_ARGS + [path])
+        return parse_probe(output)
+
+    @classmethod
+    async def probe(cls, path: str) -> Tuple[float, Optional[str]]:
+        """Get the duration and title of path without blocking the event loop.
+
+        Args:
+            path (str): A file path or url.
+
+        Returns:
+            Tuple[float, Optional[str]]: Duration in seconds and the title tag.
+        """
+        cached = await asyncio.to_thread(cls.lookup, path)
+        if cached is not None:
+            return cached
+        duration, title = await cls.run_probe(path)
+        key, entry = cls.record(path, duration, title)
+        await asyncio.to_thread(MediaProbeEntry.put_many, {key: entry})
+        return duration, title
+
+    @classmethod
+    async def index_directory(
+        cls, directory: str, concurrency: int = 4
+    ) -> Dict[str, int]:
+        """Probe every file under directory that isn't cached yet.
+
+        Args:
+            directory (str): The folder to walk.
+            concurrency (int, optional): ffprobe processes to run at once. Defaults to 4.
+
+        Returns:
+            Dict[str, int]: How many files were cached already, probed, and failed.
+        """
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                paths.append(os.path.join(dirpath, filename))
+        await asyncio.to_thread(cls.entries)
+        todo = [path for path in paths if cls.lookup(path) is None]
+        semaphore = asyncio.Semaphore(concurrency)
+        probed: Dict[str, ProbeRecord] = {}
+        failed = 0
+
+        async def index(path: str):
+            nonlocal failed
+            async with semaphore:
+                try:
+                    duration, title = await cls.run_probe(path)
+                except Exception as e:
+                    failed += 1
+                    gui.dprint(f"could not probe {path}: {e}")
+                    return
+            key, entry = cls.record(path, duration, title)
+            probed[key] = entry
+
+        await asyncio.gather(*(index(path) for path in todo))
+        await asyncio.to_thread(MediaProbeEntry.put_many, probed)
+        return {
+            "cached": len(paths) - len(todo),
+            "probed": len(probed),
+            "failed": failed,
+        }
+
+    @classmethod
+    def status_string(cls) -> str:
+        return f"{len(cls.entries())} files cached, {cls.hits} hits, {cls.misses} misses"
@@ -1,5 +1,6 @@
 import json
-from typing import Any, List, Tuple
+import threading
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
 from sqlalchemy import (
     Column,
     ForeignKey,
@@ -17,8 +18,8 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship, Session
 from database import DatabaseSingleton
 from sqlalchemy import case, func
-from .MusicUtils import is_url
-from urllib.parse import urlparse, parse_qs, urlsplit
+from .MusicUtils import youtube_id
+from .MusicSearch import MusicSearchIndex
 import gui
 
 MusicBase = declarative_base(name="Music System Base")
@@ -32,6 +33,9 @@ class MusicJSONMemoryDB(MusicBase):
     source = Column(String, default="unknown")
     infojson = Column(JSON, default={})
 
+    _search_index: ClassVar[Optional[MusicSearchIndex]] = None
+    _search_index_lock = threading.Lock()
+
     def __init__(self, url: str, title: str, id: str, source: str, infojson: dict):
         self.url = url
         self.title = title
@@ -61,6 +65,88 @@ class MusicJSONMemoryDB(MusicBase):
             profile.update(url=url, title=title, id=id, infojson=infojson)
         session.commit()
         session.close()
+        if MusicJSONMemoryDB._search_index is not None:
+            MusicJSONMemoryDB._search_index.add(url, id, title)
+
+    @classmethod
+    def add_many(cls, infojsons: List[dict]):
+        """Store the infojson of many songs at once, in one transaction.
+
+        Args:
+            infojsons (List[dict]): Sanitized yt_dlp info dicts.
+        """
+        by_url = {}
+        for infojson in infojsons:
+            by_url[infojson["webpage_url"]] = infojson
+        if not by_url:
+            return
+        session: Session = DatabaseSingleton.get_new_session()
+        existing = {
+            profile.url: profile
+            for profile in session.query(cls).filter(cls.url.in_(list(by_url)))
+        }
+        for url, infojson in by_url.items():
+            title, id = infojson["title"], infojson["id"]
+            if url in existing:
+                existing[url].update(title=title, id=id, infojson=infojson)
+            else:
+                session.add(
+                    cls(
+                        url=url,
+                        title=title,
+                        id=id,
+                        source=infojson.get("extractor", "???"),
+                        infojson=infojson,
+                    )
+                )
+        session.commit()
+        session.close()
+        if cls._search_index is not None:
+            for url, infojson in by_url.items():
+                cls._search_index.add(url, infojson["id"], infojson["title"])
+
+    @classmethod
+    def get_search_index(cls) -> MusicSearchIndex:
+        """Get the search index, building it from the table the first time.  BLOCKING OPERATION."""
+        with cls._search_index_lock:
+            if cls._search_index is None:
+                session: Session = DatabaseSingleton.get_new_session()
+                rows = session.query(cls.url, cls.id, cls.title).all()
+                session.close()
+                cls._search_index = MusicSearchIndex.from_rows(rows)
+                gui.dprint(f"built music search index of {len(rows)} songs")
+            return cls._search_index
+
+    @classmethod
+    def get_cached(cls, queries: List[str]) -> Dict[str, dict]:
+        """Look up the stored infojson of many song queries at once.
+
+        A query matches an entry with the same url, or for youtube links,
+        the same video id.
+
+        Args:
+            queries (List[str]): Song urls.
+
+        Returns:
+            Dict[str, dict]: Each query that has a stored infojson, mapped to it.
+        """
+        ids = {query: youtube_id(query) for query in queries}
+        wanted_ids = [i for i in ids.values() if i]
+        session: Session = DatabaseSingleton.get_new_session()
+        rows = (
+            session.query(cls.url, cls.id, cls.infojson)
+            .filter(or_(cls.url.in_(queries), cls.id.in_(wanted_ids)))
+            .all()
+        )
+        session.close()
+        by_url = {url: infojson for url, id, infojson in rows if infojson}
+        by_id = {id: infojson for url, id, infojson in rows if infojson}
+        found = {}
+        for query in queries:
+            infojson = by_url.get(query) or by_id.get(ids[query])
+            if infojson:
+                found[query] = infojson
+        return found
 
     def update(self, **kwargs):
         for key, value in kwargs.items():
@@ -324,60 +410,71 @@ class MusicJSONMemoryDB(MusicBase):
         """
         Search for entries in the database that match the given query.
 
+        Matching is done with the in memory search index, see MusicSearchIndex.search
+        for the ranking.
+
         Parameters:
         - query (str): The search query string.
         - do_sub (bool, optional): Whether to perform partial substring matching. Defaults to True.
+        - do_maxsearch (bool, optional): Whether to return entries that only match some parts. Defaults to False.
 
         Returns:
-        - List[MusicJSONMemoryDB]: A list of MusicJSONMemoryDB objects that match the search query.
+        - List[MusicJSONMemoryDB]: A list of MusicJSONMemoryDB objects that match the search query, best first.
         """
-        session: Session = DatabaseSingleton.get_new_session()
-        results = (
-            session.query(cls)
-            .filter(
-                (cls.id.ilike(f"%{query}%"))
-                | (cls.title.ilike(f"%{query}%"))
-                | (cls.url.ilike(f"%{query}%"))
-            )
-            .limit(10)
-            .all()
+        urls = cls.get_search_index().search(
+            query, do_sub=do_sub, do_maxsearch=do_maxsearch
         )
-        if results:
-            session.close()
-            return results
-        if do_sub:
-            parts = []
-            # Time to check for partial matches.
-            if is_url(query):
-                gui.gprint("searching urls")
-                # Include the whole query as one part initially
-                parts = [query]
-                # Split the query by the URL components: domain, basename, and GET parameters
-                url_components = urlsplit(query)
-                gui.dprint(url_components)
-                if (
-                    url_components.scheme and url_components.netloc
-                ):  # Ensure it's a valid URL
-                    domain = url_components.netloc
-                    basename = url_components.path.lstrip("/")
-                    get_params = url_components.query
-                    parts.extend([domain, basename, get_params])
-                    # Split GET parameters and add them as separate parts
-                    params_dict = parse_qs(get_params)
-                    for param_key, param_values in params_dict.items():
-                        parts.append(param_key)
-                        for param_value in param_values:
-                            parts.append(param_value)
-            else:
-                parts = query.split()
-            res = MusicJSONMemoryDB.substring_search(
-                parts, do_maxsearch=do_maxsearch, session=session
-            )
-            session.close()
-            return res
-        else:
-            session.close()
+        if not urls:
             return []
+        session: Session = DatabaseSingleton.get_new_session()
+        results = session.query(cls).filter(cls.url.in_(urls)).all()
+        session.close()
+        by_url = {entry.url: entry for entry in results}
+        return [by_url[url] for url in urls if url in by_url]
+
+
+class MediaProbeEntry(MusicBase):
+    """Cached ffprobe results for an audio file or url."""
+
+    __tablename__ = "media_probe_cache"
+    key = Column(String, primary_key=True)
+    mtime = Column(Double, default=0.0)
+    size = Column(Integer, default=0)
+    duration = Column(Double, default=0.0)
+    title = Column(String, nullable=True)
+
+    @classmethod
+    def get_all(cls) -> Dict[str, Tuple[float, int, float, Optional[str]]]:
+        """Get every entry as key: (mtime, size, duration, title)."""
+        session: Session = DatabaseSingleton.get_new_session()
+        rows = session.query(
+            cls.key, cls.mtime, cls.size, cls.duration, cls.title
+        ).all()
+        session.close()
+        return {
+            key: (mtime, size, duration, title)
+            for key, mtime, size, duration, title in rows
+        }
+
+    @classmethod
+    def put_many(cls, entries: Dict[str, Tuple[float, int, float, Optional[str]]]):
+        """Store many probe results at once, in one transaction."""
+        if not entries:
+            return
+        session: Session = DatabaseSingleton.get_new_session()
+        existing = {
+            entry.key: entry
+            for entry in session.query(cls).filter(cls.key.in_(list(entries)))
+        }
+        for key, (mtime, size, duration, title) in entries.items():
+            entry = existing.get(key)
+            if entry is None:
+                entry = cls(key=key)
+                session.add(entry)
+            entry.mtime, entry.size = mtime, size
+            entry.duration, entry.title = duration, title
+        session.commit()
+        session.close()
 
 
 class UserMusicProfile(MusicBase):
@@ -2,6 +2,7 @@ import gui
 import asyncio
 import datetime
 import random
+import time
 import urllib
 
 import discord
@@ -18,13 +19,18 @@ from assetloader import AssetLookup
 from utility import seconds_to_time_string, seconds_to_time_stamp, urltomessage
 from utility import PageClassContainer
 from .AudioContainer import AudioContainer, speciallistsplitter
+from .MusicDatabase import MusicJSONMemoryDB
 from .MusicUtils import connection_check
 from .MusicViews import PlayerButtons, PlaylistButtons
 from .MusicPlayer_Mixins import PlaylistMixin, PlayerMixin
+from .SourcePrefetch import SourcePrefetcher, TimedAudio
 
 """this code is for the music player, and it's interactions."""
 
 EDIT_INTERVAL = 45
+# Songs from song_add_queue that get their metadata looked up at once.
+INGEST_WORKERS = 4
+INGEST_PROGRESS_INTERVAL = 5
 
 
 def make_playlist_embeds(player, interaction):
@@ -169,11 +175,13 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
         self.timeidle = 0
         self.override = False
         self.channel, self.voice = None, None
-        self.song_add_queue, self.songcanadd, self.processsize = Queue(), True, 0
+        self.song_add_queue, self.processsize = Queue(), 0
+        self.ingest_task: Optional[asyncio.Task] = None
         self.lastm: discord.Message = None
         self.messages = []
         self.internal_message_log = []
         self.old_desc = ""
+        self.prefetcher = SourcePrefetcher()
         self.setup_actions()
         self.setup_playlist_actions()
 
@@ -235,34 +243,11 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             pass
 
     async def songadd(self):
-        if self.song_add_queue.empty() == False:
-            gui.gprint("Adding song.")
-            if self.songcanadd:
-                self.songcanadd, got = False, False
-                try:
-                    song = self.song_add_queue.get()
-                    got = True
-                    await asyncio.gather(asyncio.to_thread(self.musicplayeradd, song))
-
-                    self.processsize -= 1
-                    if self.song_add_queue.empty():
-                        gui.gprint("COMPLETED.")
-                        if self.channel:
-                            embed = discord.Embed(
-                                description="All songs have been processed.",
-                                color=discord.Color.green(),
-                            )
-                            mess = await self.channel.send(embed=embed)
-                            # mess=await self.channel.send(embed=embed)
-                            self.bot.schedule_for_deletion(mess, 20)
-                except:
-                    if not got:
-                        self.processsize -= 1
-
-                    gui.gprint("PROCESSING ERROR")
-                    if self.song_add_queue.empty():
-                        self.processsize = 0
-                self.songcanadd = True
+        """Start ingesting the songs in song_add_queue, if that isn't already running."""
+        if not self.song_add_queue.empty():
+            if self.ingest_task is None or self.ingest_task.done():
+                gui.gprint("Adding songs.")
+                self.ingest_task = asyncio.create_task(self.ingest_queued_songs())
         if self.internal_message_log:
             front = self.internal_message_log.pop()
             myname = AssetLookup.get_asset("name")
@@ -272,6 +257,11 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             if self.channel:
                 mess = await self.channel.send(embed=embed)
 
+    def prefetch_sources(self):
+        """Resolve the stream urls of the next few songs in the background."""
+        if self.voice is not None and self.songs:
+            self.prefetcher.schedule(self.songs)
+
     async def autodisconnect(self):
         voice = discord.utils.get(self.bot.voice_clients, guild=self.guild)
         if voice == None:
@@ -380,9 +370,10 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             ctxmode,
         )  # discord.utils.get(self.bot.voice_clients, guild=interaction.guild)
         if self.songs:
+            requested = time.monotonic()
             self.current = self.songs.pop(0)
             if self.current.state != "Ok":
-                self.current.get_song()
+                await asyncio.to_thread(self.current.get_song)
                 if self.current.state == "Error":
                     gui.gprint("error")
                     # if song.state=="Error":
@@ -400,7 +391,9 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             if voice is not None:
                 if voice.is_playing():
                     voice.pause()
-            song.get_source()  # Get youtube streaming link
+            # Get youtube streaming link, usually already prefetched
+            how = await self.prefetcher.ready(song)
+            wait = time.monotonic() - requested
             if song.state == "Error":
                 # Something went wrong don't play it
                 gui.gprint("error")
@@ -418,10 +411,11 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             if song.type == "file":
                 # FFMPEG has different rules for files.
                 aud = discord.FFmpegPCMAudio(song.source, **self.FFMPEG_FILEOPTIONS)
+            record = self.prefetcher.track_started(song, how, requested, wait)
             await asyncio.sleep(0.1)
             song.start()
             voice.play(
-                aud,
+                TimedAudio(aud, record),
                 after=lambda e: (
                     self.bot.schedule_for_post(
                         ctx.channel, "Error in playback: " + str(e)
@@ -436,6 +430,7 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             self.bot.add_act(
                 "MusicPlay", f"{song.title}", discord.ActivityType.listening
             )
+            self.prefetch_sources()
             await self.send_message(ctx, "play", f"**{song.title}** is now playing.  ")
 
     async def play_song_override(
@@ -468,19 +463,136 @@ class MusicPlayer(PlaylistMixin, PlayerMixin):
             ),
         )
 
-    def musicplayeradd(self, song: AudioContainer):
-        """Get song, and add to queue.  BLOCKING OPERATION."""
+    def resolve_queued_song(
+        self, song: AudioContainer, info: Optional[dict] = None
+    ) -> bool:
+        """Get the metadata of a queued song.  BLOCKING OPERATION.
+
+        Args:
+            song (AudioContainer): The song to resolve.
+            info (Optional[dict], optional): Its cached infojson, if there is one. Defaults to None.
+
+        Returns:
+            bool: True if the metadata was extracted, False if it came from the cache.
+        """
+        if info:
+            try:
+                song.get_song_from_info(dict(info))
+                return False
+            except Exception as e:
+                gui.dprint(f"cached info for {song.query} is unusable: {e}")
         song.get_song(do_search=True, db_search=False, substrings=False)
+        return True
+
+    def queue_resolved_song(self, song: AudioContainer):
+        """Add a resolved song to the playlist, or log why it couldn't be."""
         if song.state == "Error":
             self.internal_message_log.append(
                 f"I could not add {song.title} : `{str(song.error_value)}`"
             )
         elif song.state == "Ok":
             if self.autoshuffle:
-                self.songs.insert(random.randint(0, len(self.songs) - 1), song)
+                self.songs.insert(random.randint(0, len(self.songs)), song)
             else:
                 self.songs.append(song)
 
+    async def ingest_queued_songs(self):
+        """Resolve everything in song_add_queue with a pool of workers.
+
+        Up to INGEST_WORKERS songs are looked up at once, songs already in
+        MusicJSONMemoryDB are read from it, and the newly extracted metadata
+        is stored in one batch.  Songs are added to the playlist in the order
+        they were queued, each as soon as it and every song before it is done.
+        """
+        progress: Optional[discord.Message] = None
+        last_progress = time.monotonic()
+        added, failed, total = 0, 0, 0
+        while not self.song_add_queue.empty():
+            batch: List[AudioContainer] = []
+            while not self.song_add_queue.empty():
+                batch.append(self.song_add_queue.get())
+            total += len(batch)
+            try:
+                cached = await asyncio.to_thread(
+                    MusicJSONMemoryDB.get_cached, [song.query for song in batch]
+                )
+            except Exception as e:
+                gui.dprint(f"could not check the song cache: {e}")
+                cached = {}
+            if progress is None and total > 1 and self.channel:
+                try:
+                    progress = await self.channel.send(
+                        embed=discord.Embed(
+                            description=f"Processing {total} songs...",
+                            color=discord.Color.blue(),
+                        )
+                    )
+                except discord.HTTPException:
+                    progress = None
+
+            semaphore = asyncio.Semaphore(INGEST_WORKERS)
+            extracted: List[dict] = []
+
+            async def resolve(song: AudioContainer):
+                async with semaphore:
+                    looked_up = await asyncio.to_thread(
+                        self.resolve_queued_song, song, cached.get(song.query)
+                    )
+                info = song.json_dict
+                if looked_up and song.state == "Ok":
+                    if all(k in info for k in ("webpage_url", "id", "title")):
+                        extracted.append(info)
+
+            workers = [asyncio.create_task(resolve(song)) for song in batch]
+            for song, worker in zip(batch, workers):
+                try:
+                    await worker
+                except Exception as e:
+                    song.state, song.error_value = "Error", e
+                self.queue_resolved_song(song)
+                self.processsize = max(self.processsize - 1, 0)
+                if song.state == "Ok":
+                    added += 1
+                else:
+                    failed += 1
+                now = time.monotonic()
+                if progress and now - last_progress > INGEST_PROGRESS_INTERVAL:
+                    last_progress = now
+                    try:
+                        await progress.edit(
+                            embed=discord.Embed(
+                                description=f"Added {added} of {total} songs, {failed} failed.",
+                                color=discord.Color.blue(),
+                            )
+                        )
+                    except discord.HTTPException:
+                        progress = None
+            if extracted:
+                try:
+                    await asyncio.to_thread(MusicJSONMemoryDB.add_many, extracted)
+                except Exception as e:
+                    gui.dprint(f"could not cache song metadata: {e}")
+            self.prefetch_sources()
+
+        gui.gprint("COMPLETED.")
+        embed = discord.Embed(
+            description=f"All songs have been processed.  Added {added} of {total}.",
+            color=discord.Color.green(),
+        )
+        if progress:
+            try:
+                await progress.edit(embed=embed)
+                self.bot.schedule_for_deletion(progress, 20)
+                return
+            except discord.HTTPException:
+                pass
+        if self.channel:
+            try:
+                mess = await self.channel.send(embed=embed)
+                self.bot.schedule_for_deletion(mess, 20)
+            except discord.HTTPException:
+                pass
+
     def get_music_embed(self, title: str, description: str) -> discord.Embed:
         """Format a status embed and return"""
         if description:
@@ -0,0 +1,184 @@
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .MusicUtils import is_url
+
+"""
+In memory search index for MusicJSONMemoryDB.
+
+Searching used to run several ilike '%part%' queries over the whole table for
+every lookup.  This keeps a trigram index of each song's id, title and url
+instead, so a substring only has to be checked against the songs that contain
+its rarest trigram.  The index is built from the table the first time it's
+needed and kept up to date as songs are added.
+
+search_benchmark.py compares it against the old queries.
+"""
+
+# Separates the fields of a song so a part can't match across two of them.
+FIELD_SEP = "\x00"
+
+
+def trigrams(text: str) -> Set[str]:
+    """Get every three character substring of text."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def query_parts(query: str) -> List[str]:
+    """Split a search query into the parts that are matched separately.
+
+    Urls are split into their domain, path, query string, and each query
+    parameter's key and values.  Anything else is split on whitespace.
+
+    Args:
+        query (str): The search query.
+
+    Returns:
+        List[str]: The parts, without duplicates or blank parts.
+    """
+    if is_url(query):
+        parts = [query]
+        url_components = urlsplit(query)
+        # Ensure it's a valid URL
+        if url_components.scheme and url_components.netloc:
+            get_params = url_components.query
+            parts.extend(
+                [url_components.netloc, url_components.path.lstrip("/"), get_params]
+            )
+            for param_key, param_values in parse_qs(get_params).items():
+                parts.append(param_key)
+                parts.extend(param_values)
+    else:
+        parts = query.split()
+    return list(dict.fromkeys(p for p in parts if p and not p.isspace()))
+
+
+class MusicSearchIndex:
+    """Trigram index over the id, title and url of songs, keyed by url.
+
+    Matching is case insensitive substring matching, the same as ilike.
+    """
+
+    def __init__(self):
+        self.urls: List[Optional[str]] = []
+        self.texts: List[str] = []
+        self.titles: List[str] = []
+        self.doc_of: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+        self.dead = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.doc_of)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, str]]) -> "MusicSearchIndex":
+        """Build an index from (url, id, title) rows."""
+        index = cls()
+        for url, id, title in rows:
+            index.add(url, id, title)
+        return index
+
+    def add(self, url: str, id: Optional[str], title: Optional[str]):
+        """Add a song, replacing the one with the same url if it's already there."""
+        with self.lock:
+            old = self.doc_of.get(url)
+            if old is not None:
+                self.urls[old], self.texts[old], self.titles[old] = None, "", ""
+                self.dead += 1
+            doc = len(self.urls)
+            title = (title or "").lower()
+            text = FIELD_SEP.join([(id or "").lower(), title, url.lower()])
+            self.urls.append(url)
+            self.texts.append(text)
+            self.titles.append(title)
+            self.doc_of[url] = doc
+            for gram in trigrams(text):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("i")
+                posting.append(doc)
+            if self.dead > 1000 and self.dead * 2 > len(self.urls):
+                self.compact()
+
+    def compact(self):
+        """Rebuild the postings without the songs that were replaced."""
+        live = [
+            (url, text, title)
+            for url, text, title in zip(self.urls, self.texts, self.titles)
+            if url is not None
+        ]
+        self.urls = [url for url, _, _ in live]
+        self.texts = [text for _, text, _ in live]
+        self.titles = [title for _, _, title in live]
+        self.doc_of = {url: doc for doc, url in enumerate(self.urls)}
+        self.postings = {}
+        for doc, text in enumerate(self.texts):
+            for gram in trigrams(text):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("i")
+                posting.append(doc)
+        self.dead = 0
+
+    def matches(self, part: str) -> Set[int]:
+        """Get every song whose id, title or url contains part."""
+        if len(part) < 3:
+            candidates = range(len(self.texts))
+        else:
+            candidates = None
+            for gram in trigrams(part):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return set()
+                if candidates is None or len(posting) < len(candidates):
+                    candidates = posting
+        texts = self.texts
+        return {doc for doc in candidates if part in texts[doc]}
+
+    def search(
+        self, query: str, do_sub: bool = True, do_maxsearch: bool = False
+    ) -> List[str]:
+        """Find the urls of the songs that best match query.
+
+        Songs containing the whole query come first.  Failing that, with
+        do_sub, songs that contain every part of the query that's in the index,
+        and failing that, with do_maxsearch, songs that contain the most parts.
+
+        Args:
+            query (str): The search query.
+            do_sub (bool, optional): Match the query's parts separately. Defaults to True.
+            do_maxsearch (bool, optional): Allow songs that only match some parts. Defaults to False.
+
+        Returns:
+            List[str]: Up to 10 urls, or 15 for an all parts match, best first.
+        """
+        whole = query.lower()
+        parts = [p.lower() for p in query_parts(query)] if do_sub else []
+        with self.lock:
+            found = {
+                part: self.matches(part) for part in dict.fromkeys([whole, *parts])
+            }
+            counts: Counter = Counter()
+            for part in parts:
+                counts.update(found[part])
+            if found[whole]:
+                pool, limit = found[whole], 10
+            elif parts:
+                matched = sum(1 for part in parts if found[part])
+                pool = {doc for doc, count in counts.items() if count == matched}
+                limit = 15
+                if not pool and do_maxsearch:
+                    pool, limit = set(counts), 10
+            else:
+                pool = set()
+            titles = self.titles
+
+            def rank(doc: int):
+                in_title = sum(1 for part in found if part in titles[doc])
+                return (-counts[doc], -in_title, doc)
+
+            return [self.urls[doc] for doc in sorted(pool, key=rank)[:limit]]
@@ -3,6 +3,7 @@ from discord.ext import commands, tasks
 from .MessageTemplates_EXT import MessageTemplatesMusic
 import os
 import re
+from typing import Optional
 
 
 async def connection_check(
@@ -61,3 +62,11 @@ def is_url(text: str):
         return True
     else:
         return False
+
+
+def youtube_id(url: str) -> Optional[str]:
+    """Get the video id out of a youtube link, None if it isn't one."""
+    match = re.search(r"(?:youtu\.be/|[?&]v=|/shorts/)([\w-]{11})", url)
+    if match and "youtu" in url:
+        return match.group(1)
+    return None
@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import discord
+import gui
+from utility.debug import percentile
+
+from .AudioContainer import AudioContainer
+
+"""
+Look ahead stream resolution for the music player.
+
+Looking up a stream url with yt_dlp takes a second or more, and used to happen
+right when a song was about to play, leaving a gap between songs.  The prefetcher
+resolves the sources of the next few queued songs in the background, and checks
+again right before playback so a source that is about to expire gets refreshed
+instead of failing partway through the song.
+"""
+
+PREFETCH_AHEAD = 2
+# A source has to stay valid for this many seconds past the end of the song.
+REFRESH_MARGIN = 120.0
+# Songs longer than this are treated as this long when checking for expiry.
+MAX_PLAY_WINDOW = 3600.0
+
+
+class TimedAudio(discord.AudioSource):
+    """Wraps an AudioSource and records when its first frame of audio is read.
+
+    Args:
+        original (discord.AudioSource): The source to play.
+        record (Dict[str, Any]): Track metrics, "first_audio" is set on the first frame.
+    """
+
+    def __init__(self, original: discord.AudioSource, record: Dict[str, Any]):
+        self.original = original
+        self.record = record
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data and self.record.get("first_audio") is None:
+            self.record["first_audio"] = time.monotonic() - self.record["requested"]
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class SourcePrefetcher:
+    """Resolves the sources of upcoming songs ahead of time.
+
+    Args:
+        ahead (int, optional): How many queued songs to keep resolved. Defaults to PREFETCH_AHEAD.
+        margin (float, optional): Seconds a source must outlast the song by. Defaults to REFRESH_MARGIN.
+    """
+
+    def __init__(self, ahead: int = PREFETCH_AHEAD, margin: float = REFRESH_MARGIN):
+        self.ahead = ahead
+        self.margin = margin
+        self.pending: Dict[int, asyncio.Task] = {}
+        self.tracks: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self.resolved = 0
+        self.failed = 0
+        self.hits = 0
+        self.refreshed = 0
+        self.misses = 0
+
+    def required_lifetime(self, song: AudioContainer) -> float:
+        """Seconds the source of song needs to stay valid for to be played.
+
+        Live streams have no duration, so they get the full play window."""
+        if song.duration is None:
+            return MAX_PLAY_WINDOW + self.margin
+        return min(song.duration, MAX_PLAY_WINDOW) + self.margin
+
+    def should_prefetch(self, song: AudioContainer) -> bool:
+        if song.state != "Ok":
+            return False
+        if song.source_valid_for(self.required_lifetime(song)):
+            return False
+        # Don't keep looking up a host's short lived urls over and over.
+        if song.source_resolved_at is not None:
+            return time.time() - song.source_resolved_at > self.margin
+        return True
+
+    def schedule(self, songs: List[AudioContainer]):
+        """Start resolving the next few songs in songs in the background."""
+        for song in songs[: self.ahead]:
+            key = id(song)
+            if key in self.pending or not self.should_prefetch(song):
+                continue
+            task = asyncio.create_task(self.resolve(song))
+            task.add_done_callback(lambda t, key=key: self.pending.pop(key, None))
+            self.pending[key] = task
+
+    async def resolve(self, song: AudioContainer):
+        try:
+            source = await asyncio.to_thread(song.resolve_source)
+        except Exception as e:
+            # Playback will try again, and report the error if it still fails.
+            self.failed += 1
+            gui.dprint(f"could not prefetch {song.title}: {e}")
+            return
+        song.set_source(source)
+        self.resolved += 1
+
+    async def ready(self, song: AudioContainer) -> str:
+        """Make sure song has a source that will last until it's done playing.
+
+        Waits on the song's prefetch if it's still running, and looks up a new
+        source if there isn't one or it expires too soon.  Sets the song's
+        state to "Error" if the lookup fails.
+
+        Args:
+            song (AudioContainer): The song about to be played.
+
+        Returns:
+            str: "prefetched", "refreshed", or "resolved".
+        """
+        task = self.pending.get(id(song))
+        if task is not None:
+            await asyncio.shield(task)
+        if song.source_valid_for(self.required_lifetime(song)):
+            self.hits += 1
+            return "prefetched"
+        how = "resolved"
+        if song.source is not None:
+            how = "refreshed"
+            self.refreshed += 1
+        else:
+            self.misses += 1
+        await asyncio.to_thread(song.get_source)
+        return how
+
+    def track_started(
+        self, song: AudioContainer, how: str, requested: float, wait: float
+    ) -> Dict[str, Any]:
+        """Start the metrics record for a song that's about to play.
+
+        Args:
+            song (AudioContainer): The song.
+            how (str): What ready returned for it.
+            requested (float): time.monotonic() when the song was asked to play.
+            wait (float): Seconds spent waiting on its source.
+
+        Returns:
+            Dict[str, Any]: The record, to pass into TimedAudio.
+        """
+        record = {
+            "title": song.title,
+            "source": how,
+            "requested": requested,
+            "source_wait": wait,
+            "first_audio": None,
+        }
+        self.tracks.append(record)
+        return record
+
+    def first_audio_percentiles(self) -> Optional[Dict[str, float]]:
+        """p50, p95 and max seconds from a song being asked to play to its first audio."""
+        times = [
+            r["first_audio"] for r in self.tracks if r["first_audio"] is not None
+        ]
+        if not times:
+            return None
+        return {
+            "p50": percentile(times, 0.5),
+            "p95": percentile(times, 0.95),
+            "max": percentile(times, 1.0),
+        }
+
+    def status_string(self) -> str:
+        text = (
+            f"{self.hits} prefetched, {self.refreshed} refreshed, {self.misses} resolved at play time\n"
+            f"{self.resolved} background lookups, {self.failed} failed, {len(self.pending)} running"
+        )
+        lat = self.first_audio_percentiles()
+        if lat:
+            text += (
+                f"\ntime to first audio p50 {lat['p50']:.2f}s, "
+                f"p95 {lat['p95']:.2f}s, max {lat['max']:.2f}s"
+            )
+        for record in list(self.tracks)[-5:]:
+            first = record["first_audio"]
+            first = f"{first:.2f}s" if first is not None else "n/a"
+            text += f"\n{record['title']}: {first} ({record['source']}, waited {record['source_wait']:.2f}s)"
+        return text
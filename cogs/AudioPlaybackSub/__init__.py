@@ -8,7 +8,10 @@ from .MusicPlayer import MusicPlayer, PlaylistPageContainer
 from .MusicPlayerManager import MusicManager
 from .MusicViews import PlayerButtons, PlaylistButtons
 from .MusicUtils import connection_check, get_audio_directory, get_directory_size
+from .SourcePrefetch import SourcePrefetcher, TimedAudio
+from .MusicSearch import MusicSearchIndex
 from .MusicDatabase import UserMusicProfile, UserUploads, MusicJSONMemoryDB
+from .MediaProbe import MediaProbeCache
 
 
 async def setup(bot):
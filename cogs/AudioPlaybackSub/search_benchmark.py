@@ -0,0 +1,121 @@
+import random
+import sqlite3
+import string
+import time
+from typing import Any, Dict, List
+
+from utility.debug import percentile
+
+from .MusicSearch import MusicSearchIndex, query_parts
+
+"""
+Benchmark for MusicSearchIndex against the ilike queries it replaced.
+
+Builds a made up library, then times the same searches through the index
+and through the old queries on an in memory sqlite copy:
+
+    python -m cogs.AudioPlaybackSub.search_benchmark
+"""
+
+
+def legacy_sql_search(
+    conn: sqlite3.Connection, query: str, do_maxsearch: bool = False
+) -> List[str]:
+    """The queries MusicJSONMemoryDB.search used to run, for comparison."""
+    fields = "(id LIKE ? OR title LIKE ? OR url LIKE ?)"
+    like = f"%{query}%"
+    rows = conn.execute(
+        f"SELECT url FROM songs WHERE {fields} LIMIT 10", (like, like, like)
+    ).fetchall()
+    if rows:
+        return [r[0] for r in rows]
+    parts = query_parts(query)
+    args: List[Any] = []
+    for part in parts:
+        args.extend([f"%{part}%"] * 3)
+    sums = ", ".join(f"SUM(CASE WHEN {fields} THEN 1 ELSE 0 END)" for _ in parts)
+    counts = conn.execute(f"SELECT {sums} FROM songs", args).fetchone()
+    present = [p for p, c in zip(parts, counts) if c]
+    if not present:
+        return []
+    args = []
+    for part in present:
+        args.extend([f"%{part}%"] * 3)
+    where = " AND ".join(fields for _ in present)
+    rows = conn.execute(
+        f"SELECT url FROM songs WHERE {where} LIMIT 15", args
+    ).fetchall()
+    if rows or not do_maxsearch:
+        return [r[0] for r in rows]
+    score = " + ".join(f"(CASE WHEN {fields} THEN 1 ELSE 0 END)" for _ in present)
+    rows = conn.execute(
+        f"SELECT url, {score} AS total FROM songs GROUP BY url ORDER BY total DESC LIMIT 10",
+        args,
+    ).fetchall()
+    return [r[0] for r in rows if r[1] > 0]
+
+
+def search_benchmark(count: int = 100000, queries: int = 200) -> Dict[str, Any]:
+    """Compare the index against the old ilike queries on a made up library.
+
+    Args:
+        count (int, optional): Songs in the library. Defaults to 100000.
+        queries (int, optional): Searches to time. Defaults to 200.
+
+    Returns:
+        Dict[str, Any]: Build time, and query percentiles in milliseconds for both.
+    """
+    rng = random.Random(0)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+        for _ in range(5000)
+    ]
+    alphabet = string.ascii_letters + string.digits + "-_"
+    rows = []
+    for _ in range(count):
+        vid = "".join(rng.choices(alphabet, k=11))
+        title = " ".join(rng.choices(words, k=rng.randint(2, 7)))
+        rows.append((f"https://www.youtube.com/watch?v={vid}", vid, title))
+
+    start = time.perf_counter()
+    index = MusicSearchIndex.from_rows(rows)
+    build = time.perf_counter() - start
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE songs (url TEXT PRIMARY KEY, id TEXT, title TEXT)")
+    conn.executemany("INSERT INTO songs VALUES (?, ?, ?)", rows)
+
+    samples = []
+    for _ in range(queries):
+        url, vid, title = rng.choice(rows)
+        kind = rng.random()
+        if kind < 0.4:
+            samples.append(title.split()[0] + " " + rng.choice(words))
+        elif kind < 0.7:
+            samples.append(" ".join(title.split()[:2]))
+        elif kind < 0.9:
+            samples.append(f"https://youtu.be/{vid}")
+        else:
+            samples.append(rng.choice(words)[:4] + "zq")
+
+    def timed(fn) -> Dict[str, float]:
+        times = []
+        for q in samples:
+            t = time.perf_counter()
+            fn(q)
+            times.append((time.perf_counter() - t) * 1000)
+        return {
+            "p50_ms": round(percentile(times, 0.5), 3),
+            "p99_ms": round(percentile(times, 0.99), 3),
+        }
+
+    return {
+        "songs": count,
+        "build_s": round(build, 3),
+        "index": timed(lambda q: index.search(q, do_maxsearch=True)),
+        "sql_like": timed(lambda q: legacy_sql_search(conn, q, do_maxsearch=True)),
+    }
+
+
+if __name__ == "__main__":
+    print(search_benchmark())
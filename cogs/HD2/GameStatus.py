@@ -9,6 +9,8 @@ import numpy as np
 from utility.debug import Timer
 
 from .diff_util import detect_loggable_changes, detect_loggable_changes_planet
+from .galaxy_graph import GalaxyGraph
+from .stats_store import StatsStore
 from hd2api import *
 from .utils import prioritized_string_split
 from discord.utils import format_dt as fdt
@@ -142,6 +144,7 @@ class ApiStatus:
         "stations",
         "last_station_time",
         "deadzone",
+        "graph",
     ]
 
     def __init__(self, client: APIConfig = APIConfig(), max_list_size=8, direct=False):
@@ -169,6 +172,7 @@ class ApiStatus:
         self.last_station_time = datetime.datetime(2024, 1, 1, 1, 1, 0)
         self.getlock = asyncio.Lock()
         self.deadzone = False
+        self.graph: Optional[GalaxyGraph] = None
 
     def to_dict(self):
         return {
@@ -232,6 +236,7 @@ class ApiStatus:
         else:
             newcks.resources = {}
         newcks.planets = {int(k): Planet(**v) for k, v in data["planets"].items()}
+        newcks.refresh_graph()
         newcks.dispatches = [Dispatch(**d) for d in data["dispatches"]]
         if "warstat" in data:
             newcks.warstat = WarStatus(**data["warstat"])
@@ -377,6 +382,13 @@ class ApiStatus:
             planet = build_planet_2(i, self.warall, self.statics)
             planet_data[i] = planet
         self.planets = build_all_planets(self.warall, self.statics)
+        self.refresh_graph()
+
+    def refresh_graph(self):
+        """Rebuild the warp link graph if the waypoints changed, and update planet owners."""
+        if self.graph is None or not self.graph.matches(self.planets):
+            self.graph = GalaxyGraph(self.planets)
+        self.graph.update_owners(self.planets)
 
     def handle_data(
         self,
@@ -524,40 +536,34 @@ class ApiStatus:
     def get_planet_fronts(self, planet: Planet) -> List[str]:
         """Get the "front" of the planet.  The front is all factions connected to it via
         warp link."""
-        results = self.depth_first_planet_search(planet)
-
-        fronts = set()
-        for index in results:
-            planet = self.planets.get(index, None)
-            if planet:
-
-                fronts.add(planet.currentOwner.upper())
+        if self.graph is None:
+            self.refresh_graph()
+        return list(self.graph.fronts(planet.index))
 
-        return list(fronts)
+    def depth_first_planet_search(self, planet: Planet) -> List[int]:
+        """Get the indexes of every planet connected to planet by warp links."""
+        if self.graph is None:
+            self.refresh_graph()
+        return sorted(self.graph.component(planet.index))
 
-    def depth_first_planet_search(self, planet: Planet) -> int:
-        visited = set()
-        stack = [planet.index]
+    def supply_path(
+        self, start: Planet, goal: Planet, owner: Optional[str] = None
+    ) -> List[Planet]:
+        """Find the fewest warp jumps from start to goal.
 
-        result = []
+        Args:
+            start (Planet): The first planet.
+            goal (Planet): The last planet.
+            owner (Optional[str], optional): Only pass through planets this faction owns. Defaults to None.
 
-        while stack:
-            planet_ind = stack.pop()
-            planet = self.planets.get(planet_ind, None)
-            if not planet:
-                continue
-            if planet.index not in visited:
-                # fronts.add(planet.currentOwner.upper())
-                visited.add(planet.index)
-                result.append(planet.index)
-                for neighbor_index in planet.waypoints:
-                    if neighbor_index not in visited:
-                        stack.append(neighbor_index)
-                for k, p in self.planets.items():
-                    if planet_ind in p.waypoints:
-                        if k not in visited:
-                            stack.append(planet_ind)
-        return result
+        Returns:
+            List[Planet]: The planets along the way, empty if there is no path.
+        """
+        if self.graph is None:
+            self.refresh_graph()
+        through = self.graph.owned_by(owner) if owner else None
+        path = self.graph.shortest_path(start.index, goal.index, through)
+        return [self.planets[index] for index in path]
 
     def calculate_total_impact(self):
         all_players, last = self.war.get_first_change()
@@ -666,15 +672,13 @@ biome_map = {
 
 
 def add_to_csv(stat: ApiStatus):
-    """Add the data from the last period of time to the csv file."""
+    """Add the data from the last period of time to the statistics store."""
     # Get the first change in the war statistics
     # print(type(stat), stat.war)
     war, lastwar = stat.war.get_first_change()
     mp_mult = (war.impactMultiplier + lastwar.impactMultiplier) / 2
     all_players = war.statistics.playerCount
 
-    # Prepare a list to hold the rows to be written to the CSV
-    rows = []
     rows_for_new = []
     now = datetime.datetime.now(tz=datetime.timezone.utc)
 
@@ -738,19 +742,6 @@ def add_to_csv(stat: ApiStatus):
             if bname:
                 biome = bname
 
-        row = {
-            "timestamp": timestamp,
-            "player_count": players,
-            "mode": mode,
-            "mp_mult": war.impactMultiplier,
-            "wins_per_sec": wins,
-            "loss_per_sec": loss,
-            "decay_rate": decay,
-            "kills_per_sec": kills,
-            "deaths_per_sec": deaths,
-            "eps": eps,
-        }
-
         row2 = {
             "timestamp": timestamp,
             "player_count": players,
@@ -772,17 +763,8 @@ def add_to_csv(stat: ApiStatus):
             "attacker": faction_map.get(attacker, 4),
         }
 
-        # Append the row to the list of rows
-        rows.append(row)
         rows_for_new.append(row2)
 
-    # Define the CSV file path
-    csv_newfile_path = "statistics_newer.csv"
-    csv_file_path = "statistics.csv"
-    csv_impact_track = "impact_track.csv"
-
-    csv_funnynumber= "funny_number_track.csv"
-
     diver_amount, total_players, diverpercent, total_contrib, per_second = (
         stat.calculate_total_impact()
     )
@@ -796,63 +778,24 @@ def add_to_csv(stat: ApiStatus):
             "per_second": per_second,
         }
     ]
-    rows_for_number=[]
+    rows_for_number = []
     for i in stat.warall.status.globalResources:
         rows_for_number.append(
             {
                 "timestamp": timestamp,
                 "id": i.id32,
                 "value": i.currentValue,
-                "maxValue":i.maxValue
+                "maxValue": i.maxValue,
             }
         )
 
-    with open(csv_impact_track, mode="a+", newline="", encoding="utf8") as file:
-        writer = csv.DictWriter(file, fieldnames=rows_for_imp[0].keys())
-
-        # If the file is empty, write the header
-        if file.tell() == 0:
-            writer.writeheader()
-
-        # Write the rows
-        for row in rows_for_imp:
-            writer.writerow(row)
-    # Write the rows to the CSV file
-    # print(rows)
-    if not rows:
-        return
-    with open(csv_file_path, mode="a", newline="", encoding="utf8") as file:
-        writer = csv.DictWriter(file, fieldnames=rows[0].keys())
-
-        # If the file is empty, write the header
-        if file.tell() == 0:
-            writer.writeheader()
-
-        # Write the rows
-        for row in rows:
-            writer.writerow(row)
-
-    with open(csv_newfile_path, mode="a", newline="", encoding="utf8") as file:
-        writer = csv.DictWriter(file, fieldnames=rows_for_new[0].keys())
-
-        # If the file is empty, write the header
-        if file.tell() == 0:
-            writer.writeheader()
-
-        # Write the rows
-        for row in rows_for_new:
-            writer.writerow(row)
-
-    with open(csv_funnynumber, mode="a+", newline="", encoding="utf8") as file:
-        writer = csv.DictWriter(file, fieldnames=rows_for_number[0].keys())
-
-        # If the file is empty, write the header
-        if file.tell() == 0:
-            writer.writeheader()
-
-        # Write the rows
-        for row in rows_for_number:
-            writer.writerow(row)
+    store = StatsStore.get()
+    store.append("impact_track", rows_for_imp)
+    store.append("resource_track", rows_for_number)
+    store.append("campaign_stats", rows_for_new)
+    # Polls are minutes apart, so write this one's rows now in one
+    # transaction rather than leave them for a crash to lose.
+    store.flush()
 
 
 def get_feature_dictionary(
@@ -23,10 +23,13 @@ from .predict import (
     predict_needed_players,
     make_prediction_for_eps,
     predict_eps_for_players,
+    predict_campaign_eps,
+    PredictionService,
 )
 from .buttons import ListButtons
 from .makeplanets import get_planet
 from .diff_util import GameEvent
+from .stats_store import StatsStore
 
 
 async def setup(bot):
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from hd2api.models import DiveharderAll
+
+from utility.debug import Timer
+
+from .diff_util import (
+    EventModes,
+    GameEvent,
+    StructuralDiff,
+    legacy_differing_fields,
+    process_planet_attacks,
+    process_planet_events,
+)
+
+logs = logging.getLogger("TCLogger")
+
+"""
+Replays recorded snapshots through the event matchers detect_loggable_changes
+used before the keyed index, and the ones it uses now, to check that both
+queue the same events.
+"""
+
+
+async def legacy_check_compare_value(key, value, target: List[Dict[str, Any]]):
+    for s in target:
+        if s[key] == value:
+            return s
+    return None
+
+
+async def legacy_check_compare_value_list(
+    keys: List[str], values: List[Any], target: List[Dict[str, Any]]
+):
+    for s in target:
+        if all(s[key] == value for key, value in zip(keys, values)):
+            return s
+    return None
+
+
+async def legacy_process_planet_events(
+    source, target, place, key, QueueAll, batch, exclude=[], game_time=0
+):
+    """process_planet_events as it was before the keyed index, kept for replay_events."""
+    pushed_items = []
+    new, old, change = [], [], []
+    for event in source:
+        oc = await legacy_check_compare_value(key, event[key], target)
+        if not oc:
+            item = GameEvent(
+                mode=EventModes.NEW, place=place, batch=batch, value=event, game_time=game_time
+            )
+            pushed_items.append(item)
+            new.append(item)
+        else:
+            differ = await legacy_differing_fields(oc, event, to_ignore=exclude)
+            if differ:
+                item = GameEvent(
+                    mode=EventModes.CHANGE,
+                    place=place,
+                    batch=batch,
+                    value=(event, differ),
+                    game_time=game_time,
+                )
+                pushed_items.append(item)
+                change.append(item)
+
+    for event in target:
+        if not await legacy_check_compare_value(key, event[key], source):
+            item = GameEvent(
+                mode=EventModes.REMOVE,
+                place=place,
+                batch=batch,
+                value=event,
+                game_time=game_time,
+            )
+            pushed_items.append(item)
+            old.append(item)
+    if new:
+        await QueueAll.put(new)
+
+    if change:
+        await QueueAll.put(change)
+
+    if old:
+        await QueueAll.put(old)
+    return pushed_items
+
+
+async def legacy_process_planet_attacks(
+    source, target, place, keys, QueueAll, batch, exclude=[], game_time=0
+):
+    """process_planet_attacks as it was before the keyed index, kept for replay_events."""
+    pushed_items = []
+    newlist = []
+    oldlist = []
+    for event in source:
+        oc = await legacy_check_compare_value_list(keys, [event[key] for key in keys], target)
+        if not oc:
+            print(place, EventModes.NEW, event)
+            item = GameEvent(mode=EventModes.NEW, place=place, batch=batch, value=event)
+            newlist.append(item)
+            pushed_items.append(item)
+            # await QueueAll.put(item)
+
+    for event in target:
+        if not await legacy_check_compare_value_list(
+            keys, [event[key] for key in keys], source
+        ):
+            item = GameEvent(
+                mode=EventModes.REMOVE,
+                place=place,
+                batch=batch,
+                value=event,
+                game_time=game_time,
+            )
+            pushed_items.append(item)
+            oldlist.append(item)
+            # await QueueAll.put(item)
+
+    if place == "planetAttacks":
+        if newlist:
+            newitem = GameEvent(
+                mode=EventModes.ADDED,
+                place=place,
+                batch=batch,
+                value=newlist,
+                cluster=True,
+                game_time=game_time,
+            )
+            await QueueAll.put([newitem])
+        if oldlist:
+            olditem = GameEvent(
+                mode=EventModes.REMOVED,
+                place=place,
+                batch=batch,
+                value=oldlist,
+                cluster=True,
+                game_time=game_time,
+            )
+            await QueueAll.put([olditem])
+    else:
+        combined_list = oldlist + newlist
+        await QueueAll.put(combined_list)
+    return pushed_items
+
+
+def replay_lists(old: DiveharderAll, new: DiveharderAll) -> List[tuple]:
+    """The lists detect_loggable_changes matches up between two snapshots.
+
+    Sectors are left out, since they need the statics.
+
+    Returns:
+        List[tuple]: (place, new list, old list, key or keys, fields to ignore).
+    """
+    exclude = ["retrieved_at", "time_delta", "self"]
+    status, old_status = new.status, old.status
+    lists = [
+        (
+            "planetAttacks",
+            status.planetAttacks,
+            old_status.planetAttacks,
+            ["source", "target"],
+            exclude,
+        ),
+        (
+            "planetEffects",
+            status.planetActiveEffects,
+            old_status.planetActiveEffects,
+            ["index", "galacticEffectId"],
+            exclude,
+        ),
+        ("station", status.spaceStations, old_status.spaceStations, "id32", exclude),
+        (
+            "resources",
+            status.globalResources,
+            old_status.globalResources,
+            "id32",
+            exclude,
+        ),
+        ("campaign", status.campaigns, old_status.campaigns, "id", exclude),
+        (
+            "planetevents",
+            status.planetEvents,
+            old_status.planetEvents,
+            "id",
+            ["health"] + exclude,
+        ),
+        (
+            "planets",
+            status.planetStatus,
+            old_status.planetStatus,
+            "index",
+            ["health", "players", "position"] + exclude,
+        ),
+        (
+            "globalEvents",
+            status.globalEvents,
+            old_status.globalEvents,
+            "eventId",
+            exclude,
+        ),
+    ]
+    if new.news_feed is not None and old.news_feed is not None:
+        lists.append(("news", new.news_feed, old.news_feed, "id", exclude))
+    if new.war_info is not None and old.war_info is not None:
+        lists.append(
+            (
+                "planetInfo",
+                new.war_info.planetInfos,
+                old.war_info.planetInfos,
+                "index",
+                exclude,
+            )
+        )
+    return lists
+
+
+async def replay_events(snapshots: List[DiveharderAll]) -> List[Dict[str, Any]]:
+    """Replay each consecutive pair of snapshots through the legacy and current matchers.
+
+    Both get the same lists detect_loggable_changes would give them, and
+    the events they return and queue have to be identical.
+
+    Args:
+        snapshots (List[DiveharderAll]): Recorded snapshots, such as the ones
+            HelldiversAutoLog.load_test_files loads.
+
+    Returns:
+        List[Dict[str, Any]]: One row per pair, with both timings in seconds,
+            the number of events, and the places where the two disagreed.
+    """
+    rows = []
+    for i in range(1, len(snapshots)):
+        old, new = snapshots[i - 1], snapshots[i]
+        legacy_time = new_time = 0.0
+        events = 0
+        mismatched = []
+        differ = StructuralDiff()
+        for place, source, target, key, exclude in replay_lists(old, new):
+            legacy_queue, new_queue = asyncio.Queue(), asyncio.Queue()
+            if isinstance(key, list):
+                with Timer() as timer:
+                    legacy_items = await legacy_process_planet_attacks(
+                        source, target, place, key, legacy_queue, i, exclude
+                    )
+                legacy_time += timer.get_time()
+                with Timer() as timer:
+                    new_items = await process_planet_attacks(
+                        source, target, place, key, new_queue, i, exclude
+                    )
+                new_time += timer.get_time()
+            else:
+                with Timer() as timer:
+                    legacy_items = await legacy_process_planet_events(
+                        source, target, place, key, legacy_queue, i, exclude
+                    )
+                legacy_time += timer.get_time()
+                with Timer() as timer:
+                    new_items = await process_planet_events(
+                        source,
+                        target,
+                        place,
+                        key,
+                        new_queue,
+                        i,
+                        exclude,
+                        differ=differ,
+                    )
+                new_time += timer.get_time()
+            legacy_queued = [
+                legacy_queue.get_nowait() for _ in range(legacy_queue.qsize())
+            ]
+            new_queued = [new_queue.get_nowait() for _ in range(new_queue.qsize())]
+            events += len(new_items)
+            if legacy_items != new_items or legacy_queued != new_queued:
+                mismatched.append(place)
+        rows.append(
+            {
+                "pair": i,
+                "legacy": legacy_time,
+                "indexed": new_time,
+                "events": events,
+                "mismatched": mismatched,
+            }
+        )
+        logs.info("event replay %s", rows[-1])
+    return rows
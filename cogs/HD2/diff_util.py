@@ -12,8 +12,11 @@ from enum import Enum
 from pydantic import Field
 import discord
 import asyncio
+import hashlib
 import random
 
+from utility.debug import Timer
+
 
 class EventModes(Enum):
     NEW = 1
@@ -46,101 +49,235 @@ class GameEvent(BaseApiModel):
     game_time: Optional[int] = Field(alias="game_time", default=0)
 
 
-async def compare_value_with_timeout(model1, field):
+DEFAULT_IGNORE = frozenset({"retrieved_at", "time_delta", "self"})
+MAX_DEPTH = 20
+
+
+def as_ignore_set(to_ignore: Optional[Iterable[str]]) -> FrozenSet[str]:
+    if to_ignore is None:
+        return DEFAULT_IGNORE
+    return frozenset(to_ignore)
+
+
+def sorted_list(value: list) -> list:
+    """Sorted copy of value, or value itself if the items can't be ordered."""
     try:
-        value = await asyncio.wait_for(
-            asyncio.to_thread(model1.get, field, None), timeout=5
-        )
-        if isinstance(value, list):
-            # TODO: replace with something less
-            # hacky later.
-            try:
-                value.sort()
-            except TypeError:
-                print(value, "unsortable")
+        return sorted(value)
+    except TypeError:
         return value
-    except asyncio.TimeoutError as e:
-        logs.error("Could not get field %s ", field, exc_info=e)
-        raise e
 
 
-async def compare_values(val1, val2, lvd, to_ignore: Set[str]):
-    if isinstance(val1, BaseApiModel) and isinstance(val2, BaseApiModel):
-        return await get_differing_fields(val1, val2, lvd + 1, to_ignore)
-    elif isinstance(val1, list) and isinstance(val2, list):
+def dump_value(value):
+    if isinstance(value, BaseApiModel):
+        return value.model_dump(exclude=["retrieved_at", "time_delta"])
+    return value
+
+
+class StructuralDiff:
+    """
+    Hash based structural diff between two snapshots of the same api models.
+
+    Every model and list is hashed once, from the hashes of its children,
+    so two subtrees can be compared by digest and only fields whose digest
+    changed are descended into.  Leaf values hash their str(), which keeps
+    the old "str(v1) != str(v2)" comparison semantics.
+
+    Everything here is synchronous, run it in a single worker thread.
+    Digests are memoised per ignore set for the lifetime of the instance,
+    so make one instance per pair of snapshots and pass it to every diff
+    made between them.
+    """
+
+    def __init__(self, to_ignore: Optional[Iterable[str]] = None):
+        self.to_ignore = as_ignore_set(to_ignore)
+        # (id, ignore set) -> (object, digest); the object is held so its
+        # id can't be reused.
+        self.memo: Dict[Tuple[int, FrozenSet[str]], Tuple[Any, bytes]] = {}
+
+    def fields(self, model: BaseApiModel, ignore: FrozenSet[str]) -> List[str]:
+        return [f for f in type(model).model_fields if f not in ignore]
+
+    def digest(self, value: Any, ignore: FrozenSet[str]) -> bytes:
+        """Get the digest of value, computing it for every subtree on the first call."""
+        if not isinstance(value, (BaseApiModel, list)):
+            return hashlib.blake2b(
+                b"V" + str(value).encode(), digest_size=16
+            ).digest()
+        key = (id(value), ignore)
+        hit = self.memo.get(key)
+        if hit is not None and hit[0] is value:
+            return hit[1]
+        h = hashlib.blake2b(digest_size=16)
+        if isinstance(value, BaseApiModel):
+            h.update(b"M" + type(value).__qualname__.encode())
+            for field in self.fields(value, ignore):
+                h.update(field.encode())
+                h.update(self.digest(value.get(field, None), ignore))
+        else:
+            items = sorted_list(value)
+            h.update(b"L%d" % len(items))
+            for item in items:
+                h.update(self.digest(item, ignore))
+        out = h.digest()
+        self.memo[key] = (value, out)
+        return out
+
+    def same(self, val1: Any, val2: Any, ignore: FrozenSet[str]) -> bool:
+        return val1 is val2 or self.digest(val1, ignore) == self.digest(val2, ignore)
+
+    def compare_lists(
+        self, val1: list, val2: list, lvd: int, ignore: FrozenSet[str]
+    ) -> Optional[dict]:
         list_diffs = {}
-        if len(val1) != len(val2):
-            # print(len(val1),len(val2))
-            biggestsize = max(len(val1), len(val2))
-
-            for i in range(biggestsize):
-                v1 = val1[i] if i < len(val1) else None
-                v2 = val2[i] if i < len(val2) else None
-                if isinstance(v1, BaseApiModel) and isinstance(v2, BaseApiModel):
-                    differing = await get_differing_fields(v1, v2, lvd + 1, to_ignore)
+        same_size = len(val1) == len(val2)
+        for i in range(max(len(val1), len(val2))):
+            v1 = val1[i] if i < len(val1) else None
+            v2 = val2[i] if i < len(val2) else None
+            if isinstance(v1, BaseApiModel) and isinstance(v2, BaseApiModel):
+                if not self.same(v1, v2, ignore):
+                    differing = self.diff(v1, v2, lvd + 1, ignore)
                     if differing:
                         list_diffs[i] = differing
-                elif str(v1) != str(v2):
-                    target = {}
+            elif str(v1) != str(v2):
+                if same_size:
+                    list_diffs[i] = {"old": dump_value(v1), "new": dump_value(v2)}
+                else:
                     target = {
-                        k: v for k, v in zip(["old", "new"], [v1, v2]) if v is not None
+                        k: dump_value(v)
+                        for k, v in zip(["old", "new"], [v1, v2])
+                        if v is not None
                     }
                     if target:
-                        nt = {}
-                        for m, n in target.items():
-                            if isinstance(n, BaseApiModel):
-                                nt[m] = n.model_dump(
-                                    exclude=["retrieved_at", "time_delta"]
-                                )
-                            else:
-                                nt[m] = n
-                        list_diffs[i] = nt
-        else:
-            for i, (v1, v2) in enumerate(zip(val1, val2)):
-                if isinstance(v1, BaseApiModel) and isinstance(v2, BaseApiModel):
-                    differing = await get_differing_fields(v1, v2, lvd + 1, to_ignore)
-                    if differing:
-                        list_diffs[i] = differing
-                elif str(v1) != str(v2):
-                    if isinstance(v1, BaseApiModel):
-                        v1 = v1.model_dump(exclude=["retrieved_at", "time_delta"])
-                    if isinstance(v2, BaseApiModel):
-                        v2 = v2.model_dump(exclude=["retrieved_at", "time_delta"])
-                    list_diffs[i] = {"old": v1, "new": v2}
+                        list_diffs[i] = target
+        return list_diffs if list_diffs else None
+
+    def diff(
+        self,
+        model1: BaseApiModel,
+        model2: BaseApiModel,
+        lvd: int = 0,
+        to_ignore: Optional[Iterable[str]] = None,
+    ) -> dict:
+        """Get the fields that differ between model1 and model2.
+
+        Args:
+            model1 (BaseApiModel): The old model.
+            model2 (BaseApiModel): The new model, of the same type as model1.
+            lvd (int, optional): Current recursion depth. Defaults to 0.
+            to_ignore (Optional[Iterable[str]], optional): Fields to skip. Defaults to the instance's.
+
+        Returns:
+            dict: Nested dict of changed fields, with {"old":..., "new":...} at the leaves.
+        """
+        if type(model1) is not type(model2):
+            raise ValueError("Both models must be of the same type")
+        if lvd > MAX_DEPTH:
+            return "ERROR"
+        ignore = self.to_ignore if to_ignore is None else frozenset(to_ignore)
+
+        differing_fields = {}
+        for field in self.fields(model1, ignore):
+            value1 = model1.get(field, None)
+            value2 = model2.get(field, None)
+            if self.same(value1, value2, ignore):
+                continue
+            if isinstance(value1, list):
+                value1 = sorted_list(value1)
+            if isinstance(value2, list):
+                value2 = sorted_list(value2)
+
+            if isinstance(value1, BaseApiModel) and isinstance(value2, BaseApiModel):
+                diffs = self.diff(value1, value2, lvd + 1, ignore)
+            elif isinstance(value1, list) and isinstance(value2, list):
+                diffs = self.compare_lists(value1, value2, lvd, ignore)
+            else:
+                diffs = str(value1) != str(value2)
+
+            if isinstance(diffs, dict):
+                if diffs:
+                    differing_fields[field] = diffs
+            elif diffs and value1 != value2:
+                differing_fields[field] = {
+                    "old": dump_value(value1),
+                    "new": dump_value(value2),
+                }
+        return differing_fields
+
+
+async def get_differing_fields(
+    model1: BaseApiModel,
+    model2: BaseApiModel,
+    lvd=0,
+    to_ignore=None,
+    differ: Optional[StructuralDiff] = None,
+) -> dict:
+    """Diff two models in a worker thread, see StructuralDiff.
 
+    Pass the differ made for the snapshot pair so its digests are reused.
+    """
+    if differ is None:
+        differ = StructuralDiff()
+    return await asyncio.to_thread(differ.diff, model1, model2, lvd, to_ignore)
+
+
+async def legacy_compare_value(model1, field):
+    value = await asyncio.wait_for(
+        asyncio.to_thread(model1.get, field, None), timeout=5
+    )
+    if isinstance(value, list):
+        try:
+            value.sort()
+        except TypeError:
+            pass
+    return value
+
+
+async def legacy_compare_values(val1, val2, lvd, to_ignore: Set[str]):
+    if isinstance(val1, BaseApiModel) and isinstance(val2, BaseApiModel):
+        return await legacy_differing_fields(val1, val2, lvd + 1, to_ignore)
+    elif isinstance(val1, list) and isinstance(val2, list):
+        list_diffs = {}
+        same_size = len(val1) == len(val2)
+        for i in range(max(len(val1), len(val2))):
+            v1 = val1[i] if i < len(val1) else None
+            v2 = val2[i] if i < len(val2) else None
+            if isinstance(v1, BaseApiModel) and isinstance(v2, BaseApiModel):
+                differing = await legacy_differing_fields(v1, v2, lvd + 1, to_ignore)
+                if differing:
+                    list_diffs[i] = differing
+            elif str(v1) != str(v2):
+                if same_size:
+                    list_diffs[i] = {"old": dump_value(v1), "new": dump_value(v2)}
+                else:
+                    target = {
+                        k: dump_value(v)
+                        for k, v in zip(["old", "new"], [v1, v2])
+                        if v is not None
+                    }
+                    if target:
+                        list_diffs[i] = target
         return list_diffs if list_diffs else None
     else:
         return str(val1) != str(val2)
 
 
-async def get_differing_fields(
+async def legacy_differing_fields(
     model1: BaseApiModel, model2: BaseApiModel, lvd=0, to_ignore=None
 ) -> dict:
+    """The field by field diff StructuralDiff replaced, only kept for benchmark_diff."""
     if type(model1) is not type(model2):
         raise ValueError("Both models must be of the same type")
-
-    if lvd > 20:
+    if lvd > MAX_DEPTH:
         return "ERROR"
-
-    if to_ignore is None:
-        to_ignore = set()
-        to_ignore.add("retrieved_at")
-        to_ignore.add("time_delta")
-        to_ignore.add("self")
-    elif isinstance(to_ignore, list):
-        to_ignore2 = set()
-        for l in to_ignore:
-            to_ignore2.add(l)
-        to_ignore = to_ignore2
+    to_ignore = as_ignore_set(to_ignore)
 
     differing_fields = {}
-    for field in model1.model_fields:
+    for field in type(model1).model_fields:
         if field not in to_ignore:
-            logs.info("Retrieving field %s ", field)
-            value1 = await compare_value_with_timeout(model1, field)
-            value2 = await compare_value_with_timeout(model2, field)
+            value1 = await legacy_compare_value(model1, field)
+            value2 = await legacy_compare_value(model2, field)
 
-            diffs = await compare_values(value1, value2, lvd, to_ignore)
+            diffs = await legacy_compare_values(value1, value2, lvd, to_ignore)
             if isinstance(diffs, dict):
                 if diffs:
                     differing_fields[field] = diffs
@@ -149,59 +286,110 @@ async def get_differing_fields(
             else:
                 if value1 == value2:
                     continue
-                if isinstance(value1, BaseApiModel):
-                    value1 = value1.model_dump(exclude=["retrieved_at", "time_delta"])
-                if isinstance(value2, BaseApiModel):
-                    value2 = value2.model_dump(exclude=["retrieved_at", "time_delta"])
-                differing_fields[field] = {"old": value1, "new": value2}
+                differing_fields[field] = {
+                    "old": dump_value(value1),
+                    "new": dump_value(value2),
+                }
 
     return differing_fields
 
 
-async def check_compare_value(key, value, target: List[Dict[str, Any]]):
-    for s in target:
-        if s[key] == value:
-            return s
-    return None
+async def benchmark_diff(snapshots: List[DiveharderAll]) -> List[Dict[str, Any]]:
+    """Time the legacy and structural diff over each consecutive pair of snapshots.
 
+    Args:
+        snapshots (List[DiveharderAll]): Recorded snapshots, such as the ones
+            HelldiversAutoLog.load_test_files loads.
+
+    Returns:
+        List[Dict[str, Any]]: One row per pair, with both timings in seconds and
+            whether both engines produced the same output.
+    """
+    rows = []
+    for i in range(1, len(snapshots)):
+        old, new = snapshots[i - 1], snapshots[i]
+        pairs = [(old.status, new.status)]
+        if old.war_info is not None and new.war_info is not None:
+            pairs.append((old.war_info, new.war_info))
+        legacy_out, new_out = [], []
+        with Timer() as legacy_timer:
+            for m1, m2 in pairs:
+                legacy_out.append(await legacy_differing_fields(m1, m2))
+        with Timer() as new_timer:
+            differ = StructuralDiff()
+            for m1, m2 in pairs:
+                new_out.append(await get_differing_fields(m1, m2, differ=differ))
+        rows.append(
+            {
+                "pair": i,
+                "legacy": legacy_timer.get_time(),
+                "structural": new_timer.get_time(),
+                "match": legacy_out == new_out,
+            }
+        )
+        logs.info("diff benchmark %s", rows[-1])
+    return rows
 
-async def check_compare_value_list(
-    keys: List[str], values: List[Any], target: List[Dict[str, Any]]
-):
-    for s in target:
-        if all(s[key] == value for key, value in zip(keys, values)):
-            return s
-    return None
+
+def index_by_keys(items: Iterable[Any], keys: List[str]) -> Dict[tuple, Any]:
+    """Map the values of keys in each item to the first item that has them."""
+    index = {}
+    for item in items:
+        index.setdefault(tuple(item[key] for key in keys), item)
+    return index
+
+
+def diff_pairs(
+    pairs: List[Tuple[Optional[BaseApiModel], BaseApiModel]],
+    differ: StructuralDiff,
+    to_ignore=None,
+) -> List[Optional[dict]]:
+    """Diff every (old, new) pair with differ, None where old is None."""
+    return [
+        differ.diff(old, new, to_ignore=to_ignore) if old is not None else None
+        for old, new in pairs
+    ]
 
 
 async def process_planet_events(
-    source, target, place, key, QueueAll, batch, exclude=[], game_time=0
+    source,
+    target,
+    place,
+    key,
+    QueueAll,
+    batch,
+    exclude=[],
+    game_time=0,
+    differ: Optional[StructuralDiff] = None,
 ):
     pushed_items = []
     new, old, change = [], [], []
-    for event in source:
-        oc = await check_compare_value(key, event[key], target)
-        if not oc:
+    if differ is None:
+        differ = StructuralDiff()
+    source_index = index_by_keys(source, [key])
+    target_index = index_by_keys(target, [key])
+    pairs = [(target_index.get((event[key],)), event) for event in source]
+    diffs = await asyncio.to_thread(diff_pairs, pairs, differ, exclude)
+    for (oc, event), delta in zip(pairs, diffs):
+        if oc is None:
             item = GameEvent(
                 mode=EventModes.NEW, place=place, batch=batch, value=event, game_time=game_time
             )
             pushed_items.append(item)
             new.append(item)
-        else:
-            differ = await get_differing_fields(oc, event, to_ignore=exclude)
-            if differ:
-                item = GameEvent(
-                    mode=EventModes.CHANGE,
-                    place=place,
-                    batch=batch,
-                    value=(event, differ),
-                    game_time=game_time,
-                )
-                pushed_items.append(item)
-                change.append(item)
+        elif delta:
+            item = GameEvent(
+                mode=EventModes.CHANGE,
+                place=place,
+                batch=batch,
+                value=(event, delta),
+                game_time=game_time,
+            )
+            pushed_items.append(item)
+            change.append(item)
 
     for event in target:
-        if not await check_compare_value(key, event[key], source):
+        if (event[key],) not in source_index:
             item = GameEvent(
                 mode=EventModes.REMOVE,
                 place=place,
@@ -228,9 +416,10 @@ async def process_planet_attacks(
     pushed_items = []
     newlist = []
     oldlist = []
+    source_index = index_by_keys(source, keys)
+    target_index = index_by_keys(target, keys)
     for event in source:
-        oc = await check_compare_value_list(keys, [event[key] for key in keys], target)
-        if not oc:
+        if tuple(event[key] for key in keys) not in target_index:
             print(place, EventModes.NEW, event)
             item = GameEvent(mode=EventModes.NEW, place=place, batch=batch, value=event)
             newlist.append(item)
@@ -238,9 +427,7 @@ async def process_planet_attacks(
             # await QueueAll.put(item)
 
     for event in target:
-        if not await check_compare_value_list(
-            keys, [event[key] for key in keys], source
-        ):
+        if tuple(event[key] for key in keys) not in source_index:
             item = GameEvent(
                 mode=EventModes.REMOVE,
                 place=place,
@@ -297,6 +484,9 @@ async def detect_loggable_changes(
     batch = (int(new.retrieved_at.timestamp()) >> 4) | (random.randint(0, 15))
 
     superlist = []
+    # One differ for the pair, so every subtree is hashed once per snapshot
+    # across all the diffs below.
+    differ = StructuralDiff()
     if old.status.time == new.status.time:
         newitem = GameEvent(
             mode=EventModes.DEADZONE, place=EventModes.DEADZONE, batch=batch, value=new.status
@@ -323,6 +513,7 @@ async def detect_loggable_changes(
             "spaceStations",
             "globalResources",
         ],
+        differ=differ,
     )
     if rawout:
         item = GameEvent(
@@ -373,6 +564,7 @@ async def detect_loggable_changes(
                 "self",
             ],
             game_time=gametime,
+            differ=differ,
         )
     logs.info("DSS movement detection, stand by...")
     superlist += await process_planet_events(
@@ -384,6 +576,7 @@ async def detect_loggable_changes(
         batch,
         ["retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
 
     logs.info("Global Resourse detection, stand by...")
@@ -396,6 +589,7 @@ async def detect_loggable_changes(
         batch,
         ["retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
     logs.info("campaigns detection, stand by...")
     superlist += await process_planet_events(
@@ -407,6 +601,7 @@ async def detect_loggable_changes(
         batch,
         ["retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
     logs.info("planet events detection, stand by...")
     superlist += await process_planet_events(
@@ -418,6 +613,7 @@ async def detect_loggable_changes(
         batch,
         ["health", "retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
     logs.info("planet status detection, stand by...")
     superlist += await process_planet_events(
@@ -429,6 +625,7 @@ async def detect_loggable_changes(
         batch,
         ["health", "players", "position", "retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
     logs.info("global event detection, stand by...")
     superlist += await process_planet_events(
@@ -440,6 +637,7 @@ async def detect_loggable_changes(
         batch,
         ["retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
 
     if new.war_info is not None and old.war_info is not None:
@@ -447,6 +645,7 @@ async def detect_loggable_changes(
             old.war_info,
             new.war_info,
             to_ignore=["planetInfos", "retrieved_at", "time_delta", "self"],
+            differ=differ,
         )
         if infoout:
             item = GameEvent(
@@ -468,6 +667,7 @@ async def detect_loggable_changes(
             batch,
             [ "retrieved_at", "time_delta", "self"],
             game_time=gametime,
+            differ=differ,
         )
     superlist += await process_planet_events(
         sector_states(new.status, statics),
@@ -478,6 +678,7 @@ async def detect_loggable_changes(
         batch,
         ["planetStatus", "retrieved_at", "time_delta", "self"],
         game_time=gametime,
+        differ=differ,
     )
     logs.info("Done detection, stand by...")
     if new.major_order is None:
@@ -32,7 +32,7 @@ from hd2api import extract_timestamp as et, hdml_parse
 
 import random
 from .GameStatus import ApiStatus, get_feature_dictionary
-from .predict import make_prediction_for_eps, predict_needed_players
+from .predict import predict_campaign_eps, predict_needed_players
 
 
 item_emojis: Dict[str, str] = {
@@ -355,6 +355,8 @@ def campaign_view(
     prop = defaultdict(int)
     stalemated = []
     players_on_stalemated = 0
+    campaign_features = {k: get_feature_dictionary(stat, k) for k in stat.campaigns}
+    predictions = predict_campaign_eps(campaign_features)
     # Iterate over each campaign in the status
     for k, list in stat.campaigns.items():
         camp, last = list.get_change_from(15)
@@ -418,8 +420,8 @@ def campaign_view(
                 total_contrib[4] += rate / total_sec  # Impact per second
 
         # Get estimated and real EPS
-        features = get_feature_dictionary(stat, k)
-        pred = make_prediction_for_eps(features)
+        features = campaign_features[k]
+        pred = predictions[k]
         eps_estimated = round(pred, 3)
         eps_real = round(features["eps"], 3)
         desc += f"\ninfl/s:`{eps_estimated},c{eps_real}`"
@@ -599,6 +601,8 @@ def campaign_text_view(
     players_on_stalemated = 0
     liberation_campaigns = []
     defense_campaigns = []
+    campaign_features = {k: get_feature_dictionary(stat, k) for k in stat.campaigns}
+    predictions = predict_campaign_eps(campaign_features)
     for k, list in stat.campaigns.items():
         camp, last = list.get_first_change()
         changes = list.get_changes()
@@ -657,8 +661,8 @@ def campaign_text_view(
                 )  # Contribution per hour
                 total_contrib[4] += rate / total_sec  # Impact per second
 
-        features = get_feature_dictionary(stat, k)
-        pred = make_prediction_for_eps(features)
+        features = campaign_features[k]
+        pred = predictions[k]
         # print(features["eps"], pred)
         eps_estimated = round(pred, 3)
         eps_real = round(features["eps"], 3)
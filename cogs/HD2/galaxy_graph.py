@@ -0,0 +1,145 @@
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from hd2api import Planet
+
+"""
+Warp link graph of the galaxy map.
+
+Planets only list their outgoing waypoints, so finding everything linked to a
+planet used to mean scanning every planet for links back to it at each step.
+GalaxyGraph builds the links in both directions once, along with the connected
+groups of planets, and is only rebuilt when the waypoints change.
+"""
+
+WaypointSignature = Tuple[Tuple[int, Tuple[int, ...]], ...]
+
+
+def waypoint_signature(planets: Dict[int, Planet]) -> WaypointSignature:
+    """Get a comparable snapshot of every planet's waypoints."""
+    return tuple(
+        (index, tuple(sorted(planet.waypoints or [])))
+        for index, planet in sorted(planets.items())
+    )
+
+
+class GalaxyGraph:
+    """Bidirectional adjacency index over the planets' warp links.
+
+    Args:
+        planets (Dict[int, Planet]): Planets by index.
+    """
+
+    def __init__(self, planets: Dict[int, Planet]):
+        self.signature = waypoint_signature(planets)
+        self.adjacency: Dict[int, Set[int]] = {index: set() for index in planets}
+        for index, planet in planets.items():
+            for other in planet.waypoints or []:
+                if other in self.adjacency:
+                    self.adjacency[index].add(other)
+                    self.adjacency[other].add(index)
+
+        # Label every planet with the connected group it's in.
+        self.component_of: Dict[int, int] = {}
+        self.components: List[FrozenSet[int]] = []
+        for start in sorted(self.adjacency):
+            if start in self.component_of:
+                continue
+            label = len(self.components)
+            members = {start}
+            self.component_of[start] = label
+            queue = deque([start])
+            while queue:
+                for other in self.adjacency[queue.popleft()]:
+                    if other not in self.component_of:
+                        self.component_of[other] = label
+                        members.add(other)
+                        queue.append(other)
+            self.components.append(frozenset(members))
+
+        self.owners: Dict[int, str] = {}
+        self.front_cache: Dict[int, FrozenSet[str]] = {}
+
+    def matches(self, planets: Dict[int, Planet]) -> bool:
+        """Check if this graph was built from the same waypoints as planets."""
+        return self.signature == waypoint_signature(planets)
+
+    def update_owners(self, planets: Dict[int, Planet]):
+        """Record the current owner of each planet, dropping stale front sets."""
+        for index, planet in planets.items():
+            owner = planet.currentOwner.upper()
+            if self.owners.get(index) != owner:
+                self.owners[index] = owner
+                label = self.component_of.get(index)
+                if label is not None:
+                    self.front_cache.pop(label, None)
+
+    def neighbors(self, index: int) -> Set[int]:
+        """Planets with a warp link to or from index."""
+        return self.adjacency.get(index, set())
+
+    def component(self, index: int) -> FrozenSet[int]:
+        """Every planet connected to index, including itself."""
+        label = self.component_of.get(index)
+        if label is None:
+            return frozenset()
+        return self.components[label]
+
+    def fronts(self, index: int) -> FrozenSet[str]:
+        """The factions that own a planet connected to index."""
+        label = self.component_of.get(index)
+        if label is None:
+            return frozenset()
+        front = self.front_cache.get(label)
+        if front is None:
+            front = frozenset(
+                self.owners[other]
+                for other in self.components[label]
+                if other in self.owners
+            )
+            self.front_cache[label] = front
+        return front
+
+    def shortest_path(
+        self, start: int, goal: int, through: Optional[Iterable[int]] = None
+    ) -> List[int]:
+        """Find a path with the fewest warp jumps from start to goal.
+
+        Args:
+            start (int): Index of the first planet.
+            goal (int): Index of the last planet.
+            through (Optional[Iterable[int]], optional): If given, only these
+                planets can be passed through, as with a faction's supply lines.
+                Defaults to None.
+
+        Returns:
+            List[int]: Planet indexes from start to goal, empty if there's no path.
+        """
+        if start not in self.adjacency or goal not in self.adjacency:
+            return []
+        if self.component_of[start] != self.component_of[goal]:
+            return []
+        allowed = set(through) | {start, goal} if through is not None else None
+        previous: Dict[int, Optional[int]] = {start: None}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if current == goal:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = previous[current]
+                return path[::-1]
+            for other in self.adjacency[current]:
+                if other in previous:
+                    continue
+                if allowed is not None and other not in allowed:
+                    continue
+                previous[other] = current
+                queue.append(other)
+        return []
+
+    def owned_by(self, owner: str) -> Set[int]:
+        """Indexes of the planets owned by owner."""
+        owner = owner.upper()
+        return {index for index, value in self.owners.items() if value == owner}
@@ -2,6 +2,9 @@ import io
 import math
 import os
 import json
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import discord
 from PIL import Image, ImageDraw, ImageFont, ImageSequence
 import numpy as np
@@ -18,6 +21,18 @@ from utility.image_functions import draw_arrow, draw_dot
 SCALE = 1.0
 CELL_SIZE = 200
 GRIDDRAW = False
+FRAME_COUNT = 30
+LABEL_COLORS = {
+    "automaton": (254 - 50, 109 - 50, 114 - 50, 200),  # Red
+    "terminids": (255 - 50, 193 - 50, 0, 200),  # Yellow
+    "humans": (0, 150, 150, 200),  # Cyan-like color
+    "illuminate": (150, 0, 150, 200),
+}
+
+
+@lru_cache(maxsize=4)
+def get_font(size=12):
+    return ImageFont.truetype("./assets/ChakraPetch-SemiBold.ttf", size)
 
 
 def update_lastval_file(lastplanets):
@@ -67,8 +82,9 @@ def get_im_coordinates(x, y, scale=1):
     return coordinate
 
 
-def draw_supply_lines(img, color=(0, 255, 0, 255), apistat: ApiStatus = None):
-    width, height = img.size
+def draw_line_layer(size, apistat: ApiStatus, color=(0, 255, 0, 255)):
+    """Draw every supply and attack line onto a transparent layer of the given size."""
+    width, height = size
     overlay = Image.new("RGBA", (width * 2, height * 2), (0, 0, 0, 0))
     draw = ImageDraw.Draw(overlay)
 
@@ -86,11 +102,14 @@ def draw_supply_lines(img, color=(0, 255, 0, 255), apistat: ApiStatus = None):
                 width=4,
             )
 
-        for index, planet in apistat.planets.items():
-            draw_attack_lines(draw, planet, apistat)
+    for index, planet in apistat.planets.items():
+        draw_attack_lines(draw, planet, apistat)
+
+    return overlay.resize((overlay.width // 2, overlay.height // 2))
 
-    overlay = overlay.resize((overlay.width // 2, overlay.height // 2))
 
+def draw_supply_lines(img, color=(0, 255, 0, 255), apistat: ApiStatus = None):
+    overlay = draw_line_layer(img.size, apistat, color)
     img = Image.alpha_composite(img, overlay)
     return img
 
@@ -108,27 +127,16 @@ def draw_attack_lines(draw, planet, apistat: ApiStatus):
         draw_arrow(draw, (255, 0, 0, 255), (x, y), (tx, ty), width=5)
 
 
-def highlight(img, index, x, y, name, hper, owner, event, task_planets, health=0):
-    coordinate = get_im_coordinates(x, y)
-
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    font = ImageFont.truetype("./assets/ChakraPetch-SemiBold.ttf", 12)
-    font2 = ImageFont.truetype("./assets/ChakraPetch-SemiBold.ttf", 12)
+def draw_label(draw, coordinate, name, hper, owner, event, tasked):
+    """Draw a planet's name and sector boxes around coordinate."""
+    font = get_font(12)
+    font2 = get_font(12)
     bbox = draw.textbbox((0, 0), name, font=font, align="center", spacing=0)
 
     out = 2
-    colors = {
-        "automaton": (254 - 50, 109 - 50, 114 - 50, 200),  # Red
-        "terminids": (255 - 50, 193 - 50, 0, 200),  # Yellow
-        "humans": (0, 150, 150, 200),  # Cyan-like color
-        "illuminate": (150, 0, 150, 200),
-    }
-    outline = colors[owner]
-
-    if index in task_planets or event:
-        # print(task_planets)
+    outline = LABEL_COLORS[owner]
+
+    if tasked or event:
         outline = (255, 255, 255)
         if event:
             outline = (64, 64, 255)
@@ -140,7 +148,7 @@ def highlight(img, index, x, y, name, hper, owner, event, task_planets, health=0
         coordinate[1] - 10,
     ]
 
-    draw.rectangle(background_box, fill=colors[owner], outline=outline, width=out)
+    draw.rectangle(background_box, fill=LABEL_COLORS[owner], outline=outline, width=out)
     draw.rectangle(
         (
             [
@@ -150,7 +158,7 @@ def highlight(img, index, x, y, name, hper, owner, event, task_planets, health=0
                 background_box[3] + 20 + bbox2[3] + 2,
             ]
         ),
-        fill=colors[owner],
+        fill=LABEL_COLORS[owner],
         outline=outline,
     )
 
@@ -170,25 +178,70 @@ def highlight(img, index, x, y, name, hper, owner, event, task_planets, health=0
         align="center",
         spacing=0,
     )
+
+
+def render_label(x, y, name, hper, owner, event, tasked):
+    """Draw a planet's label onto a tile just big enough to hold it.
+
+    Returns:
+        Tuple[Image.Image, Tuple[int, int]]: The tile, and where its top left
+        corner goes on the map.
+    """
+    coordinate = get_im_coordinates(x, y)
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    font = get_font(12)
+    bbox = measure.textbbox((0, 0), name, font=font, align="center", spacing=0)
+    bbox2 = measure.textbbox((0, 0), str(hper), font=font, align="center", spacing=0)
+    half = max(bbox[2], bbox2[2]) // 2 + 4
+    left = coordinate[0] - half
+    top = coordinate[1] - bbox[3] - 16
+    bottom = coordinate[1] + 14 + bbox2[3]
+    tile = Image.new("RGBA", (half * 2 + 1, bottom - top), (0, 0, 0, 0))
+    draw_label(
+        ImageDraw.Draw(tile),
+        (coordinate[0] - left, coordinate[1] - top),
+        name,
+        hper,
+        owner,
+        event,
+        tasked,
+    )
+    return tile, (left, top)
+
+
+def highlight(img, index, x, y, name, hper, owner, event, task_planets, health=0):
+    coordinate = get_im_coordinates(x, y)
+
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    draw_label(draw, coordinate, name, hper, owner, event, index in task_planets)
     img = Image.alpha_composite(img, overlay)
     return img
 
 
-def place_planet(index, frames_dict):
-
+def planet_sprite_path(index):
     filepath = f"./assets/planets/planet_{index}_rotate.gif"
     if os.path.exists(filepath):
-        frames_dict[index] = []
+        return filepath
+    return "./assets/planet.png"
+
+
+def load_planet_frames(index):
+    """Load the rotation frames of a planet's sprite, or the default planet's."""
+    filepath = planet_sprite_path(index)
+    if filepath.endswith(".gif"):
         with Image.open(filepath) as planetimg:
-            for frame in ImageSequence.Iterator(planetimg):
-                frames_dict[index].append(frame.copy().convert("RGBA"))
-    else:
-        filepath = "./assets/planet.png"
-        if os.path.exists(filepath):
-            with Image.open(filepath).convert("RGBA") as planetimg:
-                frames_dict[index] = [
-                    planetimg.copy() for _ in range(30)
-                ]  # Assuming 30 frames for PNG
+            return [
+                frame.copy().convert("RGBA")
+                for frame in ImageSequence.Iterator(planetimg)
+            ]
+    with Image.open(filepath).convert("RGBA") as planetimg:
+        return [planetimg.copy() for _ in range(FRAME_COUNT)]
+
+
+def place_planet(index, frames_dict):
+    if os.path.exists(planet_sprite_path(index)):
+        frames_dict[index] = load_planet_frames(index)
 
 
 def crop_image(image, coordinate, off_by, cell_size=250):
@@ -203,16 +256,31 @@ def crop_image(image, coordinate, off_by, cell_size=250):
     return cropped_img
 
 
-def create_gif(filepath, apistat: ApiStatus):
-    # create gif only if needed
-    img = draw_grid(filepath)
-    img = draw_supply_lines(img, apistat=apistat)
+def palette_frame(img):
+    """Convert an RGBA frame to the adaptive palette image the gif encoder would make of it.
+
+    Quantizing is most of the cost of saving the map, so the sprite frames
+    are kept already converted.
+    """
+    frame = img.convert("P", palette=Image.Palette.ADAPTIVE)
+    if frame.palette.mode == "RGBA":
+        for rgba in frame.palette.colors:
+            if rgba[3] == 0:
+                frame.info["transparency"] = frame.palette.colors[rgba]
+                break
+    return frame
+
+
+def map_state(apistat: ApiStatus):
+    """Get what each planet's label shows, in the format saved to lastval.json."""
     task_planets = []
     if apistat:
         for a in apistat.assignments.values():
             assignment = a.get_first()
             task_planets.extend(assignment.get_task_planets())
-    planets = {}
+    known = set()
+    if apistat and apistat.warall:
+        known = {pf.index for pf in apistat.warall.war_info.planetInfos}
     lastplanets = {"version": 3, "planets": {}}
     for _, planet in apistat.planets.items():
         gpos = planet.position
@@ -221,12 +289,9 @@ def create_gif(filepath, apistat: ApiStatus):
         hper = str(planet.sector_id) + ":" + str(planet.sector)
         hp = (math.ceil(planet.health_percent()) // 10) * 10
         name = str(planet.index) + ":" + str(planet.name).replace(" ", "\n")
-        if apistat and apistat.warall:
-            for pf in apistat.warall.war_info.planetInfos:
-                if pf.index == planet.index:
-                    name = str(planet.name).replace(" ", "\n")
-                    hper = str(planet.sector)
-                    break
+        if planet.index in known:
+            name = str(planet.name).replace(" ", "\n")
+            hper = str(planet.sector)
         event = True if planet.event is not None else False
         owner = planet.currentOwner.lower()
         lastplanets["planets"][planet.index] = {
@@ -240,48 +305,208 @@ def create_gif(filepath, apistat: ApiStatus):
             "name": name,
             "owner": owner,
         }
-    if not update_lastval_file(lastplanets):
-        print("No significant change.")
-        return "./saveData/map.gif"
-
-    for index, value in lastplanets["planets"].items():
-        img = highlight(img, **value)
-        place_planet(index, planets)
-
-    frames = []
-    for _, planet_obj in apistat.planets.items():
-        gpos = planet_obj.position
-        c = get_im_coordinates(gpos.x, gpos.y)
-        img.alpha_composite(planets[planet_obj.index][0], (c[0] - 10, c[1] - 10))
-
-    for frame in range(1, 30):  # Assuming 30 frames
-        #        print(frame)
-        frame_img = Image.new("RGBA", (img.width, img.height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(frame_img)
-        for _, planet_obj in apistat.planets.items():
-            gpos = planet_obj.position
-            c = get_im_coordinates(gpos.x, gpos.y)
-            frame_img.alpha_composite(
-                planets[planet_obj.index][frame], (c[0] - 10, c[1] - 10)
+    return lastplanets
+
+
+class MapCompositor:
+    """Builds the animated galaxy map out of cached layers.
+
+    The background, the supply and attack lines, each planet's label and each
+    planet's sprite frames are kept between updates.  A layer is only drawn
+    again when what it shows changes, so an update that flips one planet's
+    owner redraws one small label tile instead of the whole map.
+    """
+
+    def __init__(self):
+        self.background_key = None
+        self.background: Optional[Image.Image] = None
+        self.lines_key = None
+        self.base: Optional[Image.Image] = None
+        self.labels: Dict[int, Tuple[tuple, Image.Image, Tuple[int, int]]] = {}
+        self.sprites: Dict[int, Tuple[tuple, List[Image.Image]]] = {}
+        self.frames_key = None
+        self.frames: List[Image.Image] = []
+        self.timings: Dict[str, float] = {}
+        self.redrawn: Dict[str, int] = {}
+
+    def update_background(self, filepath) -> bool:
+        key = (filepath, os.path.getmtime(filepath))
+        if key == self.background_key:
+            return False
+        self.background = draw_grid(filepath)
+        self.background_key = key
+        self.lines_key = None
+        return True
+
+    def update_lines(self, apistat: ApiStatus) -> bool:
+        key = tuple(
+            (
+                index,
+                planet.position.x,
+                planet.position.y,
+                tuple(sorted(planet.waypoints or [])),
+                tuple(sorted(planet.attacking or [])),
             )
+            for index, planet in apistat.planets.items()
+        )
+        if key == self.lines_key:
+            return False
+        overlay = draw_line_layer(self.background.size, apistat)
+        self.base = Image.alpha_composite(self.background, overlay)
+        self.lines_key = key
+        return True
+
+    def update_labels(self, lastplanets) -> int:
+        """Redraw the label tiles of planets whose label changed."""
+        redrawn = 0
+        current = lastplanets["planets"]
+        for index in list(self.labels):
+            if index not in current:
+                del self.labels[index]
+        for index, value in current.items():
+            key = (
+                value["x"],
+                value["y"],
+                value["name"],
+                value["hper"],
+                value["owner"],
+                value["event"],
+                index in value["task_planets"],
+            )
+            cached = self.labels.get(index)
+            if cached is not None and cached[0] == key:
+                continue
+            tile, origin = render_label(*key)
+            self.labels[index] = (key, tile, origin)
+            redrawn += 1
+        return redrawn
+
+    def update_sprites(self, indexes) -> int:
+        """Load the sprite frames of planets that are new or were regenerated."""
+        loaded = 0
+        for index in indexes:
+            filepath = planet_sprite_path(index)
+            key = (filepath, os.path.getmtime(filepath))
+            cached = self.sprites.get(index)
+            if cached is not None and cached[0] == key:
+                continue
+            self.sprites[index] = (key, load_planet_frames(index))
+            loaded += 1
+        return loaded
+
+    def update_frames(self, lastplanets) -> bool:
+        """Rebuild the sprite only frames that follow the first one."""
+        places = []
+        for index, value in lastplanets["planets"].items():
+            c = get_im_coordinates(value["x"], value["y"])
+            places.append((index, (c[0] - 10, c[1] - 10), self.sprites[index][0]))
+        key = tuple(places)
+        if key == self.frames_key:
+            return False
+        frames = []
+        for frame in range(1, FRAME_COUNT):
+            frame_img = Image.new("RGBA", self.base.size, (0, 0, 0, 0))
+            for index, place, _ in places:
+                frame_img.alpha_composite(self.sprites[index][1][frame], place)
+            frames.append(palette_frame(frame_img))
+        self.frames = frames
+        self.frames_key = key
+        return True
+
+    def first_frame(self, lastplanets) -> Image.Image:
+        img = self.base.copy()
+        for index in lastplanets["planets"]:
+            _, tile, origin = self.labels[index]
+            img.alpha_composite(tile, origin)
+        for index, value in lastplanets["planets"].items():
+            c = get_im_coordinates(value["x"], value["y"])
+            img.alpha_composite(self.sprites[index][1][0], (c[0] - 10, c[1] - 10))
+        return img
+
+    def render(
+        self, filepath, apistat: ApiStatus, lastplanets, output, saved=False
+    ) -> bool:
+        """Bring every layer up to date and encode the map if anything changed.
+
+        Args:
+            filepath (str): The background map image.
+            apistat (ApiStatus): Current war status, for the lines.
+            lastplanets (dict): Planet labels from map_state.
+            output (str): Where to save the gif.
+            saved (bool, optional): If output was already saved with these
+                labels, like after a restart.  The layers are still built
+                on the first render, but the gif isn't encoded again.
+                Defaults to False.
+
+        Returns:
+            bool: If the gif was saved again.
+        """
+        first = self.base is None
+        timings = {}
+        redrawn = {}
+        start = time.perf_counter()
+
+        step = time.perf_counter()
+        background = self.update_background(filepath)
+        lines = self.update_lines(apistat)
+        redrawn["lines"] = int(lines)
+        timings["layers"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        redrawn["labels"] = self.update_labels(lastplanets)
+        timings["labels"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        redrawn["sprites"] = self.update_sprites(lastplanets["planets"])
+        frames = self.update_frames(lastplanets)
+        timings["sprites"] = time.perf_counter() - step
+
+        changed = background or lines or frames or redrawn["labels"] > 0
+        if first and saved:
+            changed = False
+        if changed or not os.path.exists(output):
+            step = time.perf_counter()
+            img = self.first_frame(lastplanets)
+            timings["compose"] = time.perf_counter() - step
+
+            step = time.perf_counter()
+            img.save(
+                output,
+                format="GIF",
+                save_all=True,
+                default_image=True,
+                interlace=False,
+                append_images=self.frames,
+                duration=100,
+                optimize=True,
+                dispose=2,
+                transparency=0,
+                loop=0,
+            )
+            timings["encode"] = time.perf_counter() - step
+        timings["total"] = time.perf_counter() - start
+        self.timings = timings
+        self.redrawn = redrawn
+        print(self.status_string())
+        return changed
+
+    def status_string(self) -> str:
+        times = ", ".join(f"{k} {v*1000:.0f}ms" for k, v in self.timings.items())
+        redrawn = ", ".join(f"{k} {v}" for k, v in self.redrawn.items())
+        return f"map render: {times}; redrawn: {redrawn}"
+
+
+map_compositor = MapCompositor()
 
-        frames.append(frame_img)
-    print("saving")
-    # Save the frames to the buffer
-    img.save(
-        "./saveData/map.gif",
-        format="GIF",
-        save_all=True,
-        default_image=True,
-        interlace=False,
-        append_images=frames[0:],
-        duration=100,
-        optimize=True,
-        dispose=2,
-        transparency=0,
-        loop=0,
-    )
 
+def create_gif(filepath, apistat: ApiStatus):
+    # create gif only if needed
+    lastplanets = map_state(apistat)
+    updated = update_lastval_file(lastplanets)
+    if not map_compositor.render(
+        filepath, apistat, lastplanets, "./saveData/map.gif", saved=not updated
+    ):
+        print("No significant change.")
     return "./saveData/map.gif"
 
 
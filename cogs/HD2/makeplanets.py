@@ -2,22 +2,27 @@
 
 import math
 import os
+import json
 import random
 import glob
+import threading
 import matplotlib.pyplot as plt
 import numpy as np
 import math
 from matplotlib.colors import LinearSegmentedColormap
-from perlin_noise import PerlinNoise
 from PIL import Image, ImageDraw, ImageFont
 from sklearn.cluster import KMeans
 
 CLOUD_ALPHA = 180
+SPRITE_SIZE = 21
 
 
 BIOME_IMAGE_PATH = r"./assets/allimages/*"
 OUTPUT_PATH = "./assets/planets/"
 FONT_PATH = "./assets/ChakraPetch-SemiBold.ttf"
+SPRITE_INDEX_PATH = f"{OUTPUT_PATH}sprite_index.json"
+# Bump when the renderer changes, so every sprite is made again.
+SPRITE_VERSION = 2
 
 
 def draw_streak(draw, xpix, ypix, lightest_color):
@@ -123,75 +128,132 @@ def extract_colors(image_path, num_colors=7):
     return colors
 
 
+def sphere_geometry(sphere_center, sphere_radius, size=SPRITE_SIZE):
+    """Get the disc mask and surface normals of a sphere seen head on.
+
+    Returns:
+        Tuple of the boolean mask of pixels inside the sphere, and the x, y and z
+        components of the normal at every pixel, each a (size, size) array.
+    """
+    ys, xs = np.mgrid[0:size, 0:size]
+    dx = xs - sphere_center[0]
+    dy = ys - sphere_center[1]
+    mask = dx**2 + dy**2 <= sphere_radius**2
+    # Keep the points on the sphere surface; outside the disc is masked off anyway.
+    dz = np.sqrt(np.where(mask, sphere_radius**2 - dx**2 - dy**2, 0))
+    return mask, dx / sphere_radius, dy / sphere_radius, dz / sphere_radius
+
+
+def render_frames(
+    texture, xpix, ypix, sphere_center, sphere_radius, angles, light_dir, biome
+):
+    """Render the textured sphere at every rotation angle in one pass.
+
+    Normals, texture coordinates and lighting are computed as arrays over
+    every pixel of every frame at once.
+
+    Args:
+        texture (np.ndarray): RGB or RGBA texture, shape (ypix, xpix, channels).
+        xpix (int): Texture width.
+        ypix (int): Texture height.
+        sphere_center (Tuple[int, int]): Center of the sphere in the sprite.
+        sphere_radius (int): Radius of the sphere in pixels.
+        angles (Iterable[float]): Rotation of each frame, in degrees.
+        light_dir (np.ndarray): Unit vector pointing at the light.
+        biome (str): Biome name, blackholes are unlit and get an outline.
+
+    Returns:
+        List[Image.Image]: One RGBA sprite per angle.
+    """
+    texture = np.asarray(texture)
+    if texture.shape[-1] == 3:
+        alpha = np.full(texture.shape[:-1] + (1,), 255, dtype=texture.dtype)
+        texture = np.concatenate([texture, alpha], axis=-1)
+
+    mask, nx, ny, nz = sphere_geometry(sphere_center, sphere_radius)
+    angle_rad = np.radians(np.asarray(angles, dtype=float))[:, None, None]
+
+    # Apply rotation to the normals, then map them to texture coordinates.
+    nx_rot = nx * np.cos(angle_rad) - nz * np.sin(angle_rad)
+    nz_rot = nx * np.sin(angle_rad) + nz * np.cos(angle_rad)
+    u = 0.5 + np.arctan2(nz_rot, nx_rot) / (2 * np.pi)
+    v = 0.5 - np.arcsin(np.clip(ny, -1.0, 1.0)) / np.pi
+    tx = np.trunc(u * xpix - 1).astype(int)
+    ty = np.broadcast_to(np.trunc(v * ypix - 1).astype(int), tx.shape)
+    colors = texture[ty, tx]
+
+    if biome == "blackhole":
+        pixels = colors.astype(np.uint8)
+    else:
+        # Light falls off to half brightness, to simulate a larger light source.
+        intensity = np.maximum(
+            0.0, nx * light_dir[0] + ny * light_dir[1] + nz * light_dir[2]
+        )
+        intensity = 0.5 + 0.5 * intensity
+        pixels = (colors * intensity[..., None]).astype(np.uint8)
+    pixels[:, ~mask] = 0
+
+    images = []
+    for frame in pixels:
+        sphere_img = Image.fromarray(frame, "RGBA")
+        if biome == "blackhole":
+            sphere_draw = ImageDraw.Draw(sphere_img)
+            sphere_draw.ellipse([(0, 0), (20, 20)], outline="purple", width=1)
+        images.append(sphere_img)
+    return images
+
+
 def render_planet(
     texture, xpix, ypix, sphere_center, sphere_radius, angle, light_dir, biome
 ):
-    sphere_img = Image.new("RGBA", (21, 21), (0, 0, 0, 0))
-    sphere_draw = ImageDraw.Draw(sphere_img)
-
-    def get_texture_color(u, v):
-        x = int(u * xpix - 1)
-        y = int(v * ypix - 1)
-        return tuple(texture[y, x])
-
-    # Convert angle to radians
-    angle_rad = math.radians(angle)
-
-    for y in range(21):
-        for x in range(21):
-            dx = x - sphere_center[0]  # Calculate the x-distance from the sphere center
-            dy = y - sphere_center[1]  # Calculate the y-distance from the sphere center
-            if (
-                dx**2 + dy**2 <= sphere_radius**2
-            ):  # Check if the point is within the circle
-                # Calculate the z-distance using Pythagorean theorem to keep the point on the sphere surface
-                dz = math.sqrt(sphere_radius**2 - dx**2 - dy**2)
-                nx = dx / sphere_radius  # Normalize x-distance to get the normal
-                ny = dy / sphere_radius  # Normalize y-distance to get the normal
-                nz = dz / sphere_radius  # Normalize z-distance to get the normal
-
-                # Apply rotation to the normal vector
-                nx_rot = nx * math.cos(angle_rad) - nz * math.sin(angle_rad)
-                nz_rot = nx * math.sin(angle_rad) + nz * math.cos(angle_rad)
-
-                # Calculate texture coordinates with the rotated normal
-                u = 0.5 + (
-                    math.atan2(nz_rot, nx_rot) / (2 * math.pi)
-                )  # Calculate texture coordinate u
-                v = 0.5 - (math.asin(ny) / math.pi)  # Calculate texture coordinate v
-
-                color = get_texture_color(u, v)  # Get the texture color at (u, v)
-                normal = np.array([nx, ny, nz])  # Construct the normal vector
-                if biome == "blackhole":
-                    light_intensity = 0.5  # Make the light intensity constant
-                    sphere_img.putpixel((x, y), color)
-
-                else:
-                    light_intensity = np.dot(
-                        normal, light_dir
-                    )  # Calculate the light intensity
-                    light_intensity = max(
-                        0.0, light_intensity
-                    )  # Ensure a minimum light intensity
-
-                    # Adjust the light intensity to simulate a larger light source
-                    light_falloff = 0.5 + 0.5 * light_intensity
-                    light_intensity = max(0.5, light_falloff)
-
-                    color = tuple(
-                        int(c * light_intensity) for c in color
-                    )  # Adjust the color by the light intensity
-                    if color != (
-                        0,
-                        0,
-                        0,
-                    ):  # If the color is not black, set the pixel in the image
-                        sphere_img.putpixel(
-                            (x, y), color
-                        )  # Set the pixel color in the image
-    if biome == "blackhole":
-        sphere_draw.ellipse([(0, 0), (20, 20)], outline="purple", width=1)
-    return sphere_img
+    return render_frames(
+        texture,
+        xpix,
+        ypix,
+        sphere_center,
+        sphere_radius,
+        [angle],
+        light_dir,
+        biome,
+    )[0]
+
+
+def gradient_noise(xs, ys, freq, rng):
+    """Perlin style gradient noise with freq lattice cells across the unit square."""
+    angles = rng.uniform(0, 2 * np.pi, (freq + 1, freq + 1))
+    gx, gy = np.cos(angles), np.sin(angles)
+    x, y = xs * freq, ys * freq
+    x0, y0 = np.floor(x).astype(int), np.floor(y).astype(int)
+    fx, fy = x - x0, y - y0
+
+    def corner(ix, iy, dx, dy):
+        return gx[iy, ix] * dx + gy[iy, ix] * dy
+
+    n00 = corner(x0, y0, fx, fy)
+    n10 = corner(x0 + 1, y0, fx - 1, fy)
+    n01 = corner(x0, y0 + 1, fx, fy - 1)
+    n11 = corner(x0 + 1, y0 + 1, fx - 1, fy - 1)
+    sx = fx * fx * fx * (fx * (fx * 6 - 15) + 10)
+    sy = fy * fy * fy * (fy * (fy * 6 - 15) + 10)
+    nx0 = n00 + sx * (n10 - n00)
+    nx1 = n01 + sx * (n11 - n01)
+    return nx0 + sy * (nx1 - nx0)
+
+
+def fractal_noise(xpix, ypix, octaves=(3, 6, 12, 24), rng=None):
+    """Layered gradient noise, each layer at half the weight of the last.
+
+    Returns:
+        np.ndarray: Noise values, shape (ypix, xpix).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    ys, xs = np.mgrid[0:ypix, 0:xpix]
+    xs, ys = xs / xpix, ys / ypix
+    total = np.zeros((ypix, xpix))
+    for layer, freq in enumerate(octaves):
+        total += gradient_noise(xs, ys, freq, rng) / (2**layer)
+    return total
 
 
 def make_new_texture(colors, nme, num_craters, num_clouds, xpix, ypix, biome_name):
@@ -203,31 +265,11 @@ def make_new_texture(colors, nme, num_craters, num_clouds, xpix, ypix, biome_nam
 
     cm = LinearSegmentedColormap.from_list("", np.array(colors) / 256, 256)
 
-    img = Image.new("RGBA", (xpix, ypix), (255, 255, 255, 255))
+    noise_val = fractal_noise(xpix, ypix)
+    rgb = (cm(np.clip((noise_val + 1) / 2, 0, 1))[..., :3] * 255).astype(np.uint8)
+    img = Image.fromarray(rgb, "RGB").convert("RGBA")
     draw = ImageDraw.Draw(img)
 
-    noise1 = PerlinNoise(octaves=3)
-    noise2 = PerlinNoise(octaves=6)
-    noise3 = PerlinNoise(octaves=12)
-    noise4 = PerlinNoise(octaves=24)
-
-    pic = []
-    for i in range(xpix):
-        row = []
-        for j in range(ypix):
-            noise_val = noise1([i / xpix, j / ypix])
-            noise_val += 0.5 * noise2([i / xpix, j / ypix])
-            noise_val += 0.25 * noise3([i / xpix, j / ypix])
-            noise_val += 0.125 * noise4([i / xpix, j / ypix])
-
-            color = cm((noise_val + 1) / 2)
-            color = tuple(int(c * 255) for c in color[:3])
-            img.putpixel((i, j), tuple(color))
-
-            row.append(255)
-
-        pic.append(row)
-
     for _ in range(num_craters):
         crater_center = (random.randint(0, xpix - 1), random.randint(0, ypix - 1))
         crater_radius = random.randint(1, 2)
@@ -286,26 +328,20 @@ def generate_planet_texture(
     def create_gif_with_light_variation(
         texture, sphere_center, sphere_radius, frames, output_path, biome_name
     ):
-        images = []
-        for frame in range(frames):
-
-            angle = (frame / frames) * 360
-            # print(angle)
-            light_dir = np.array([0.8, 0, 1])
-            light_dir = light_dir / np.linalg.norm(light_dir)
-
-            sphere_img = render_planet(
-                texture,
-                xpix,
-                ypix,
-                sphere_center,
-                sphere_radius,
-                angle,
-                light_dir,
-                biome_name,
-            )
-
-            images.append(sphere_img)
+        angles = [(frame / frames) * 360 for frame in range(frames)]
+        light_dir = np.array([0.8, 0, 1])
+        light_dir = light_dir / np.linalg.norm(light_dir)
+
+        images = render_frames(
+            texture,
+            xpix,
+            ypix,
+            sphere_center,
+            sphere_radius,
+            angles,
+            light_dir,
+            biome_name,
+        )
 
         images[0].save(
             output_path,
@@ -405,12 +441,60 @@ im = extract_colors_image(all_colors)
 im.save(f"{OUTPUT_PATH}colorpallate.png")
 
 
-def get_planet(ind: int, biome_name: str):
-    labels = []
+def load_sprite_index():
+    if os.path.exists(SPRITE_INDEX_PATH):
+        with open(SPRITE_INDEX_PATH, "r") as f:
+            return json.load(f)
+    return {}
+
+
+sprite_index = load_sprite_index()
+sprite_lock = threading.Lock()
+
+
+def get_planet(ind: int, biome_name: str, force: bool = False):
+    """Make the rotating sprite for a planet, unless an up to date one exists.
+
+    Sprites are tracked in sprite_index by planet and biome, so a planet is
+    only re-rendered when its biome changes, its gif is missing, the renderer
+    version changes, or force is set.  A planet that keeps its biome also
+    keeps its texture.
+
+    Args:
+        ind (int): Planet index.
+        biome_name (str): Biome of the planet.
+        force (bool, optional): Render a new texture and sprite regardless. Defaults to False.
+
+    Returns:
+        Optional[str]: Path of the sprite gif, None if the biome has no colors.
+    """
     use = all_colors.get(biome_name, None)
-    if biome_name in has_c:
-        return generate_planet_texture(use, 0, 2, f"planet_{ind}", biome_name)
-    return None
+    if biome_name not in has_c:
+        return None
+    nme = f"planet_{ind}"
+    output_path = f"{OUTPUT_PATH}{nme}_rotate.gif"
+    entry = sprite_index.get(nme, {})
+    same_biome = entry.get("biome") == biome_name
+    if (
+        not force
+        and same_biome
+        and entry.get("version") == SPRITE_VERSION
+        and os.path.exists(output_path)
+    ):
+        return output_path
+    keep_texture = (
+        not force
+        and same_biome
+        and os.path.exists(f"{OUTPUT_PATH}planet_{nme}_texture.png")
+    )
+    generate_planet_texture(
+        use, 0, 2, nme, biome_name, make_a_new_texture=not keep_texture
+    )
+    with sprite_lock:
+        sprite_index[nme] = {"biome": biome_name, "version": SPRITE_VERSION}
+        with open(SPRITE_INDEX_PATH, "w") as f:
+            json.dump(sprite_index, f, indent=1)
+    return output_path
 
 
 # get_planet(64, "blackhole")
@@ -1,4 +1,9 @@
 import datetime
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
 import numpy as np
 import pandas as pd
 from sklearn.metrics import mean_squared_error, r2_score
@@ -17,62 +22,245 @@ from scipy import stats
 from io import BytesIO
 from PIL import Image
 
-# Load your dataset (Assume your dataset is in a CSV file)
-# Replace 'your_dataset.csv' with your actual dataset file
+from .stats_store import StatsStore
+
+"""
+EPS and player count predictions from the gathered campaign statistics.
+
+The three linear models are fit once with least squares and saved to
+MODEL_PATH along with the row count and newest timestamp of the data they
+were fit on.  They're only fit again once the statistics have grown by
+RETRAIN_GROWTH.  Predictions take arrays, so every campaign is predicted
+in one matrix product, and the standard errors are worked out in closed
+form from the saved (X^T X)^-1 instead of from the whole training set.
+"""
+
+MODEL_PATH = "saveData/hd2_predict_model.npz"
+RETRAIN_GROWTH = 0.05
+
+TRAINING_COLUMNS = [
+    "timestamp",
+    "player_count",
+    "mode",
+    "mp_mult",
+    "wins_per_sec",
+    "loss_per_sec",
+    "decay_rate",
+    "kills_per_sec",
+    "deaths_per_sec",
+    "eps",
+]
+TRAINING_FILTER = (
+    "wins_per_sec >= 0 AND loss_per_sec >= 0 "
+    "AND kills_per_sec >= 0 AND deaths_per_sec >= 0"
+)
+EPS_FEATURES = [
+    "player_count",
+    "mp_mult",
+    "wins_per_sec",
+    "loss_per_sec",
+    "decay_rate",
+    "kills_per_sec",
+    "deaths_per_sec",
+]
 
-# List of regression models to use
 
+def load_training_data() -> pd.DataFrame:
+    """Load the campaign statistics the models are fit on.  BLOCKING OPERATION."""
+    return pd.DataFrame(
+        StatsStore.get().query(
+            "campaign_stats", columns=TRAINING_COLUMNS, where=TRAINING_FILTER
+        )
+    )
 
-data = pd.read_csv("statistics.csv")
-data = data[
-    (data["wins_per_sec"] >= 0)
-    & (data["loss_per_sec"] >= 0)
-    & (data["kills_per_sec"] >= 0)
-    & (data["deaths_per_sec"] >= 0)
-]
 
+class LinearFit:
+    """An ordinary least squares fit, kept as plain arrays.
+
+    Args:
+        coef (np.ndarray): Intercept followed by one weight per feature.
+        xtx_inv (np.ndarray): Inverse of X^T X for the design matrix with intercept.
+        mse (float): Mean squared error of the fit on its training data.
+    """
+
+    def __init__(self, coef: np.ndarray, xtx_inv: np.ndarray, mse: float):
+        self.coef = coef
+        self.xtx_inv = xtx_inv
+        self.mse = mse
+
+    @classmethod
+    def fit(cls, X: np.ndarray, y: np.ndarray) -> "LinearFit":
+        A = np.column_stack([np.ones(len(X)), X])
+        coef, _, _, _ = np.linalg.lstsq(A, y, rcond=None)
+        mse = float(np.mean((A @ coef - y) ** 2))
+        return cls(coef, np.linalg.pinv(A.T @ A), mse)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predict for each row of X, shaped (rows, features)."""
+        return self.coef[0] + X @ self.coef[1:]
+
+    def predict_with_error(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Predict for each value of a single feature, with the standard error of each prediction."""
+        inv = self.xtx_inv
+        # x_new (X^T X)^-1 x_new^T for x_new = [1, x], expanded for every x at once.
+        leverage = inv[0, 0] + 2 * inv[0, 1] * x + inv[1, 1] * x * x
+        prediction = self.coef[0] + self.coef[1] * x
+        return prediction, np.sqrt(self.mse * (1 + leverage))
+
+    def to_arrays(self, name: str) -> Dict[str, np.ndarray]:
+        return {
+            f"{name}_coef": self.coef,
+            f"{name}_xtx_inv": self.xtx_inv,
+            f"{name}_mse": np.array(self.mse),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Any, name: str) -> "LinearFit":
+        return cls(
+            arrays[f"{name}_coef"],
+            arrays[f"{name}_xtx_inv"],
+            float(arrays[f"{name}_mse"]),
+        )
 
-# Extract features and target
-T = data["timestamp"]
-X = data[
-    [
-        "player_count",
-        "mp_mult",
-        "wins_per_sec",
-        "loss_per_sec",
-        "decay_rate",
-        "kills_per_sec",
-        "deaths_per_sec",
-    ]
-]
-Y = data["eps"]
 
+class PredictionService:
+    """Holds the fitted models, loading them from MODEL_PATH or fitting them as needed.
+
+    Args:
+        path (str, optional): Where the models are saved. Defaults to MODEL_PATH.
+    """
+
+    _instance: Optional["PredictionService"] = None
+
+    def __init__(self, path: str = MODEL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.version: Tuple[int, int] = (0, 0)
+        self.eps_fit: Optional[LinearFit] = None
+        self.needed_fit: Optional[LinearFit] = None
+        self.to_eps_fit: Optional[LinearFit] = None
+        self.data: Optional[pd.DataFrame] = None
+        self.fit_seconds = 0.0
+
+    @classmethod
+    def get(cls) -> "PredictionService":
+        """Get the shared service, loading or fitting its models the first time.  BLOCKING OPERATION."""
+        if cls._instance is None:
+            service = cls()
+            service.refresh()
+            cls._instance = service
+        return cls._instance
+
+    def stale(self, version: Tuple[int, int]) -> bool:
+        """Check if the models were fit on too little of the data in version."""
+        if self.eps_fit is None:
+            return True
+        rows, _ = version
+        return rows > self.version[0] * (1 + RETRAIN_GROWTH)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Load the saved models, fitting them again if the statistics outgrew them.  BLOCKING OPERATION.
+
+        Args:
+            force (bool, optional): Fit again even if the models are current. Defaults to False.
+
+        Returns:
+            bool: If the models were fit again.
+        """
+        with self.lock:
+            version = StatsStore.get().version("campaign_stats", TRAINING_FILTER)
+            if self.eps_fit is None and not force:
+                self.load()
+            if not force and not self.stale(version):
+                return False
+            self.train()
+            self.save()
+            return True
+
+    def train(self, data: Optional[pd.DataFrame] = None):
+        """Fit all three models on data, or on everything in the store."""
+        start = time.perf_counter()
+        if data is None:
+            data = load_training_data()
+        eps = data["eps"].to_numpy(dtype=np.float64)
+        players = data["player_count"].to_numpy(dtype=np.float64)
+        self.eps_fit = LinearFit.fit(data[EPS_FEATURES].to_numpy(dtype=np.float64), eps)
+        self.needed_fit = LinearFit.fit(eps[:, None], players)
+        self.to_eps_fit = LinearFit.fit(players[:, None], eps)
+        self.version = (len(data), int(data["timestamp"].max()) if len(data) else 0)
+        self.data = data
+        self.fit_seconds = time.perf_counter() - start
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as arrays:
+            self.version = tuple(int(v) for v in arrays["version"])
+            self.eps_fit = LinearFit.from_arrays(arrays, "eps")
+            self.needed_fit = LinearFit.from_arrays(arrays, "needed")
+            self.to_eps_fit = LinearFit.from_arrays(arrays, "to_eps")
+        return True
+
+    def save(self):
+        np.savez(
+            self.path,
+            version=np.array(self.version),
+            **self.eps_fit.to_arrays("eps"),
+            **self.needed_fit.to_arrays("needed"),
+            **self.to_eps_fit.to_arrays("to_eps"),
+        )
 
-# XE = data[["eps", "mp_mult",'wins_per_sec','loss_per_sec','kills_per_sec','deaths_per_sec']]
-XE = data[["eps"]]
-YE = data["player_count"]
-model = LinearRegression()
-model.fit(X, Y)
+    def training_data(self) -> pd.DataFrame:
+        """The data the models were fit on, loaded again if they came from MODEL_PATH."""
+        if self.data is None:
+            self.data = load_training_data()
+        return self.data
+
+    def predict_eps(self, rows: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Predict the eps of every row from get_feature_dictionary in one go."""
+        if not rows:
+            return np.zeros(0)
+        X = np.array(
+            [[row[name] for name in EPS_FEATURES] for row in rows], dtype=np.float64
+        )
+        return self.eps_fit.predict(X)
 
-# Fit the linear regression model
-players_needed_model = LinearRegression()
-players_needed_model.fit(XE[["eps"]], YE)
+    def needed_players(self, eps: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """Players needed for each target eps, with the standard error of each."""
+        return self.needed_fit.predict_with_error(np.asarray(eps, dtype=np.float64))
 
-XE2 = data[["player_count"]]
-YE2 = data["eps"]
-players_to_eps_model = LinearRegression()
-players_to_eps_model.fit(XE2[["player_count"]], YE2)
+    def eps_for_players(self, players: Any) -> Tuple[np.ndarray, np.ndarray]:
+        """Eps expected from each player count, with the standard error of each."""
+        return self.to_eps_fit.predict_with_error(
+            np.asarray(players, dtype=np.float64)
+        )
 
+    def status_string(self) -> str:
+        rows, newest = self.version
+        return (
+            f"models fit on {rows} rows up to <t:{newest}:f> "
+            f"in {self.fit_seconds:.2f}s, eps mse {self.eps_fit.mse:.3f}"
+        )
 
-# Predict values
-predicted_eps = players_needed_model.predict(XE[["eps"]])
 
-# Calculate the mean squared error
-mse = mean_squared_error(YE, predicted_eps)
-# print(f"Mean Squared Error: {mse}")
+def predict_campaign_eps(features: Dict[Any, Dict[str, Any]]) -> Dict[Any, float]:
+    """Predict the eps of every campaign at once.
+
+    Args:
+        features (Dict[Any, Dict[str, Any]]): get_feature_dictionary rows by campaign key.
+
+    Returns:
+        Dict[Any, float]: Predicted eps by campaign key.
+    """
+    keys = list(features)
+    predicted = PredictionService.get().predict_eps([features[k] for k in keys])
+    return {k: float(p) for k, p in zip(keys, predicted)}
 
 
 def experiment_models():
+    data = PredictionService.get().training_data()
+    XE = data[["eps"]]
+    YE = data["player_count"]
     models = [
         ("Linear Regression", LinearRegression()),
         ("ElasticNet", ElasticNet()),
@@ -111,108 +299,25 @@ def experiment_models():
 
 
 def make_prediction_for_eps(data_dict):
-
-    prediction_features = {
-        "timestamp": data_dict["timestamp"],
-        "player_count": data_dict["player_count"],
-        "mode": data_dict["mode"],
-        "mp_mult": data_dict["mp_mult"],
-        "wins_per_sec": data_dict["wins_per_sec"],
-        "loss_per_sec": data_dict["loss_per_sec"],
-        "decay_rate": data_dict["decay_rate"],
-        "kills_per_sec": data_dict["kills_per_sec"],
-        "deaths_per_sec": data_dict["deaths_per_sec"],
-    }
-
-    # Extract features for prediction
-    features_for_prediction = pd.DataFrame([prediction_features])
-
-    # Predict using the model
-    eps_prediction = model.predict(
-        features_for_prediction[
-            [
-                "player_count",
-                "mp_mult",
-                "wins_per_sec",
-                "loss_per_sec",
-                "decay_rate",
-                "kills_per_sec",
-                "deaths_per_sec",
-            ]
-        ]
-    )
-
-    # Add the prediction result to the schema
-    # print(eps_prediction)
-
-    return eps_prediction[0]
+    return float(PredictionService.get().predict_eps([data_dict])[0])
 
 
 def predict_needed_players(target_eps, mp_mult):
-    prediction_features = {
-        "eps": target_eps,
-        "mp_mult": mp_mult,
-    }
-    # Extract features for prediction
-    features_for_prediction = pd.DataFrame([prediction_features])
-    # X_new = features_for_prediction[["eps", "mp_mult"]]
-    X_new = features_for_prediction[["eps"]]
-    y_pred = players_needed_model.predict(X_new)
-    needed = y_pred[0]
-
-    y = YE
-    # Calculate the standard error of the prediction
-    X_with_intercept = np.hstack((np.ones((XE.shape[0], 1)), XE))
-    X_new_with_intercept = np.hstack((np.ones((X_new.shape[0], 1)), X_new))
-    se_of_prediction = np.sqrt(
-        mse
-        * (
-            1
-            + np.dot(
-                np.dot(
-                    X_new_with_intercept,
-                    np.linalg.inv(np.dot(X_with_intercept.T, X_with_intercept)),
-                ),
-                X_new_with_intercept.T,
-            )
-        )
-    )
-    return needed, se_of_prediction
+    needed, se_of_prediction = PredictionService.get().needed_players(target_eps)
+    return float(needed), float(se_of_prediction)
 
 
 def predict_eps_for_players(players, mp_mult):
-    prediction_features = {
-        "player_count": players,
-        "mp_mult": mp_mult,
-    }
-    # Extract features for prediction
-    features_for_prediction = pd.DataFrame([prediction_features])
-    # X_new = features_for_prediction[["eps", "mp_mult"]]
-    X_new = features_for_prediction[["player_count"]]
-    y_pred = players_to_eps_model.predict(X_new)
-    needed = y_pred[0]
-
-    # Calculate the standard error of the prediction
-    X_with_intercept = np.hstack((np.ones((XE2.shape[0], 1)), XE2))
-    X_new_with_intercept = np.hstack((np.ones((X_new.shape[0], 1)), X_new))
-    se_of_prediction = np.sqrt(
-        mse
-        * (
-            1
-            + np.dot(
-                np.dot(
-                    X_new_with_intercept,
-                    np.linalg.inv(np.dot(X_with_intercept.T, X_with_intercept)),
-                ),
-                X_new_with_intercept.T,
-            )
-        )
-    )
-    return needed, se_of_prediction
+    eps, se_of_prediction = PredictionService.get().eps_for_players(players)
+    return float(eps), float(se_of_prediction)
 
 
-def make_graph():
-    se = np.sqrt(mse)
+def make_graph(service: Optional[PredictionService] = None):
+    service = service or PredictionService.get()
+    data = service.training_data()
+    XE = data[["eps"]]
+    YE = data["player_count"]
+    predicted_eps = service.needed_fit.predict(XE.to_numpy(dtype=np.float64))
 
     from matplotlib.font_manager import FontProperties
 
@@ -322,7 +427,13 @@ def make_graph():
     return image
 
 
-def make_graph2():
+def make_graph2(service: Optional[PredictionService] = None):
+    service = service or PredictionService.get()
+    data = service.training_data()
+    X = data[EPS_FEATURES]
+    Y = data["eps"]
+    XE = data[["eps"]]
+    YE = data["player_count"]
 
     from matplotlib.font_manager import FontProperties
 
@@ -341,12 +452,10 @@ def make_graph2():
     chosen_entry = X.sample(n=1, random_state=random.randint(0, 100)).iloc[0]
     # print(chosen_entry)
 
-    predicted = []
-    for i in np.linspace(0, 140, num=500):
-        cho = chosen_entry
-        cho["deaths_per_sec"] = i
-        out = model.predict(pd.DataFrame([cho]))
-        predicted.append(out)
+    deaths = np.linspace(0, 140, num=500)
+    rows = np.tile(chosen_entry.to_numpy(dtype=np.float64), (len(deaths), 1))
+    rows[:, EPS_FEATURES.index("deaths_per_sec")] = deaths
+    predicted = service.eps_fit.predict(rows)
 
     # predicted=model.predict(X)
     # print(predicted)
@@ -433,8 +542,11 @@ def make_graph2():
     return image
 
 
-def make_graph3():
-    se = np.sqrt(mse)
+def make_graph3(service: Optional[PredictionService] = None):
+    service = service or PredictionService.get()
+    data = service.training_data()
+    T = data["timestamp"]
+    X = data[EPS_FEATURES]
 
     from matplotlib.font_manager import FontProperties
 
@@ -522,5 +634,12 @@ def make_graph3():
     return image
 
 
-img = make_graph()
-img2 = make_graph2()
+def update_graphs():
+    """Draw the graphs again if the models were just fit or the graphs are missing."""
+    service = PredictionService.get()
+    if service.data is not None or not os.path.exists("saveData/graph1.png"):
+        make_graph(service)
+        make_graph2(service)
+
+
+update_graphs()
@@ -0,0 +1,88 @@
+import time
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import mean_squared_error
+
+from .predict import EPS_FEATURES, PredictionService
+
+"""
+Benchmark for PredictionService against the per campaign predictions it replaced.
+
+Needs the gathered campaign statistics, since it predicts from a sample of
+their rows:
+
+    python -m cogs.HD2.predict_benchmark
+"""
+
+
+def prediction_benchmark(campaigns: int = 40, repeats: int = 20) -> Dict[str, Any]:
+    """Time predicting every campaign one at a time the old way against one batch.
+
+    The old way fit sklearn models, then for each campaign built a DataFrame
+    to predict from and inverted X^T X over the whole training set for the
+    standard error.
+
+    Args:
+        campaigns (int, optional): Active campaigns to predict. Defaults to 40.
+        repeats (int, optional): Times to repeat each way. Defaults to 20.
+
+    Returns:
+        Dict[str, Any]: Milliseconds per round of all campaigns for each way,
+        and the largest difference between their predictions.
+    """
+    service = PredictionService.get()
+    data = service.training_data()
+    rows = data.sample(n=campaigns, replace=True, random_state=0).to_dict("records")
+
+    eps_model = LinearRegression().fit(data[EPS_FEATURES], data["eps"])
+    XE = data[["eps"]]
+    needed_model = LinearRegression().fit(XE, data["player_count"])
+    mse = mean_squared_error(data["player_count"], needed_model.predict(XE))
+
+    def legacy():
+        out = []
+        for row in rows:
+            eps = eps_model.predict(pd.DataFrame([row])[EPS_FEATURES])[0]
+            X_new = pd.DataFrame([{"eps": row["eps"]}])
+            needed = needed_model.predict(X_new)[0]
+            X_with_intercept = np.hstack((np.ones((XE.shape[0], 1)), XE))
+            X_new_with_intercept = np.hstack((np.ones((X_new.shape[0], 1)), X_new))
+            se = np.sqrt(
+                mse
+                * (
+                    1
+                    + X_new_with_intercept
+                    @ np.linalg.inv(X_with_intercept.T @ X_with_intercept)
+                    @ X_new_with_intercept.T
+                )
+            )
+            out.append((eps, needed, se[0, 0]))
+        return np.array(out)
+
+    def batch():
+        eps = service.predict_eps(rows)
+        needed, se = service.needed_players([row["eps"] for row in rows])
+        return np.column_stack([eps, needed, se])
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = fn()
+        return (time.perf_counter() - start) * 1000 / repeats, result
+
+    legacy_ms, legacy_out = timed(legacy)
+    batch_ms, batch_out = timed(batch)
+    return {
+        "rows": len(data),
+        "campaigns": campaigns,
+        "legacy_ms": round(legacy_ms, 3),
+        "batch_ms": round(batch_ms, 3),
+        "max_difference": float(np.max(np.abs(legacy_out - batch_out))),
+    }
+
+
+if __name__ == "__main__":
+    print(prediction_benchmark())
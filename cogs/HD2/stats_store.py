@@ -0,0 +1,303 @@
+import atexit
+import csv
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+"""
+Time series store for the statistics gathered by add_to_csv.
+
+Each poll used to reopen four csv files and append to them, and predict.py
+parsed the whole text of statistics.csv back in to train.  Rows now go into
+typed sqlite tables indexed by time and planet.  They're buffered and written
+in batches, at the end of each poll and on exit, and read back as numpy
+columns.
+"""
+
+STORE_PATH = "saveData/hd2_stats.sqlite"
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 60.0
+
+TABLES: Dict[str, Dict[str, str]] = {
+    "campaign_stats": {
+        "timestamp": "INTEGER",
+        "pid": "INTEGER",
+        "cid": "INTEGER",
+        "player_count": "INTEGER",
+        "all_players": "INTEGER",
+        "mode": "INTEGER",
+        "mp_mult": "REAL",
+        "wins_per_sec": "REAL",
+        "loss_per_sec": "REAL",
+        "decay_rate": "REAL",
+        "kills_per_sec": "REAL",
+        "deaths_per_sec": "REAL",
+        "eps": "REAL",
+        "biomeid": "INTEGER",
+        "dow": "INTEGER",
+        "hour": "INTEGER",
+        "owner": "INTEGER",
+        "attacker": "INTEGER",
+    },
+    "impact_track": {
+        "timestamp": "INTEGER",
+        "players_contriv": "INTEGER",
+        "total_players": "INTEGER",
+        "player_percent": "REAL",
+        "total_contrib": "REAL",
+        "per_second": "REAL",
+    },
+    "resource_track": {
+        "timestamp": "INTEGER",
+        "id": "INTEGER",
+        "value": "REAL",
+        "maxValue": "REAL",
+    },
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS campaign_stats_time ON campaign_stats (timestamp)",
+    "CREATE INDEX IF NOT EXISTS campaign_stats_planet ON campaign_stats (pid, timestamp)",
+    "CREATE INDEX IF NOT EXISTS impact_track_time ON impact_track (timestamp)",
+    "CREATE INDEX IF NOT EXISTS resource_track_id ON resource_track (id, timestamp)",
+]
+
+# Old csv files, imported the first time the store is opened.
+LEGACY_CSVS = [
+    ("statistics_newer.csv", "campaign_stats"),
+    ("statistics.csv", "campaign_stats"),
+    ("impact_track.csv", "impact_track"),
+    ("funny_number_track.csv", "resource_track"),
+]
+
+
+class StatsStore:
+    """Buffered, typed time series tables in one sqlite file.
+
+    Args:
+        path (str, optional): Database file. Defaults to STORE_PATH.
+        flush_rows (int, optional): Buffered rows that trigger a write. Defaults to FLUSH_ROWS.
+        flush_seconds (float, optional): Oldest a buffered row gets before a write. Defaults to FLUSH_SECONDS.
+    """
+
+    _instance: Optional["StatsStore"] = None
+
+    def __init__(
+        self,
+        path: str = STORE_PATH,
+        flush_rows: int = FLUSH_ROWS,
+        flush_seconds: float = FLUSH_SECONDS,
+    ):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.pending: Dict[str, List[tuple]] = {table: [] for table in TABLES}
+        self.pending_since: Optional[float] = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for table, columns in TABLES.items():
+            cols = ", ".join(f"{name} {kind}" for name, kind in columns.items())
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({cols})")
+        for statement in INDEXES:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    @classmethod
+    def get(cls) -> "StatsStore":
+        """Get the shared store, opening it and importing old csv files the first time."""
+        if cls._instance is None:
+            cls._instance = cls()
+            cls._instance.import_legacy_csvs()
+            atexit.register(cls._instance.flush)
+        return cls._instance
+
+    def append(self, table: str, rows: Sequence[Dict[str, Any]]):
+        """Buffer rows for table, writing the buffer out if it's full or old enough.
+
+        Args:
+            table (str): One of TABLES.
+            rows (Sequence[Dict[str, Any]]): Rows keyed by column name, missing columns are stored as NULL.
+        """
+        columns = TABLES[table]
+        with self.lock:
+            self.pending[table].extend(
+                tuple(row.get(name) for name in columns) for row in rows
+            )
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            size = sum(len(v) for v in self.pending.values())
+            age = time.monotonic() - self.pending_since
+            if size >= self.flush_rows or age >= self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        """Write every buffered row in one transaction."""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        with self.conn:
+            for table, rows in self.pending.items():
+                if rows:
+                    marks = ", ".join("?" for _ in TABLES[table])
+                    self.conn.executemany(
+                        f"INSERT INTO {table} VALUES ({marks})", rows
+                    )
+        self.pending = {table: [] for table in TABLES}
+        self.pending_since = None
+
+    def query(
+        self,
+        table: str,
+        columns: Optional[Sequence[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        pid: Optional[int] = None,
+        where: str = "",
+    ) -> Dict[str, np.ndarray]:
+        """Read rows from table as one numpy array per column, ordered by time.
+
+        Args:
+            table (str): One of TABLES.
+            columns (Optional[Sequence[str]], optional): Columns to read. Defaults to all of them.
+            start (Optional[int], optional): Earliest unix timestamp, inclusive. Defaults to None.
+            end (Optional[int], optional): Latest unix timestamp, exclusive. Defaults to None.
+            pid (Optional[int], optional): Only this planet, for campaign_stats. Defaults to None.
+            where (str, optional): Extra sql condition on the columns. Defaults to "".
+
+        Returns:
+            Dict[str, np.ndarray]: Column name to values.  Integer columns with
+            missing values come back as floats with nan.
+        """
+        schema = TABLES[table]
+        columns = list(columns or schema)
+        for name in columns:
+            if name not in schema:
+                raise KeyError(f"{table} has no column {name}")
+        conditions, args = [], []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            args.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            args.append(end)
+        if pid is not None:
+            conditions.append("pid = ?")
+            args.append(pid)
+        if where:
+            conditions.append(f"({where})")
+        sql = f"SELECT {', '.join(columns)} FROM {table}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY timestamp"
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(sql, args).fetchall()
+        out = {}
+        for i, name in enumerate(columns):
+            values = [row[i] for row in rows]
+            if schema[name] == "INTEGER" and None not in values:
+                out[name] = np.array(values, dtype=np.int64)
+            else:
+                out[name] = np.array(values, dtype=np.float64)
+        return out
+
+    def count(self, table: str) -> int:
+        with self.lock:
+            self._flush()
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def version(self, table: str, where: str = "") -> Tuple[int, int]:
+        """Get the row count and newest timestamp of table, to tell if it changed.
+
+        Args:
+            table (str): One of TABLES.
+            where (str, optional): Only count rows matching this sql condition. Defaults to "".
+
+        Returns:
+            Tuple[int, int]: Rows, and the newest timestamp or 0 if it's empty.
+        """
+        sql = f"SELECT COUNT(*), MAX(timestamp) FROM {table}"
+        if where:
+            sql += f" WHERE {where}"
+        with self.lock:
+            self._flush()
+            rows, newest = self.conn.execute(sql).fetchone()
+        return rows, newest or 0
+
+    def import_csv(self, path: str, table: str, before: Optional[int] = None) -> int:
+        """Copy the rows of an old csv file into table.
+
+        Rows without a timestamp are skipped.
+
+        Args:
+            path (str): The csv file.
+            table (str): One of TABLES.
+            before (Optional[int], optional): Only rows older than this timestamp. Defaults to None.
+
+        Returns:
+            int: Rows imported.
+        """
+        columns = TABLES[table]
+        rows = []
+        with open(path, newline="", encoding="utf8") as file:
+            for row in csv.DictReader(file):
+                values = []
+                for name, kind in columns.items():
+                    value = row.get(name)
+                    if value in (None, ""):
+                        values.append(None)
+                    elif kind == "INTEGER":
+                        values.append(int(float(value)))
+                    else:
+                        values.append(float(value))
+                if values[0] is None:
+                    # Can't be placed in time, so it's no use to any track.
+                    continue
+                if before is not None and values[0] >= before:
+                    continue
+                rows.append(tuple(values))
+        marks = ", ".join("?" for _ in columns)
+        with self.lock, self.conn:
+            self.conn.executemany(f"INSERT INTO {table} VALUES ({marks})", rows)
+        return len(rows)
+
+    def import_legacy_csvs(self):
+        """Import the old csv files into any tables that are still empty."""
+        empty = {table for table in TABLES if self.count(table) == 0}
+        first_new: Optional[int] = None
+        for path, table in LEGACY_CSVS:
+            if table not in empty or not os.path.exists(path):
+                continue
+            # statistics.csv overlaps statistics_newer.csv, so only its older rows are kept.
+            imported = self.import_csv(path, table, before=first_new)
+            print(f"imported {imported} rows from {path} into {table}")
+            if path == "statistics_newer.csv":
+                first_new = self.conn.execute(
+                    "SELECT MIN(timestamp) FROM campaign_stats"
+                ).fetchone()[0]
+
+    def export_csv(self, table: str, path: str):
+        """Write all of table to a csv file."""
+        data = self.query(table)
+        columns = list(TABLES[table])
+        with open(path, mode="w", newline="", encoding="utf8") as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for row in zip(*(data[name] for name in columns)):
+                writer.writerow(
+                    [v.item() if not np.isnan(v) else "" for v in row]
+                )
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import aiohttp
+import discord
+import gui
+from utility.debug import percentile
+
+"""
+Concurrent webhook delivery for the HD2 event log.
+
+Every subscribed hook gets its own worker, so a burst of events goes out to all
+servers at once instead of one post at a time.  A hook's messages are still sent
+in order.  discord.py waits out a webhook's rate limit bucket when the response
+headers say it is exhausted; 429s it gives up on, server errors and connection
+errors are retried here with exponential backoff, and the hook is held back
+until the backoff expires.
+"""
+
+EMBED_BATCH_CHARS = 6000
+EMBED_BATCH_COUNT = 10
+
+
+def embed_batches(embeds: List[discord.Embed]) -> List[List[discord.Embed]]:
+    """Split embeds into groups that each fit in a single webhook message.
+
+    Each embed is serialized once, and the size of the current group is kept
+    as a running total.
+
+    Args:
+        embeds (List[discord.Embed]): Embeds to send, in order.
+
+    Returns:
+        List[List[discord.Embed]]: The groups, in order.
+    """
+    batches = []
+    batch, batch_size = [], 0
+    for embed in embeds:
+        size = len(json.dumps(embed.to_dict()))
+        if batch and (
+            batch_size + size > EMBED_BATCH_CHARS or len(batch) >= EMBED_BATCH_COUNT
+        ):
+            batches.append(batch)
+            batch, batch_size = [], 0
+        batch.append(embed)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def retry_after(error: discord.HTTPException) -> float:
+    """Get the Retry-After header of a failed request, 0 if there isn't one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class WebhookDelivery:
+    """Posts messages to many webhook urls through one shared aiohttp session.
+
+    Args:
+        max_concurrent (int, optional): Requests in flight at once. Defaults to 16.
+        max_attempts (int, optional): Attempts per message before a hook is given up on. Defaults to 5.
+        base_delay (float, optional): First backoff delay in seconds. Defaults to 1.0.
+        max_delay (float, optional): Longest backoff delay in seconds. Defaults to 60.0.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.blocked_until: Dict[str, float] = {}
+        self.latencies: Deque[float] = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def backoff(self, attempt: int, at_least: float = 0.0) -> float:
+        delay = min(self.max_delay, self.base_delay * (2**attempt))
+        delay *= 0.5 + random.random() / 2
+        return max(delay, at_least)
+
+    async def post(
+        self,
+        url: str,
+        content: str = "",
+        embeds: Optional[List[discord.Embed]] = None,
+        username: Optional[str] = None,
+        avatar_url: Optional[str] = None,
+    ) -> discord.WebhookMessage:
+        """Post one message to url, retrying failures that might go away.
+
+        Raises:
+            discord.HTTPException: The hook is gone, forbidden, or kept failing.
+            aiohttp.ClientError: The hook kept failing to connect.
+        """
+        webhook = discord.Webhook.from_url(url, session=self.get_session())
+        error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            wait = self.blocked_until.get(url, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                async with self.semaphore:
+                    return await webhook.send(
+                        content=content,
+                        username=username,
+                        avatar_url=avatar_url,
+                        embeds=embeds or [],
+                        wait=True,
+                    )
+            except (discord.NotFound, discord.Forbidden):
+                raise
+            except discord.HTTPException as e:
+                if e.status != 429 and e.status < 500:
+                    raise
+                error = e
+                delay = self.backoff(attempt, retry_after(e))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                delay = self.backoff(attempt)
+            self.retries += 1
+            self.blocked_until[url] = time.monotonic() + delay
+            gui.dprint(
+                f"webhook post failed ({error}), attempt {attempt + 1}, retrying in {delay:.1f}s"
+            )
+        raise error
+
+    async def deliver(
+        self, hooks: List[str], messages: List[Dict[str, Any]]
+    ) -> Dict[str, Exception]:
+        """Send every message to every hook, all hooks at once.
+
+        Args:
+            hooks (List[str]): Webhook urls.
+            messages (List[Dict[str, Any]]): Keyword arguments for post, sent to each hook in order.
+
+        Returns:
+            Dict[str, Exception]: Each hook that failed, with the error that stopped it.
+        """
+        start = time.monotonic()
+
+        async def to_hook(url: str):
+            for kwargs in messages:
+                await self.post(url, **kwargs)
+                self.sent += 1
+                self.latencies.append(time.monotonic() - start)
+
+        results = await asyncio.gather(
+            *(to_hook(url) for url in hooks), return_exceptions=True
+        )
+        failed = {}
+        for url, result in zip(hooks, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                failed[url] = result
+        return failed
+
+    def latency_percentiles(self) -> Dict[str, float]:
+        """p50, p95 and max seconds from a delivery starting to each message being sent."""
+        return {
+            "p50": percentile(self.latencies, 0.5),
+            "p95": percentile(self.latencies, 0.95),
+            "max": percentile(self.latencies, 1.0),
+        }
+
+    def status_string(self) -> str:
+        lat = self.latency_percentiles()
+        return (
+            f"{self.sent} sent, {self.failed} hooks failed, {self.retries} retries\n"
+            f"latency p50 {lat['p50']:.2f}s, p95 {lat['p95']:.2f}s, max {lat['max']:.2f}s"
+        )
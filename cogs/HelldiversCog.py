@@ -243,6 +243,7 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
     def cog_unload(self):
         if self.img:
             self.img = None
+        hd2.StatsStore.get().flush()
         # hd2.save_to_json(self.apistatus, "./saveData/hd2_snapshot.json")
         TCTaskManager.remove_task("SuperEarthStatus")
         Guild_Task_Functions.remove_task_function("WARSTATUS")
@@ -256,7 +257,7 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
             hd2.add_to_csv(self.apistatus)
         return
 
-    async def make_planets(self, ctx, usebiome=""):
+    async def make_planets(self, ctx, usebiome="", force=False):
         print("Updating planets.")
 
         async def update_planet(planet, ctx):
@@ -268,7 +269,7 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
                     if planetbiome["biome"] != usebiome:
                         return
                 thread = asyncio.to_thread(
-                    hd2.get_planet, planet.index, planetbiome["biome"]
+                    hd2.get_planet, planet.index, planetbiome["biome"], force
                 )
                 await thread
 
@@ -306,7 +307,11 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
             print("updating war")
             await self.update_data()
 
-            await asyncio.gather(asyncio.to_thread(self.draw_img), asyncio.sleep(1))
+            await asyncio.gather(
+                asyncio.to_thread(self.draw_img),
+                asyncio.to_thread(hd2.PredictionService.get().refresh),
+                asyncio.sleep(1),
+            )
 
         except Exception as e:
             await self.bot.send_error(e, "Message update cleanup error.")
@@ -378,10 +383,12 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
 
     @commands.is_owner()
     @commands.command(name="make_planets")
-    async def planetmaker(self, ctx: commands.Context, usebiome: str = ""):
+    async def planetmaker(
+        self, ctx: commands.Context, usebiome: str = "", force: bool = False
+    ):
 
         await ctx.send("Making planets")
-        await self.make_planets(ctx, usebiome)
+        await self.make_planets(ctx, usebiome, force)
 
         await ctx.send("made planets")
 
@@ -389,9 +396,13 @@ class HelldiversCog(commands.Cog, TC_Cog_Mixin):
     @commands.command(name="get_csv")
     async def get_csv(self, ctx: commands.Context):
         hd2.write_statistics_to_csv(self.apistatus)
-        await ctx.send(file=discord.File("statistics.csv"))
+        await asyncio.to_thread(
+            hd2.StatsStore.get().export_csv,
+            "campaign_stats",
+            "campaign_stats_export.csv",
+        )
         await ctx.send(file=discord.File("statistics_sub.csv"))
-        await ctx.send(file=discord.File("statistics_newer.csv"))
+        await ctx.send(file=discord.File("campaign_stats_export.csv"))
 
     @commands.is_owner()
     @commands.command(name="direct_mode")
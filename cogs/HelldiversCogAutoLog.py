@@ -51,7 +51,9 @@ from hd2api import (
 
 from hd2api.constants import faction_names
 from cogs.HD2.maths import maths
-from cogs.HD2.diff_util import process_planet_attacks, GameEvent,EventModes
+from cogs.HD2.diff_util import process_planet_attacks, GameEvent,EventModes, benchmark_diff
+from cogs.HD2.diff_replay import replay_events
+from cogs.HD2.webhook_delivery import WebhookDelivery, embed_batches
 from utility.manual_load import load_json_with_substitutions
 
 
@@ -974,6 +976,7 @@ class HelldiversAutoLog(commands.Cog, TC_Cog_Mixin):
         self.titleids = {}
         self.messageids = {}
         self.redirect_hook=""
+        self.delivery = WebhookDelivery()
         snap = hd2.load_from_json("./saveData/mt_pairs.json")
         if snap:
             for i, v in snap["titles"].items():
@@ -1006,6 +1009,7 @@ class HelldiversAutoLog(commands.Cog, TC_Cog_Mixin):
         self.run2.cancel()
         hold = {"titles": self.titleids, "messages": self.messageids}
         hd2.save_to_json(hold, "./saveData/mt_pairs.json")
+        asyncio.create_task(self.delivery.close())
 
     def load_test_files(self):
         now = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -1036,20 +1040,16 @@ class HelldiversAutoLog(commands.Cog, TC_Cog_Mixin):
 
         for batch_id in list(self.batches.keys()):
             texts = self.batches[batch_id].combo_checker()
-            for t in texts:
-                for hook in list(self.loghook):
-                    try:
-                        await web.postMessageAsWebhookWithURL(
-                            hook,
-                            message_content=t,
-                            display_username="SUPER EVENT",
-                            avatar_url=self.bot.user.avatar.url,
-                        )
-                    except Exception as e:
-                        await self.bot.send_error(e, "Webhook error")
-                        if hook != AssetLookup.get_asset("loghook", "urls"):
-                            self.loghook.remove(hook)
-                            # ServerHDProfile.set_all_matching_webhook_to_none(hook)
+            if texts:
+                messages = [
+                    {
+                        "content": t,
+                        "username": "SUPER EVENT",
+                        "avatar_url": self.bot.user.avatar.url,
+                    }
+                    for t in texts
+                ]
+                await self.deliver_to_loghooks(messages)
 
             self.batches.pop(batch_id)
 
@@ -1089,52 +1089,41 @@ class HelldiversAutoLog(commands.Cog, TC_Cog_Mixin):
                     if embed.color==0xAC50FE:
                         subthread.append(embed)
         thishook=AssetLookup.get_asset("subhook", "urls")
-        if thishook:
-            for s in subthread:
-                try:
-                    await web.postMessageAsWebhookWithURL(
-                        thishook,
-                        message_content="This is a redirect",
-                        display_username="Super Earth Event Log",
-                        avatar_url=self.bot.user.avatar.url,
-                        embed=[s],
-                    )
-                except Exception as e:
-                    await self.bot.send_error(e, "Webhook error")
+        if thishook and subthread:
+            redirects = [
+                {
+                    "content": "This is a redirect",
+                    "embeds": [s],
+                    "username": "Super Earth Event Log",
+                    "avatar_url": self.bot.user.avatar.url,
+                }
+                for s in subthread
+            ]
+            failed = await self.delivery.deliver([thishook], redirects)
+            for e in failed.values():
+                await self.bot.send_error(e, "Webhook error")
 
         if not embeds:
             return
 
-        val_batches = []
-        batch = []
-        for e in embeds:
-            val = json.dumps(e.to_dict())
-            size = len(val)
-            if (
-                sum(len(json.dumps(b.to_dict())) for b in batch) + size > 6000
-                or len(batch) >= 10
-            ):
-                val_batches.append(batch)
-                batch = [e]
-            else:
-                batch.append(e)
-        if batch:
-            val_batches.append(batch)
-        for embeds in val_batches:
-            for hook in list(self.loghook):
-                try:
-                    await web.postMessageAsWebhookWithURL(
-                        hook,
-                        message_content="",
-                        display_username="Super Earth Event Log",
-                        avatar_url=self.bot.user.avatar.url,
-                        embed=embeds,
-                    )
-                except Exception as e:
-                    await self.bot.send_error(e, "Webhook error")
-                    if hook != AssetLookup.get_asset("loghook", "urls"):
-                        self.loghook.remove(hook)
-
+        messages = [
+            {
+                "embeds": batch,
+                "username": "Super Earth Event Log",
+                "avatar_url": self.bot.user.avatar.url,
+            }
+            for batch in embed_batches(embeds)
+        ]
+        await self.deliver_to_loghooks(messages)
+
+    async def deliver_to_loghooks(self, messages: List[Dict[str, Any]]):
+        """Send messages to every log hook at once, dropping hooks that fail."""
+        failed = await self.delivery.deliver(list(self.loghook), messages)
+        for hook, e in failed.items():
+            await self.bot.send_error(e, "Webhook error")
+            if hook != AssetLookup.get_asset("loghook", "urls") and hook in self.loghook:
+                self.loghook.remove(hook)
+                # ServerHDProfile.set_all_matching_webhook_to_none(hook)
 
     async def build_embed(self, item: GameEvent):
         event_type = item.mode
@@ -1379,6 +1368,55 @@ class HelldiversAutoLog(commands.Cog, TC_Cog_Mixin):
         await self.load_log()
         await ctx.send("Done testing now.")
 
+    @commands.is_owner()
+    @commands.command(name="diff_bench")
+    async def diff_bench(self, ctx: commands.Context):
+        """Time the snapshot diff engines over the recorded test files."""
+        if len(self.test_with) < 2:
+            await ctx.send("Need at least two snapshots in ./saveData/testwith.")
+            return
+        rows = await benchmark_diff(self.test_with)
+        legacy = sum(r["legacy"] for r in rows)
+        structural = sum(r["structural"] for r in rows)
+        mismatched = [str(r["pair"]) for r in rows if not r["match"]]
+        out = (
+            f"{len(rows)} snapshot pairs\n"
+            f"legacy: {legacy:.3f}s, structural: {structural:.3f}s"
+        )
+        if mismatched:
+            out += f"\nOutput differed on pairs {', '.join(mismatched)}"
+        await ctx.send(out)
+
+    @commands.is_owner()
+    @commands.command(name="event_replay")
+    async def event_replay(self, ctx: commands.Context):
+        """Check the indexed event matchers against the legacy ones over the recorded test files."""
+        if len(self.test_with) < 2:
+            await ctx.send("Need at least two snapshots in ./saveData/testwith.")
+            return
+        rows = await replay_events(self.test_with)
+        legacy = sum(r["legacy"] for r in rows)
+        indexed = sum(r["indexed"] for r in rows)
+        events = sum(r["events"] for r in rows)
+        mismatched = [
+            f"{r['pair']} ({', '.join(r['mismatched'])})" for r in rows if r["mismatched"]
+        ]
+        out = (
+            f"{len(rows)} snapshot pairs, {events} events\n"
+            f"legacy: {legacy:.3f}s, indexed: {indexed:.3f}s"
+        )
+        if mismatched:
+            out += f"\nEvents differed on pairs {', '.join(mismatched)}"
+        await ctx.send(out)
+
+    @commands.is_owner()
+    @commands.command(name="hook_stats")
+    async def hook_stats(self, ctx: commands.Context):
+        """Show event log delivery counts and latency."""
+        await ctx.send(
+            f"{len(self.loghook)} hooks\n{self.delivery.status_string()}"
+        )
+
     @commands.is_owner()
     @commands.command(name="planeteffectget")
     async def peffect(self, ctx: commands.Context):
@@ -436,7 +436,7 @@ class HelldiversMathCog(commands.Cog, TC_Cog_Mixin):
     
         ctx: commands.Context = await self.bot.get_context(interaction)
         mes=await ctx.send("Graphing...",ephemeral=True)
-        df5 = pd.read_csv('funny_number_track.csv')
+        df5 = pd.DataFrame(hd2.StatsStore.get().query("resource_track"))
 
         df_groupeds = df5.groupby('timestamp', group_keys=False).apply(lambda x: x.to_dict(orient='records')[0]).reset_index()
         df25= df_groupeds[0]
@@ -482,7 +482,7 @@ class HelldiversMathCog(commands.Cog, TC_Cog_Mixin):
     
         ctx: commands.Context = await self.bot.get_context(interaction)
         mes=await ctx.send("Graphing...",ephemeral=True)
-        df5 = pd.read_csv('funny_number_track.csv')
+        df5 = pd.DataFrame(hd2.StatsStore.get().query("resource_track"))
 
         df_groupeds = df5.groupby('timestamp', group_keys=False).apply(lambda x: x.to_dict(orient='records')[0]).reset_index()
         df25= df_groupeds[0]
@@ -77,6 +77,12 @@ class MusicCog(commands.Cog, TC_Cog_Mixin):
         """
         self.song_add_processer.start()
 
+    async def cog_load(self):
+        # Build the song search index now instead of on the first search.
+        self.bot.loop.create_task(
+            asyncio.to_thread(MusicJSONMemoryDB.get_search_index)
+        )
+
     def cog_unload(self):
         self.song_add_processer.cancel()
 
@@ -89,6 +95,7 @@ class MusicCog(commands.Cog, TC_Cog_Mixin):
         for i in MusicManager.all_players():
             await i.countusers()
             await i.songadd()
+            i.prefetch_sources()
             await i.edit_current_player()
             removeif = await i.autodisconnect()
             if removeif:
@@ -367,6 +374,21 @@ class MusicCog(commands.Cog, TC_Cog_Mixin):
         )
         # await self.send_player(interaction)
 
+    @mp.command(
+        name="playbackstats",
+        description="View how long songs took to start playing.",
+    )
+    async def playback_stats(self, interaction: discord.Interaction):
+        ctx: commands.Context = await self.bot.get_context(interaction)
+        guild: discord.Guild = interaction.guild
+        player = MusicManager.get(guild)
+        if player is None:
+            await ctx.send("There's no music player in this server.")
+            return
+        await MessageTemplatesMusic.music_msg(
+            ctx, "Playback Stats", player.prefetcher.status_string()
+        )
+
     @mp.command(name="resume", description="Resume current song in Voice Channel")
     async def resume(self, interaction: discord.Interaction):
         ctx: commands.Context = await self.bot.get_context(interaction)
@@ -699,6 +721,10 @@ class MusicCog(commands.Cog, TC_Cog_Mixin):
             return
         profile.add_song(filepath, filesize)
         await file.save(filepath)
+        try:
+            await MediaProbeCache.probe(filepath)
+        except Exception as e:
+            gui.dprint(f"could not probe {filepath}: {e}")
         await MessageTemplatesMusic.music_msg(
             ctx, "filecheck", f"Uploaded {file.filename} to my radio folder!"
         )
@@ -861,12 +887,25 @@ class MusicCog(commands.Cog, TC_Cog_Mixin):
         else:
             await MessageTemplatesMusic.music_msg(ctx, "?", f"{res}")
 
+    @commands.is_owner()
+    @commands.command(name="musicindex")
+    async def music_index(self, ctx: commands.Context):
+        """Probe every file in the radio folder that isn't in the probe cache."""
+        mess = await ctx.send("indexing the radio folder...")
+        result = await MediaProbeCache.index_directory(get_audio_directory())
+        await mess.edit(
+            content=f"{result['probed']} files probed, {result['cached']} already cached, "
+            f"{result['failed']} failed.\n{MediaProbeCache.status_string()}"
+        )
+
     @mp.command(name="search", description="search cache")
     async def search(self, interaction: discord.Interaction, search: str):
         ctx: commands.Context = await self.bot.get_context(interaction)
         guild: discord.Guild = interaction.guild
         me = await ctx.send("searching... <a:trianglepointer:1132773635195686924>")
-        results = MusicJSONMemoryDB.search(search, do_maxsearch=True)
+        results = await asyncio.to_thread(
+            MusicJSONMemoryDB.search, search, do_maxsearch=True
+        )
         text = "\n".join(f"{e}:{s}" for e, s in enumerate(results))
         if text:
             await me.edit(content=text)
@@ -1,15 +1,22 @@
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, and_, or_
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import relationship, joinedload
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 import discord
-from database import DatabaseSingleton, AwareDateTime
+from database import DatabaseSingleton, AwareDateTime, upsert_all
 from utility import hash
 
 
 PollingBase = declarative_base(name="Polling System Base")
 
+CHOICES = "ABCDE"
+# Buffered votes are written once this many are waiting, or by the
+# PollingCog's flush loop, whichever is first.
+FLUSH_VOTES = 200
+
 
 class PollTable(PollingBase):
     __tablename__ = "poll_table"
@@ -112,81 +119,61 @@ class PollTable(PollingBase):
 
     @staticmethod
     def vote(button_id, user_id):
+        """Record a vote from a poll button.
+
+        The vote goes into poll_votes, which updates the poll's counts
+        and writes the vote in batches, so a vote no longer recounts
+        the whole poll.
+
+        Args:
+            button_id (str): custom_id of the pressed button, "poll_id:choice_x".
+            user_id (int): Who voted.
+
+        Returns:
+            Tuple[str, PollTable]: A message for the voter and the poll.
+        """
         session = DatabaseSingleton.get_session()
         poll_id, choice = button_id.split(":")
-        poll = session.query(PollTable).filter_by(poll_id=poll_id).first()
-        if datetime.now() > poll.end_date:
-            return "This poll is over."
-        poll_data = (
-            session.query(PollData)
-            .filter(and_(PollData.poll_id == poll_id, PollData.user_id == user_id))
-            .first()
-        )
-        mypoll = PollTable.get(poll_id)
-
-        if poll_data:
-            # return "You have already voted and cannot change your vote.", mypoll
-            new_choice = choice.split("_")[1].upper()
-            if poll_data.choice != new_choice:
-                poll.change_vote = True
-                poll_data.choice = new_choice
-                session.commit()
-        else:
-            poll.change_vote = True
-            poll_data = PollData(
-                poll_id=poll_id, user_id=user_id, choice=choice.split("_")[1].upper()
-            )
-            session.add(poll_data)
+        poll = session.get(PollTable, int(poll_id))
+        # end_date loads timezone aware.
+        if datetime.now().astimezone() > poll.end_date:
+            return "This poll is over.", poll
 
-            session.commit()
+        new_choice = choice.split("_")[1].upper()
+        poll_votes.record(session, poll.poll_id, user_id, new_choice)
 
-        mypoll.tally()
+        return "Your vote has been recorded.", poll
 
-        return "Your vote has been recorded.", mypoll
+    @staticmethod
+    def flush_votes() -> int:
+        """Write every buffered vote.  Returns how many were written."""
+        return poll_votes.flush(DatabaseSingleton.get_session())
 
     def tally(poll):
-        active = poll.active
+        """Recount this poll's votes from poll_data."""
         session = DatabaseSingleton.get_session()
-        poll_data = session.query(PollData).filter_by(poll_id=poll.poll_id).all()
-        total_votes = len(poll_data)
-        votes_a = votes_b = votes_c = votes_d = votes_e = 0
-        for data in poll_data:
-            choice = data.choice
-            if choice == "A":
-                votes_a += 1
-            elif choice == "B":
-                votes_b += 1
-            elif choice == "C":
-                votes_c += 1
-            elif choice == "D":
-                votes_d += 1
-            elif choice == "E":
-                votes_e += 1
-        poll.result_a = votes_a
-        poll.result_b = votes_b
-        poll.result_c = votes_c
-        poll.result_d = votes_d
-        poll.result_e = votes_e
-        session.commit()
+        poll_votes.flush(session)
+        reconcile_counts(session, [poll.poll_id])
 
-    def get_tally(poll):
-        active = poll.active
+    @staticmethod
+    def reconcile_tallies() -> int:
+        """Recount every active poll from poll_data, in case a counter drifted.
+
+        Returns:
+            int: How many polls had wrong counts.
+        """
         session = DatabaseSingleton.get_session()
-        total_votes = (
-            poll.result_a
-            + poll.result_b
-            + poll.result_c
-            + poll.result_d
-            + poll.result_e
-        )
-        return (
-            total_votes,
-            poll.result_a,
-            poll.result_b,
-            poll.result_c,
-            poll.result_d,
-            poll.result_e,
-        )
+        poll_votes.flush(session)
+        return reconcile_counts(session)
+
+    def get_tally(poll):
+        """The stored counts plus any votes still in the buffer."""
+        pending = poll_votes.pending(poll.poll_id)
+        counts = [
+            (getattr(poll, f"result_{c.lower()}") or 0) + pending.get(c, 0)
+            for c in CHOICES
+        ]
+        return (sum(counts), *counts)
 
     @staticmethod
     def is_real(poll_id):
@@ -308,6 +295,162 @@ class PollData(PollingBase):
     poll = relationship("PollTable", backref="poll_data")
 
 
+def count_changes(deltas: Dict[str, int]) -> Dict[str, Any]:
+    """UPDATE values that add deltas to a poll's counters in the database."""
+    changes = {}
+    for choice, delta in deltas.items():
+        if delta:
+            column = getattr(PollTable, f"result_{choice.lower()}")
+            changes[column.key] = func.coalesce(column, 0) + delta
+    return changes
+
+
+class VoteBuffer:
+    """Write behind buffer for poll votes.
+
+    Recording a vote works out how it changes the poll's counts straight
+    away, by looking up only that user's previous choice.  The votes and
+    the count changes are written together by flush, as one upsert and one
+    atomic UPDATE per poll, so a burst of votes costs a few statements
+    instead of a recount per vote.
+
+    Args:
+        limit (int, optional): Flush once this many votes are waiting. Defaults to FLUSH_VOTES.
+    """
+
+    def __init__(self, limit: int = FLUSH_VOTES):
+        self.limit = limit
+        self.votes: Dict[Tuple[int, int], str] = {}
+        self.deltas: Dict[int, Dict[str, int]] = {}
+        self.recorded = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self.votes)
+
+    def record(self, session: Session, poll_id: int, user_id: int, choice: str) -> bool:
+        """Buffer a vote.
+
+        Args:
+            session (Session): Session to look up the previous vote and flush with.
+            poll_id (int): The poll.
+            user_id (int): Who voted.
+            choice (str): "A" to "E".
+
+        Returns:
+            bool: False if the user already had this choice.
+        """
+        key = (poll_id, user_id)
+        previous = self.votes.get(key)
+        if previous is None:
+            # Not session.get, since flush writes around the identity map.
+            previous = session.execute(
+                select(PollData.choice).where(
+                    PollData.poll_id == poll_id, PollData.user_id == user_id
+                )
+            ).scalar()
+        if previous == choice:
+            return False
+        deltas = self.deltas.setdefault(poll_id, dict.fromkeys(CHOICES, 0))
+        if previous in deltas:
+            deltas[previous] -= 1
+        deltas[choice] += 1
+        self.votes[key] = choice
+        self.recorded += 1
+        if len(self.votes) >= self.limit:
+            self.flush(session)
+        return True
+
+    def pending(self, poll_id: int) -> Dict[str, int]:
+        """Count changes for poll_id that aren't written yet."""
+        return self.deltas.get(poll_id, {})
+
+    def flush(self, session: Session) -> int:
+        """Write the buffered votes and count changes in one transaction.
+
+        If the write fails, the transaction is rolled back and the buffer is
+        kept, so the next flush tries the same votes again.
+
+        Returns:
+            int: How many votes were written.
+        """
+        if not self.votes:
+            return 0
+        rows = [
+            {"poll_id": poll_id, "user_id": user_id, "choice": choice}
+            for (poll_id, user_id), choice in self.votes.items()
+        ]
+        try:
+            upsert_all(session, PollData, rows)
+            for poll_id, deltas in self.deltas.items():
+                session.execute(
+                    update(PollTable)
+                    .where(PollTable.poll_id == poll_id)
+                    .values(change_vote=True, **count_changes(deltas))
+                    .execution_options(synchronize_session=False)
+                )
+            # Commit expires loaded polls, so they pick up the new counts.
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        self.votes = {}
+        self.deltas = {}
+        self.flushes += 1
+        return len(rows)
+
+    def status_string(self) -> str:
+        return (
+            f"{len(self.votes)} votes buffered for {len(self.deltas)} polls, "
+            f"{self.recorded} recorded in {self.flushes} flushes"
+        )
+
+
+poll_votes = VoteBuffer()
+
+
+def reconcile_counts(session: Session, poll_ids: Optional[List[int]] = None) -> int:
+    """Reset poll counters to a GROUP BY count of poll_data.
+
+    Flush the vote buffer first, or its votes will be counted twice.
+
+    Args:
+        session (Session): The session to use.
+        poll_ids (List[int], optional): Polls to check.  Defaults to every active poll.
+
+    Returns:
+        int: How many polls had wrong counts.
+    """
+    query = select(PollTable)
+    if poll_ids is None:
+        query = query.where(PollTable.active == True)
+    else:
+        query = query.where(PollTable.poll_id.in_(poll_ids))
+    polls = session.execute(query).scalars().all()
+    if not polls:
+        return 0
+    counted: Dict[int, Dict[str, int]] = {}
+    rows = session.execute(
+        select(PollData.poll_id, PollData.choice, func.count())
+        .where(PollData.poll_id.in_([poll.poll_id for poll in polls]))
+        .group_by(PollData.poll_id, PollData.choice)
+    )
+    for poll_id, choice, count in rows:
+        counted.setdefault(poll_id, {})[choice] = count
+    fixed = 0
+    for poll in polls:
+        counts = counted.get(poll.poll_id, {})
+        wrong = False
+        for choice in CHOICES:
+            attr = f"result_{choice.lower()}"
+            if getattr(poll, attr) != counts.get(choice, 0):
+                setattr(poll, attr, counts.get(choice, 0))
+                wrong = True
+        fixed += wrong
+    session.commit()
+    return fixed
+
+
 class PollMessages(PollingBase):
     __tablename__ = "poll_messages"
     poll_id = Column(Integer, ForeignKey("poll_table.poll_id"), primary_key=True)
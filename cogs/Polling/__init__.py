@@ -1,4 +1,5 @@
 from .PollingTables import PollTable, PollData, PollMessages, PollChannelSubscribe
+from .PollingTables import VoteBuffer, poll_votes, reconcile_counts
 from .PollEditViews import PollEdit
 from .messtemplate import PollMessageTemplates as MessageTemplates
 from .PollViews import Persistent_Poll_View
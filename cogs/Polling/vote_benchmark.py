@@ -0,0 +1,132 @@
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import and_, create_engine
+from sqlalchemy.orm import Session
+
+from database import upsert_all
+
+from .PollingTables import (
+    CHOICES,
+    PollData,
+    PollingBase,
+    PollTable,
+    VoteBuffer,
+    reconcile_counts,
+)
+
+"""
+Benchmark for VoteBuffer against the per vote recount it replaced.
+
+Runs against its own in memory sqlite database:
+
+    python -m cogs.Polling.vote_benchmark
+"""
+
+
+def vote_benchmark(
+    voters: int = 10000, change_rate: float = 0.2, recount_votes: int = 200
+) -> Dict[str, Any]:
+    """Time voters on one poll with the old per vote recount and with VoteBuffer.
+
+    Runs against its own in memory sqlite database.  Each voter votes once,
+    and change_rate of them change their vote afterwards.  The old way
+    takes minutes for a poll this size, so it is only timed for the last
+    recount_votes votes, with the earlier ones loaded in bulk first.
+
+    Args:
+        voters (int, optional): Users voting. Defaults to 10000.
+        change_rate (float, optional): Share of voters who change their vote. Defaults to 0.2.
+        recount_votes (int, optional): Votes to time the old way with. Defaults to 200.
+
+    Returns:
+        Dict[str, Any]: Seconds and votes per second for both ways, and if
+        both ended with the counts a GROUP BY gives.
+    """
+    rng = random.Random(0)
+    stream = [(user, rng.choice(CHOICES)) for user in range(voters)]
+    stream += [
+        (rng.randrange(voters), rng.choice(CHOICES))
+        for _ in range(int(voters * change_rate))
+    ]
+
+    def new_session() -> Session:
+        engine = create_engine("sqlite://")
+        PollingBase.metadata.create_all(engine)
+        session = Session(engine)
+        session.add(PollTable(poll_id=1, poll_hex="bench", choices=5))
+        session.commit()
+        return session
+
+    def old_vote(session: Session, user_id: int, choice: str):
+        poll = session.query(PollTable).filter_by(poll_id=1).first()
+        poll_data = (
+            session.query(PollData)
+            .filter(and_(PollData.poll_id == 1, PollData.user_id == user_id))
+            .first()
+        )
+        if not poll_data or poll_data.choice != choice:
+            poll.change_vote = True
+            upsert_all(
+                session,
+                PollData,
+                [{"poll_id": 1, "user_id": user_id, "choice": choice}],
+            )
+            session.commit()
+        # Expire so the recount sees the upsert, as the old tally did on a
+        # fresh query after commit.
+        session.expire_all()
+        votes = dict.fromkeys(CHOICES, 0)
+        for data in session.query(PollData).filter_by(poll_id=1).all():
+            votes[data.choice] += 1
+        for c in CHOICES:
+            setattr(poll, f"result_{c.lower()}", votes[c])
+        session.commit()
+
+    def counts(session: Session) -> Tuple[List[int], bool]:
+        poll = session.get(PollTable, 1)
+        stored = [getattr(poll, f"result_{c.lower()}") for c in CHOICES]
+        return stored, reconcile_counts(session, [1]) == 0
+
+    session = new_session()
+    earlier = {user_id: choice for user_id, choice in stream[:-recount_votes]}
+    upsert_all(
+        session,
+        PollData,
+        [
+            {"poll_id": 1, "user_id": user_id, "choice": choice}
+            for user_id, choice in earlier.items()
+        ],
+    )
+    reconcile_counts(session, [1])
+    start = time.perf_counter()
+    for user_id, choice in stream[-recount_votes:]:
+        old_vote(session, user_id, choice)
+    old_seconds = time.perf_counter() - start
+    old_counts, old_ok = counts(session)
+
+    session = new_session()
+    buffer = VoteBuffer()
+    start = time.perf_counter()
+    for user_id, choice in stream:
+        buffer.record(session, 1, user_id, choice)
+    buffer.flush(session)
+    new_seconds = time.perf_counter() - start
+    new_counts, new_ok = counts(session)
+
+    return {
+        "votes": len(stream),
+        "recount_seconds_for_last": round(old_seconds, 3),
+        "recount_votes_per_second": round(recount_votes / old_seconds),
+        "buffered_seconds": round(new_seconds, 3),
+        "buffered_votes_per_second": round(len(stream) / new_seconds),
+        "flushes": buffer.flushes,
+        "counts": new_counts,
+        "same_counts": old_counts == new_counts,
+        "counts_match_group_by": old_ok and new_ok,
+    }
+
+
+if __name__ == "__main__":
+    print(vote_benchmark())
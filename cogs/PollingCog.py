@@ -195,9 +195,12 @@ class PollingCog(commands.Cog, TC_Cog_Mixin):
         except Exception as e:
             gui.gprint(e)
         self.message_update_cleanup.start()
+        self.vote_flush.start()
 
     def cog_unload(self):
         self.message_update_cleanup.cancel()
+        self.vote_flush.cancel()
+        PollTable.flush_votes()
 
     def server_profile_field_ext(self, guild: discord.Guild):
         """return a dictionary for the serverprofile template message"""
@@ -244,10 +247,21 @@ class PollingCog(commands.Cog, TC_Cog_Mixin):
         except Exception as e:
             await self.bot.send_error(e, "subscription")
 
+    @tasks.loop(seconds=5)
+    async def vote_flush(self):
+        """Write buffered votes, so a burst is committed in a few statements."""
+        try:
+            PollTable.flush_votes()
+        except Exception as e:
+            await self.bot.send_error(e, f"Vote flush error.")
+
     @tasks.loop(minutes=5)
     async def message_update_cleanup(self):
         try:
             PollTable.update_poll_status()
+            fixed = PollTable.reconcile_tallies()
+            if fixed:
+                gui.gprint(f"Recounted {fixed} polls with drifted tallies.")
             for i in PollMessages.get_active_poll_messages():
                 poll, mes = i
                 gui.gprint(mes)
@@ -3,6 +3,7 @@ from collections import defaultdict
 
 # import datetime
 from datetime import datetime, timedelta
+from typing import Optional
 
 import discord
 from dateutil.rrule import MINUTELY, SU, WEEKLY, rrule
@@ -32,6 +33,9 @@ from utility.debug import Timer
 from utility.embed_paginator import pages_of_embeds
 
 from .ArchiveSub import (
+    ArchiveSearch,
+    ArchivedRPBlob,
+    ArchivedRPFile,
     ArchivedRPMessage,
     ChannelArchiveStatus,
     ChannelSep,
@@ -851,6 +855,79 @@ class ServerRPArchive(commands.Cog, TC_Cog_Mixin):
         else:
             await ctx.send("guild only.")
 
+    @archive_setup.command(
+        name="build_search_index",
+        description="Index all of this server's archived messages for archive searches.",
+    )
+    async def build_search_index(self, ctx):
+        if not ctx.guild:
+            await ctx.send("guild only.")
+            return
+        total = ArchivedRPMessage.count_all(ctx.guild.id)
+        statmess = StatusEditMessage(
+            await ctx.send(f"Indexing {total} archived messages..."), ctx
+        )
+        last, done = 0, 0
+        while True:
+            last = ArchiveSearch.backfill_batch(ctx.guild.id, last)
+            if last is None:
+                break
+            done = min(done + 5000, total)
+            await statmess.editw(
+                min_seconds=5,
+                content=f"{formatutil.progress_bar(done, total, width=8)} {done}/{total}",
+            )
+            await asyncio.sleep(0.1)
+        await MessageTemplates.server_archive_message(
+            ctx, f"Indexed {total} archived messages.", ephemeral=True
+        )
+
+    @archive_setup.command(
+        name="search",
+        description="Search this server's archived messages.",
+    )
+    @app_commands.describe(
+        query="Words to search for.",
+        author="Only show messages from this author.",
+        channel="Only show messages from this channel or thread name.",
+    )
+    async def search_archive(
+        self,
+        ctx,
+        query: str,
+        author: Optional[str] = None,
+        channel: Optional[str] = None,
+    ):
+        if not ctx.guild:
+            await ctx.send("guild only.")
+            return
+        total = ArchiveSearch.count(ctx.guild.id, query, author, channel)
+        results = ArchiveSearch.search(
+            ctx.guild.id, query, author, channel, per_page=50
+        )
+        if not results:
+            await MessageTemplates.server_archive_message(
+                ctx, "No archived messages matched that search.", ephemeral=True
+            )
+            return
+        pages = []
+        for i in range(0, len(results), 5):
+            embed = discord.Embed(
+                title=f"Archive search: {query}"[:256],
+                description=f"{total} results, showing the best {len(results)}.",
+            )
+            for message, snippet, _ in results[i : i + 5]:
+                value = snippet[:900]
+                if message.posted_url:
+                    value += f"\n[Jump]({message.posted_url})"
+                embed.add_field(
+                    name=f"{message.author} in {message.thread or message.channel}"[:256],
+                    value=f"<t:{int(message.created_at.timestamp())}:f>\n{value}",
+                    inline=False,
+                )
+            pages.append(embed)
+        await pages_of_embeds(ctx, pages, ephemeral=True)
+
     @commands.guild_only()
     @commands.has_guild_permissions(manage_messages=True, manage_channels=True)
     @commands.command(name="lazymode", description="For big, unarchived servers.")
@@ -1161,6 +1238,33 @@ class ServerRPArchive(commands.Cog, TC_Cog_Mixin):
     async def correctit(self, ctx, guildid: int, channel: str):
         await self.correct(ctx, guildid, channel)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def migrate_archive_files(self, ctx, batch_size: int = 200):
+        """Move archived file bytes out of the database and into the blob store."""
+        remaining = ArchivedRPFile.count_unmigrated()
+        statmess = StatusEditMessage(
+            await ctx.send(f"Moving {remaining} files to the blob store."), ctx
+        )
+        moved = 0
+        with Timer() as timer:
+            while True:
+                count = ArchivedRPFile.migrate_to_blob_store(batch_size)
+                if count <= 0:
+                    break
+                moved += count
+                await statmess.editw(
+                    min_seconds=10, content=f"Moved {moved}/{remaining} files."
+                )
+                await asyncio.sleep(0.1)
+            ArchivedRPBlob.recount()
+            pruned = ArchivedRPBlob.prune()
+        await statmess.editw(
+            min_seconds=0,
+            content=f"Moved {moved} files in {seconds_to_time_string(int(timer.get_time()))}, "
+            + f"pruned {pruned} unused blobs.  Run VACUUM to reclaim the database space.",
+        )
+
     async def edit_embed_and_neighbors(self, target: ChannelSep):
         """
         This code checks if the target ChannelSep object has a
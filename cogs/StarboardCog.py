@@ -1,5 +1,5 @@
 import datetime
-from typing import Union
+from typing import Optional, Union
 import discord
 from discord.ext import commands, tasks
 from database import DatabaseSingleton
@@ -12,8 +12,18 @@ from cogs.dat_Starboard import (
 from utility import (
     urltomessage,
 )
-import random
+from utility.urltomessage import urlto_gcm_ids
+from .StarboardSub import (
+    EDIT_CYCLE_SECONDS,
+    EditScheduler,
+    MessageCache,
+    PendingEdit,
+    ReactionCoalescer,
+    ReactionEvent,
+    fold_reactions,
+)
 import asyncio
+from contextlib import AsyncExitStack
 
 
 class StarboardCog(commands.Cog):
@@ -22,8 +32,9 @@ class StarboardCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.blacklist = ["im lost"]
-        self.to_be_edited = {}
-        self.lock = asyncio.Lock()
+        self.edits = EditScheduler()
+        self.reactions = ReactionCoalescer(self.apply_reactions)
+        self.messages = MessageCache()
         self.emojilist = ["\N{Honeybee}", "<:2diverHeart:1221738356950564926>"]
         self.server_emoji_caches = {}
 
@@ -31,6 +42,7 @@ class StarboardCog(commands.Cog):
 
     def cog_unload(self):
         self.timerloop.cancel()  # type: ignore
+        self.reactions.cancel()
 
     async def reaction_action(
         self, fmt: str, payload: discord.RawReactionActionEvent
@@ -64,72 +76,106 @@ class StarboardCog(commands.Cog):
                 self.bot.logs.info("Too big.")
                 return
 
-            async with self.lock:
-                message = await channel.fetch_message(payload.message_id)
+            self.reactions.submit(
+                (guild.id, payload.message_id),
+                ReactionEvent(
+                    fmt,
+                    payload.user_id,
+                    str(payload.emoji),
+                    channel.id,
+                    payload.member,
+                ),
+            )
+        except Exception as e:
+            await self.bot.send_error(e, "React", True)
 
-                url = message.jump_url
-                starrer = payload.member or (await guild.fetch_member(payload.user_id))
-                if starrer is None or starrer.bot:
-                    return
+    async def get_starrer(self, guild: discord.Guild, event: ReactionEvent):
+        if event.member is not None:
+            return event.member
+        member = guild.get_member(event.user_id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(event.user_id)
+            except discord.NotFound:
+                return None
+        return member
+
+    async def apply_reactions(self, key: tuple[int, int], events: list[ReactionEvent]):
+        """
+        Apply one burst of reactions on a message in one transaction.
 
-                if message.author.bot:
-                    return
+        Args:
+            key (tuple[int, int]): The guild and message ids.
+            events (list[ReactionEvent]): The reactions on the message, oldest first.
+        """
+        guild_id, message_id = key
+        try:
+            guild = self.bot.get_guild(guild_id)  # type: ignore
+            if guild is None:
+                return
+            channel = guild.get_channel_or_thread(events[0].channel_id)
+            if channel is None:
+                return
+            message = await self.messages.fetch(channel, message_id)
+            if message.author.bot:
+                return
+            url = message.jump_url
+
+            starrers = {}
+            for event in events:
+                if event.user_id not in starrers:
+                    starrers[event.user_id] = await self.get_starrer(guild, event)
+            events = [
+                event
+                for event in events
+                if starrers[event.user_id] is not None
+                and not starrers[event.user_id].bot
+            ]
+            blacklist_words = self.blacklist
+            if any(word in message.content.lower() for word in blacklist_words):
+                self.bot.logs.info("blacklist detected")
+                events = [event for event in events if event.fmt != "star"]
+            if not events:
+                return
 
-                if fmt == "star":
-                    blacklist_words = self.blacklist
-                    if any(word in message.content.lower() for word in blacklist_words):
-                        self.bot.logs.info("blacklist detected")
-                        return
-                    self.bot.logs.info(
-                        f"adding starrer message {message.id} {guild.id} {starrer.id}"
-                    )
-                    await StarboardEntryGivers.add_starrer(
-                        message.id,
-                        guild.id,
-                        starrer.id,
-                        str(payload.emoji),
-                        message.jump_url,
-                    )
-                    await StarboardEntryTable.add_or_update_entry(
-                        guild.id,
-                        message.id,
-                        message.channel.id,
-                        message.author.id,
-                        message_url=url,
-                    )
-                else:
-                    async with DatabaseSingleton.get_async_session() as session:
-                        entry = await StarboardEntryTable.get_entry(
-                            guild.id, message.id, session=session
-                        )
-                        if not entry:
-                            return
-                        old_entry = await StarboardEntryGivers.get_starrer(
-                            guild.id, message.id, starrer.id
-                        )
-
-                        self.bot.logs.info(
-                            f"unstarring message {message.id} {guild.id} {starrer.id}"
-                        )
-                        if old_entry:
-
-                            if old_entry.emoji == str(payload.emoji):
-                                self.bot.logs.info("Same emoji...")
-                                await session.delete(old_entry)
-                                await session.commit()
-                            else:
-                                self.bot.logs.info("Different emoji...")
-                    await StarboardEntryTable.add_or_update_entry(
+            async with DatabaseSingleton.get_async_session() as session:
+                entry = await StarboardEntryTable.get_entry(
+                    guild.id, message.id, session=session
+                )
+                if not entry and not any(event.fmt == "star" for event in events):
+                    return
+                current = {
+                    starrer.star_giver_id: starrer.emoji
+                    for starrer in await StarboardEntryGivers.get_starrers_by_ids(
                         guild.id,
                         message.id,
-                        message.channel.id,
-                        message.author.id,
-                        url,
+                        list({event.user_id for event in events}),
+                        session=session,
                     )
-                entry = await StarboardEntryTable.get_entry(guild.id, message.id)
-                await self.update_starboard_message(
-                    guild, message, entry.bot_message_url
+                }
+                added, removed = fold_reactions(current, events)
+                self.bot.logs.info(
+                    f"{len(events)} reactions on message {message.id} {guild.id}, "
+                    f"{len(added)} starred, {len(removed)} unstarred"
+                )
+                await StarboardEntryGivers.apply_starrer_changes(
+                    message.id,
+                    guild.id,
+                    added,
+                    list(removed),
+                    url,
+                    session=session,
+                )
+                await StarboardEntryTable.add_or_update_entry(
+                    guild.id,
+                    message.id,
+                    message.channel.id,
+                    message.author.id,
+                    message_url=url,
+                    session=session,
                 )
+            entry = await StarboardEntryTable.get_entry(guild.id, message.id)
+            await self.update_starboard_message(guild, message, entry.bot_message_url)
         except Exception as e:
             await self.bot.send_error(e, "React", True)
 
@@ -185,58 +231,113 @@ class StarboardCog(commands.Cog):
         if msg is not None:
             await msg.delete()
 
-    async def edit_one_random(self):
-        """Edit one random key/value pair in the to be edited dictionary."""
-        (bot_message, message) = random.choice(list(self.to_be_edited.items()))
-        self.to_be_edited.pop(bot_message)
-        mess = await urltomessage(bot_message, self.bot)
-        if mess:
-            self.bot.logs.info("Editing random Starboard Emoji")
-            entry = await StarboardEntryTable.get_with_url(bot_message)
-            starboard = await Starboard.get_starboard(mess.guild.id)
-            if entry and starboard:
-                if entry.total < starboard.threshold:
-                    self.bot.logs.info(
-                        f"...entry deleted bc {entry.total} is less than {starboard.threshold}"
-                    )
-                    await StarboardEntryTable.delete_entry_by_bot_message_url(
-                        bot_message
+    def queue_edit(self, bot_message: str, message: discord.Message) -> None:
+        """Queue an edit of a starboard message, merging it with any already queued."""
+        _, channel_id, bot_message_id = urlto_gcm_ids(bot_message)
+        self.edits.queue(bot_message, int(channel_id), int(bot_message_id), message)
+
+    async def apply_edits(self, batch: list[PendingEdit]) -> None:
+        """
+        Apply a batch of queued edits, loading their entries, starboards and
+        emojis with one query each.
+
+        Every message's lock is taken before the load, in sorted order, so
+        a reaction burst can't land between the load and the edit and be
+        overwritten with an older total.
+
+        Args:
+            batch (list[PendingEdit]): Edits from the scheduler.
+        """
+        keys = sorted({(edit.message.guild.id, edit.message.id) for edit in batch})
+        async with AsyncExitStack() as held:
+            for key in keys:
+                await held.enter_async_context(self.reactions.locks.hold(key))
+            async with DatabaseSingleton.get_async_session() as session:
+                entries = await StarboardEntryTable.get_with_urls(
+                    [edit.bot_message for edit in batch], session=session
+                )
+                starboards = await Starboard.get_starboards(
+                    list({edit.message.guild.id for edit in batch}), session=session
+                )
+                emojis = await StarboardEntryGivers.list_emojis_for_messages(
+                    keys, session=session
+                )
+
+            async def apply(edit: PendingEdit):
+                message = edit.message
+                try:
+                    await self.edit_starboard_message(
+                        edit.bot_message,
+                        message,
+                        entries.get(edit.bot_message),
+                        starboards.get(message.guild.id),
+                        emojis.get((message.guild.id, message.id), []),
                     )
+                except Exception as e:
+                    await self.bot.send_error(e, "Starboard Edit Error")
+                self.edits.finished(edit)
+
+            await asyncio.gather(*(apply(edit) for edit in batch))
+
+    async def edit_starboard_message(
+        self,
+        bot_message: str,
+        message: discord.Message,
+        entry: StarboardEntryTable,
+        starboard: Starboard,
+        emlist: list[str],
+    ) -> None:
+        """
+        Bring a starboard message up to date with its entry.
+
+        Args:
+            bot_message (str): The URL of the bot's starboard message.
+            message (discord.Message): The original starred message.
+            entry (StarboardEntryTable): The message's entry, if it still has one.
+            starboard (Starboard): The guild's starboard, if it still has one.
+            emlist (list[str]): Emojis the message was starred with.
+        """
+        mess = await urltomessage(bot_message, self.bot, partial=True)
+        if not (entry and starboard):
+            self.bot.logs.info("...Purging Message due to lack of starboard")
+            await StarboardEntryTable.delete_entry_by_bot_message_url(bot_message)
+            return
+        if entry.total < starboard.threshold:
+            self.bot.logs.info(
+                f"...entry deleted bc {entry.total} is less than {starboard.threshold}"
+            )
+            await StarboardEntryTable.delete_entry_by_bot_message_url(bot_message)
+            if mess:
+                try:
                     await mess.delete()
-                else:
-                    self.bot.logs.info("...entry edited")
-                    content, embed = await self.get_emoji_message(message, entry)
-                    await mess.edit(content=content, embed=embed)
-            else:
+                except discord.NotFound:
+                    pass
+            return
+        content, embed = await self.get_emoji_message(message, entry, emlist)
+        if mess:
+            try:
+                await mess.edit(content=content, embed=embed)
                 self.bot.logs.info("...entry edited")
-                await StarboardEntryTable.delete_entry_by_bot_message_url(bot_message)
+                return
+            except discord.NotFound:
+                pass
+        starboard_channel = self.bot.get_channel(starboard.channel_id)
+        if starboard_channel:
+            self.bot.logs.info("...Resending Message")
+            bm = await starboard_channel.send(content, embed=embed)
+            await StarboardEntryTable.add_or_update_bot_message(
+                message.guild.id, message.id, bm.id, bm.jump_url
+            )
         else:
-            starboard = await Starboard.get_starboard(mess.guild.id)
-            starboard_channel = self.bot.get_channel(starboard.channel_id)
-            entry = await StarboardEntryTable.get_entry(message.guild.id, message.id)
-            if entry and starboard and starboard_channel:
-                if entry.total >= starboard.threshold:
-                    self.bot.logs.info("...Resending Message")
-                    content, embed = await self.get_emoji_message(message, entry)
-                    bm = await starboard_channel.send(content, embed=embed)
-                    entry = await StarboardEntryTable.add_or_update_bot_message(
-                        message.guild.id, message.id, bm.id, bm.jump_url
-                    )
-                else:
-                    self.bot.logs.info("Purging Message due to lack of stars")
-                    await StarboardEntryTable.delete_entry_by_bot_message_url(
-                        bot_message
-                    )
-            else:
-                self.bot.logs.info("Purging Message due to lack of starboard")
-                await StarboardEntryTable.delete_entry_by_bot_message_url(bot_message)
+            self.bot.logs.info("Purging Message due to lack of starboard")
+            await StarboardEntryTable.delete_entry_by_bot_message_url(bot_message)
 
-    @tasks.loop(seconds=15)
+    @tasks.loop(seconds=EDIT_CYCLE_SECONDS)
     async def timerloop(self):
         try:
-            async with self.lock:
-                if self.to_be_edited:
-                    await self.edit_one_random()
+            batch = self.edits.take_batch()
+            if batch:
+                await self.apply_edits(batch)
         except Exception as e:
             await self.bot.send_error(e, "Task Error")
 
@@ -244,7 +345,7 @@ class StarboardCog(commands.Cog):
     @commands.has_permissions(manage_guild=True)
     async def starboard(self, ctx):
         """Starboard management commands."""
-        await ctx.send("Available subcommands: add, remove, show, set_threshold")
+        await ctx.send("Available subcommands: add, remove, show, set_threshold, queue")
 
     @starboard.command()
     async def add(self, ctx, channel: discord.TextChannel, threshold: int):
@@ -259,6 +360,23 @@ class StarboardCog(commands.Cog):
             f"Starboard added to {channel.mention} with a threshold of {threshold} stars."
         )
 
+    @starboard.command()
+    async def queue(self, ctx):
+        """Show how many starboard edits are waiting and how fast they drain."""
+        existing = await Starboard.get_starboard(ctx.guild.id)
+        if not existing:
+            await ctx.send("No starboard found for this server.")
+            return
+        await ctx.send(self.edits.channel_status(existing.channel_id))
+
+    @commands.is_owner()
+    @commands.command(name="starboard_stats")
+    async def starboard_stats(self, ctx):
+        """Show the edit queue and reaction batching across every server."""
+        await ctx.send(
+            f"{self.edits.status_string()}\n{self.reactions.status_string()}"
+        )
+
     @starboard.command()
     async def remove(self, ctx):
         """Remove the starboard from the server."""
@@ -458,10 +576,13 @@ class StarboardCog(commands.Cog):
                     guild.id, message.id, bm.id, bm.jump_url
                 )
         else:
-            self.to_be_edited[bot_message] = message
+            self.queue_edit(bot_message, message)
 
     async def get_emoji_message(
-        self, message: discord.Message, stars: StarboardEntryTable
+        self,
+        message: discord.Message,
+        stars: StarboardEntryTable,
+        emlist: Optional[list[str]] = None,
     ) -> tuple[str, discord.Embed]:
         """
         Generates a message with an emoji and returns it along with an embed based on the input message.
@@ -469,14 +590,16 @@ class StarboardCog(commands.Cog):
         Args:
             message (discord.Message): The original Discord message.
             stars (int): The number of emojis to display.
+            emlist (Optional[list[str]]): The starrer emojis, if they were already loaded.
 
         Returns:
             tuple[str, discord.Embed]: The message content and the embed.
         """
         assert isinstance(message.channel, (discord.abc.GuildChannel, discord.Thread))
-        emlist = await StarboardEntryGivers.list_starrer_emojis(
-            stars.guild_id, stars.message_id
-        )
+        if emlist is None:
+            emlist = await StarboardEntryGivers.list_starrer_emojis(
+                stars.guild_id, stars.message_id
+            )
         unique = []
         for e in emlist:
             if not e in unique:
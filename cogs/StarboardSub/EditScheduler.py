@@ -0,0 +1,194 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from utility.debug import percentile
+
+"""
+Queue of starboard messages that need editing.
+
+The starboard used to edit one random queued message every 15 seconds, so a
+busy day's backlog took hours to clear in no particular order.  Queued edits
+are now merged per starboard message and handed out most urgent first, as
+fast as each starboard channel's edit budget allows.  Urgency is how long
+an edit has waited plus a bonus for recent starboard posts, since those
+are the ones people are looking at.
+"""
+
+EDIT_CYCLE_SECONDS = 2.0
+# Discord allows about 5 message edits per 5 seconds in one channel.
+CHANNEL_EDITS = 5
+CHANNEL_WINDOW_SECONDS = 5.0
+# A starboard post that was just made counts as this many seconds more stale.
+VISIBILITY_SECONDS = 600.0
+DISCORD_EPOCH_MS = 1420070400000
+
+
+def snowflake_seconds(snowflake: int) -> float:
+    """Unix time a discord id was made at."""
+    return ((snowflake >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+class PendingEdit:
+    """An edit waiting for one starboard message.
+
+    Args:
+        bot_message (str): Url of the starboard message.
+        channel_id (int): The starboard channel.
+        bot_message_id (int): Id of the starboard message.
+        message (Any): The starred message it shows.
+        queued_at (float): time.monotonic() when it was first queued.
+    """
+
+    __slots__ = (
+        "bot_message",
+        "channel_id",
+        "bot_message_id",
+        "message",
+        "queued_at",
+        "merged",
+    )
+
+    def __init__(
+        self,
+        bot_message: str,
+        channel_id: int,
+        bot_message_id: int,
+        message: Any,
+        queued_at: float,
+    ):
+        self.bot_message = bot_message
+        self.channel_id = channel_id
+        self.bot_message_id = bot_message_id
+        self.message = message
+        self.queued_at = queued_at
+        self.merged = 1
+
+    def priority(self, now: float, wall_now: float) -> float:
+        """Seconds waited, plus a bonus that fades as the starboard post gets older."""
+        posted_hours = max(0.0, wall_now - snowflake_seconds(self.bot_message_id)) / 3600
+        return (now - self.queued_at) + VISIBILITY_SECONDS / (1 + posted_hours)
+
+
+class ChannelBudget:
+    """Token bucket for the requests a bot can make in one channel.
+
+    Args:
+        capacity (int, optional): Requests allowed in a burst. Defaults to CHANNEL_EDITS.
+        window (float, optional): Seconds to earn capacity back in. Defaults to CHANNEL_WINDOW_SECONDS.
+    """
+
+    def __init__(
+        self, capacity: int = CHANNEL_EDITS, window: float = CHANNEL_WINDOW_SECONDS
+    ):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class EditScheduler:
+    """Merges queued starboard edits per message and hands them out by priority."""
+
+    def __init__(self):
+        self.pending: Dict[str, PendingEdit] = {}
+        self.budgets: Dict[int, ChannelBudget] = {}
+        self.latencies: Deque[float] = deque(maxlen=500)
+        self.queued = 0
+        self.done = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def queue(self, bot_message: str, channel_id: int, bot_message_id: int, message: Any):
+        """Queue an edit, merging it with one already waiting for the same starboard message."""
+        self.queued += 1
+        edit = self.pending.get(bot_message)
+        if edit is not None:
+            edit.message = message
+            edit.merged += 1
+            return
+        self.pending[bot_message] = PendingEdit(
+            bot_message, channel_id, bot_message_id, message, time.monotonic()
+        )
+
+    def take_batch(self, now: Optional[float] = None) -> List[PendingEdit]:
+        """Take the most urgent edits that each channel's budget allows right now."""
+        if not self.pending:
+            return []
+        now = time.monotonic() if now is None else now
+        wall_now = time.time()
+        ordered = sorted(
+            self.pending.values(),
+            key=lambda edit: edit.priority(now, wall_now),
+            reverse=True,
+        )
+        batch = []
+        spent = set()
+        for edit in ordered:
+            if edit.channel_id in spent:
+                continue
+            budget = self.budgets.get(edit.channel_id)
+            if budget is None:
+                budget = self.budgets[edit.channel_id] = ChannelBudget()
+            if not budget.take(now):
+                spent.add(edit.channel_id)
+                continue
+            del self.pending[edit.bot_message]
+            batch.append(edit)
+        return batch
+
+    def finished(self, edit: PendingEdit):
+        """Record that edit was applied, for the drain latency."""
+        self.done += 1
+        self.latencies.append(time.monotonic() - edit.queued_at)
+
+    def depth_by_channel(self) -> Dict[int, int]:
+        depth: Dict[int, int] = {}
+        for edit in self.pending.values():
+            depth[edit.channel_id] = depth.get(edit.channel_id, 0) + 1
+        return depth
+
+    def oldest_wait(self) -> float:
+        if not self.pending:
+            return 0.0
+        now = time.monotonic()
+        return max(now - edit.queued_at for edit in self.pending.values())
+
+    def channel_status(self, channel_id: int) -> str:
+        """Queue depth and oldest wait for one starboard channel, safe to show its guild."""
+        waiting = [e for e in self.pending.values() if e.channel_id == channel_id]
+        if not waiting:
+            return "No edits waiting for this server's starboard."
+        now = time.monotonic()
+        oldest = max(now - edit.queued_at for edit in waiting)
+        return (
+            f"{len(waiting)} edits waiting for this server's starboard, "
+            f"oldest waiting {oldest:.1f}s."
+        )
+
+    def status_string(self) -> str:
+        if self.latencies:
+            drain = (
+                f"drain p50 {percentile(self.latencies, 0.5):.1f}s, "
+                f"p95 {percentile(self.latencies, 0.95):.1f}s"
+            )
+        else:
+            drain = "no edits drained yet"
+        return (
+            f"{len(self.pending)} edits queued across "
+            f"{len(self.depth_by_channel())} channels, oldest waiting "
+            f"{self.oldest_wait():.1f}s.  {self.done} edits made from "
+            f"{self.queued} requests, {drain}."
+        )
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+"""
+Per message locking and coalescing of starboard reactions.
+
+Every reaction used to be handled one at a time under a single lock shared by
+every guild, so a burst of reactions on one message held up starboards on
+all the others.  Reactions are now grouped by (guild, message).  Each group
+waits a short window so a burst can pile up, then the whole burst is applied
+in one transaction with one starboard update, under a lock for that message
+alone.
+
+reaction_benchmark.py load tests it against the old global lock.
+"""
+
+COALESCE_SECONDS = 1.0
+MESSAGE_CACHE_SECONDS = 30.0
+
+
+class KeyedLocks:
+    """asyncio locks made on demand for each key, dropped once nothing holds or waits on them."""
+
+    def __init__(self):
+        self.locks: Dict[Hashable, asyncio.Lock] = {}
+        self.users: Dict[Hashable, int] = {}
+
+    def __len__(self):
+        return len(self.locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.users[key] = self.users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.users[key] -= 1
+            if not self.users[key]:
+                del self.users[key]
+                del self.locks[key]
+
+
+class ReactionEvent:
+    """One reaction added or removed.
+
+    Args:
+        fmt (str): "star" for an added reaction, "unstar" for a removed one.
+        user_id (int): Who reacted.
+        emoji (str): The reaction's emoji.
+        channel_id (int): Channel of the reacted message.
+        member (Any, optional): The member, if the gateway sent it. Defaults to None.
+    """
+
+    __slots__ = ("fmt", "user_id", "emoji", "channel_id", "member")
+
+    def __init__(
+        self, fmt: str, user_id: int, emoji: str, channel_id: int, member: Any = None
+    ):
+        self.fmt = fmt
+        self.user_id = user_id
+        self.emoji = emoji
+        self.channel_id = channel_id
+        self.member = member
+
+
+def fold_reactions(
+    current: Dict[int, str], events: List[ReactionEvent]
+) -> Tuple[Dict[int, str], Set[int]]:
+    """Apply reactions in order to the starrers of one message.
+
+    A star sets the user's emoji.  An unstar only removes the user if it's
+    for the emoji they starred with, as reaction_action always did.
+
+    Args:
+        current (Dict[int, str]): Emoji by user id, for the users in events who had starred.
+        events (List[ReactionEvent]): The reactions, oldest first.
+
+    Returns:
+        Tuple[Dict[int, str], Set[int]]: Starrers to add or change, and user ids to remove.
+    """
+    state = dict(current)
+    for event in events:
+        if event.fmt == "star":
+            state[event.user_id] = event.emoji
+        elif state.get(event.user_id) == event.emoji:
+            del state[event.user_id]
+    added = {user: emoji for user, emoji in state.items() if current.get(user) != emoji}
+    removed = {user for user in current if user not in state}
+    return added, removed
+
+
+class ReactionCoalescer:
+    """Groups reactions by key and hands each burst to handler under that key's lock.
+
+    handler should deal with its own errors, since it runs in a background task.
+
+    Args:
+        handler (Callable[[Hashable, List[ReactionEvent]], Awaitable[None]]): Applies one burst.
+        window (float, optional): Seconds to gather a burst for. Defaults to COALESCE_SECONDS.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Hashable, List[ReactionEvent]], Awaitable[None]],
+        window: float = COALESCE_SECONDS,
+    ):
+        self.handler = handler
+        self.window = window
+        self.locks = KeyedLocks()
+        self.pending: Dict[Hashable, List[ReactionEvent]] = {}
+        self.tasks: Dict[Hashable, asyncio.Task] = {}
+        self.events = 0
+        self.batches = 0
+
+    def submit(self, key: Hashable, event: ReactionEvent):
+        """Add a reaction to its key's burst, starting the burst's timer if needed."""
+        self.events += 1
+        self.pending.setdefault(key, []).append(event)
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.create_task(self.run(key))
+
+    async def run(self, key: Hashable):
+        await asyncio.sleep(self.window)
+        # Reactions after this point start the next burst, which waits on
+        # the lock behind this one.
+        del self.tasks[key]
+        events = self.pending.pop(key)
+        async with self.locks.hold(key):
+            self.batches += 1
+            await self.handler(key, events)
+
+    async def drain(self):
+        """Wait for every burst that's already been started."""
+        while self.tasks:
+            await asyncio.gather(*self.tasks.values())
+
+    def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        self.pending.clear()
+
+    def status_string(self) -> str:
+        merged = self.events / self.batches if self.batches else 0
+        return (
+            f"{self.events} reactions in {self.batches} batches "
+            f"({merged:.1f} per batch), {len(self.tasks)} waiting, "
+            f"{len(self.locks)} messages locked"
+        )
+
+
+class MessageCache:
+    """Keeps fetched messages for a short time so a burst only fetches its message once.
+
+    Args:
+        ttl (float, optional): Seconds to keep a message. Defaults to MESSAGE_CACHE_SECONDS.
+    """
+
+    def __init__(self, ttl: float = MESSAGE_CACHE_SECONDS):
+        self.ttl = ttl
+        self.entries: Dict[int, Tuple[Any, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def fetch(self, channel: Any, message_id: int) -> Any:
+        now = time.monotonic()
+        cached = self.entries.get(message_id)
+        if cached is not None and now - cached[1] < self.ttl:
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        message = await channel.fetch_message(message_id)
+        self.entries[message_id] = (message, now)
+        if len(self.entries) > 1000:
+            self.entries = {
+                k: v for k, v in self.entries.items() if now - v[1] < self.ttl
+            }
+        return message
+
+    def forget(self, message_id: int):
+        self.entries.pop(message_id, None)
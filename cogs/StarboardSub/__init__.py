@@ -0,0 +1,13 @@
+from .ReactionBatcher import (
+    KeyedLocks,
+    MessageCache,
+    ReactionCoalescer,
+    ReactionEvent,
+    fold_reactions,
+)
+from .EditScheduler import (
+    EDIT_CYCLE_SECONDS,
+    ChannelBudget,
+    EditScheduler,
+    PendingEdit,
+)
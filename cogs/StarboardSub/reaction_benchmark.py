@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, Hashable, List
+
+from utility.debug import percentile
+
+from .ReactionBatcher import (
+    COALESCE_SECONDS,
+    MessageCache,
+    ReactionCoalescer,
+    ReactionEvent,
+    fold_reactions,
+)
+
+"""
+Load test for the starboard's reaction coalescing.
+
+Replays a storm of synthetic reactions through the old single global lock
+and through ReactionCoalescer, with every discord or database round trip
+simulated as a sleep:
+
+    python -m cogs.StarboardSub.reaction_benchmark
+"""
+
+
+async def reaction_load_test(
+    payloads: int = 10000,
+    guilds: int = 50,
+    messages: int = 400,
+    users: int = 2000,
+    storm_seconds: float = 2.0,
+    latency: float = 0.002,
+    window: float = COALESCE_SECONDS,
+) -> Dict[str, Any]:
+    """Replay synthetic reactions through the old global lock and the coalescer.
+
+    Each discord or database round trip is simulated as a sleep of latency.
+    The old way fetched the message, made about five database round trips
+    and queued one starboard edit for every reaction, all under one lock.
+    A burst now fetches its message once if it isn't cached, makes three
+    round trips in one transaction, and queues one edit.  Half the
+    reactions land on a tenth of the messages, like a popular post.
+
+    Args:
+        payloads (int, optional): Reactions to replay. Defaults to 10000.
+        guilds (int, optional): Guilds the messages are spread over. Defaults to 50.
+        messages (int, optional): Messages reacted to. Defaults to 400.
+        users (int, optional): Users reacting. Defaults to 2000.
+        storm_seconds (float, optional): Time the reactions arrive over. Defaults to 2.0.
+        latency (float, optional): Seconds per simulated round trip. Defaults to 0.002.
+        window (float, optional): Coalescing window for the new way. Defaults to COALESCE_SECONDS.
+
+    Returns:
+        Dict[str, Any]: Wall time, round trips, edits and p50/p99 delay from a
+        reaction arriving to it being applied, for both, and if both ended
+        with the same starrers.
+    """
+    rng = random.Random(0)
+    emojis = ["\N{Honeybee}", "\N{White Medium Star}"]
+    hot = max(1, messages // 10)
+    stream = []
+    for _ in range(payloads):
+        if rng.random() < 0.5:
+            message = rng.randrange(hot)
+        else:
+            message = rng.randrange(messages)
+        stream.append(
+            (
+                (message % guilds, message),
+                ReactionEvent(
+                    rng.choice(["star", "star", "unstar"]),
+                    rng.randrange(users),
+                    rng.choice(emojis),
+                    message,
+                ),
+            )
+        )
+    gap = storm_seconds / payloads
+
+    async def replay(submit: Callable[[Hashable, ReactionEvent, float], None]):
+        start = time.perf_counter()
+        for i, (key, event) in enumerate(stream):
+            delay = start + i * gap - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            submit(key, event, time.perf_counter())
+
+    def summary(start, delays, trips, edits, stars) -> Dict[str, Any]:
+        return {
+            "seconds": round(time.perf_counter() - start, 3),
+            "round_trips": trips,
+            "edits": edits,
+            "p50_delay_ms": round(percentile(delays, 0.5) * 1000, 1),
+            "p99_delay_ms": round(percentile(delays, 0.99) * 1000, 1),
+            "starrers": sum(len(v) for v in stars.values()),
+        }
+
+    # The old way, one reaction at a time under one lock.
+    old_stars: Dict[Hashable, Dict[int, str]] = {}
+    old_delays: List[float] = []
+    old_trips = 0
+    lock = asyncio.Lock()
+    tasks = []
+
+    async def old_handle(key, event, arrived):
+        nonlocal old_trips
+        async with lock:
+            await asyncio.sleep(latency * 6)
+            old_trips += 6
+            added, removed = fold_reactions(
+                {
+                    u: e
+                    for u, e in old_stars.get(key, {}).items()
+                    if u == event.user_id
+                },
+                [event],
+            )
+            stars = old_stars.setdefault(key, {})
+            stars.update(added)
+            for user in removed:
+                del stars[user]
+            old_delays.append(time.perf_counter() - arrived)
+
+    start = time.perf_counter()
+    await replay(lambda k, e, t: tasks.append(asyncio.create_task(old_handle(k, e, t))))
+    await asyncio.gather(*tasks)
+    old = summary(start, old_delays, old_trips, payloads, old_stars)
+
+    # The new way.
+    new_stars: Dict[Hashable, Dict[int, str]] = {}
+    new_delays: List[float] = []
+    new_trips = 0
+    edits = 0
+    arrivals: Dict[int, float] = {}
+    cache = MessageCache()
+
+    class Channel:
+        async def fetch_message(self, message_id):
+            nonlocal new_trips
+            await asyncio.sleep(latency)
+            new_trips += 1
+            return message_id
+
+    channel = Channel()
+
+    async def new_handle(key, events):
+        nonlocal new_trips, edits
+        await cache.fetch(channel, key[1])
+        await asyncio.sleep(latency * 3)
+        new_trips += 3
+        stars = new_stars.setdefault(key, {})
+        users_in = {event.user_id for event in events}
+        added, removed = fold_reactions(
+            {u: e for u, e in stars.items() if u in users_in}, events
+        )
+        stars.update(added)
+        for user in removed:
+            del stars[user]
+        edits += 1
+        now = time.perf_counter()
+        for event in events:
+            new_delays.append(now - arrivals.pop(id(event)))
+
+    coalescer = ReactionCoalescer(new_handle, window)
+
+    def new_submit(key, event, arrived):
+        arrivals[id(event)] = arrived
+        coalescer.submit(key, event)
+
+    start = time.perf_counter()
+    await replay(new_submit)
+    await coalescer.drain()
+    new = summary(start, new_delays, new_trips, edits, new_stars)
+    new["batches"] = coalescer.batches
+
+    return {
+        "payloads": payloads,
+        "global_lock": old,
+        "coalesced": new,
+        "same_result": old_stars == new_stars,
+    }
+
+
+if __name__ == "__main__":
+    print(asyncio.run(reaction_load_test()))
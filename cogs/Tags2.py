@@ -26,120 +26,42 @@ import numpy as np
 from utility.views import BaseView
 
 from cogs.dat_Starboard import Tag
-
-
-async def is_cyclic_i(start_key):
-    visited = set()
-    stack = set()
-
-    async def visit(key):
-        if key in stack:
-            return True
-        if key in visited:
-            return False
-        visited.add(key)
-        stack.add(key)
-
-        tag = await Tag.get(key)
-        if not tag:
-            return False
-        text = tag.text
-        for word in re.findall(r"\{(.*?)\}", text):
-            if await visit(word):
-                return True
-        stack.remove(key)
-        return False
-
-    return await visit(start_key)
+from .TagsSub import tag_graphs
 
 
 async def is_cyclic_mod(start_key, valuestartmain, guildid):
-    visited = set()
-    stack = set()
-    steps = []
-    valuestart = valuestartmain
-    if not valuestart:
-        valuestart = ""
-
-    async def visit(key, steps):
-        if key in stack:
-            print("Key in stack.")
-            steps.append(key)
-            return True, steps
-        if key in visited:
-            return False, steps
-        visited.add(key)
-        stack.add(key)
-
-        tag = await Tag.get(key, guildid)
-        if not tag or key != start_key:
-            return False, steps
-        elif key == start_key:
-            text = valuestart
-        else:
-            text = tag.text
-        for word in re.findall(r"\{(.*?)\}", text):
-            steps.append(word)
-            print(key, word, stack, visited, steps)
-            visite, st = await visit(word, steps)
-            if visite:
-                print(key in stack, key in visited)
-                return True, steps
-            steps.pop()
-        stack.remove(key)
-        return False, steps
-
-    return await visit(start_key, steps)
-
-
-async def process_text(extracted_text, page):
-    result = await page.evaluate(extracted_text)
-    return result
+    """Check if start_key with the text valuestartmain would expand forever.
 
+    Returns:
+        Tuple[bool, List[str]]: If it would, and the tag names along the cycle.
+    """
+    graph = await tag_graphs.get(guildid)
+    return graph.find_cycle(start_key, valuestartmain or "")
 
-async def execute_javascript(tagtext, browser):
+
+async def execute_javascript(tagtext, pool):
     # I don't need to use the javascript library for this.
     # Tag javascript runs with playwright instead as a security precaution.
+    # The snippets run on a page from the bot's shared page pool, last to
+    # first as they always have.
 
     result: str = tagtext
 
-    page = await browser.new_page()
     start, end = "<js:{", "}>"
     pattern = r"<js\:\{(.*?)\}>"
-    matches = re.finditer(pattern, tagtext)
-    for match in reversed(list(matches)):
-        print(match)
-        extracted_text = match.group(1)
-        processed_text = await process_text(extracted_text, page)
-        print(processed_text)
-        result = result.replace(f"{start}{extracted_text}{end}", processed_text, 1)
-    await page.close()
+    snippets = [match.group(1) for match in re.finditer(pattern, tagtext)]
+    snippets.reverse()
+    outputs = await pool.run_snippets(snippets)
+    for extracted_text, processed_text in zip(snippets, outputs):
+        result = result.replace(
+            f"{start}{extracted_text}{end}", str(processed_text), 1
+        )
     return result
 
 
 async def dynamic_tag_get(text, guildid, maxsize=2000):
-    result = text
-    pattern = re.compile(r"\{(.*?)\}")
-    ignorethese = []
-    for i in range(0, 10):
-        matches = pattern.findall(result)
-        if not matches:
-            break
-        ignorev = False
-        for match in matches:
-            if match not in ignorethese:
-                ignorev = True
-            tag = await Tag.get(match, guildid)
-            if tag:
-                result = result.replace(f"{{{match}}}", tag.text)
-            else:
-                ignorethese.append(match)
-            if len(result) > maxsize:
-                result = result[: maxsize - 4] + "..."
-                return result
-        if not ignorev:
-            break
-    return result
+    graph = await tag_graphs.get(guildid)
+    return graph.render(text, maxsize)
 
 
 class TagContentModal(discord.ui.Modal, title="Enter Tag Contents"):
@@ -352,11 +274,22 @@ class Tags(commands.Cog):
         ctx: commands.Context = await self.bot.get_context(interaction)
 
         tag = await Tag.delete_without_user(tagname)
+        tag_graphs.invalidate()
         if not tag:
             await ctx.send("This tag doesn't exist.", ephemeral=True)
             return
         await ctx.send(f"Tag {tagname} was removed successfully.", ephemeral=True)
 
+    @tag_maintenance.command(
+        name="js_stats", description="Latency of the pages tag javascript runs on"
+    )
+    async def js_stats(self, interaction: discord.Interaction):
+        ctx: commands.Context = await self.bot.get_context(interaction)
+        if self.bot.page_pool is None:
+            await ctx.send("No tag javascript has run yet.", ephemeral=True)
+            return
+        await ctx.send(self.bot.page_pool.status_string(), ephemeral=True)
+
     tags = app_commands.Group(name="tags", description="Tag commands", guild_only=True)
 
     @tags.command(name="create", description="create a tag")
@@ -449,6 +382,7 @@ class Tags(commands.Cog):
                 imb=bytesv,
                 imname=fname,
             )
+            tag_graphs.invalidate()
 
             # Confirm tag creation
             new_tag = await Tag.get(tagname, ctx.guild.id)
@@ -480,6 +414,7 @@ class Tags(commands.Cog):
     async def delete(self, interaction: discord.Interaction, tagname: str):
         ctx: commands.Context = await self.bot.get_context(interaction)
         deleted_tag = await Tag.delete(tagname, interaction.user.id)
+        tag_graphs.invalidate()
         if deleted_tag:
             await MessageTemplates.tag_message(
                 ctx,
@@ -554,6 +489,7 @@ class Tags(commands.Cog):
                 return
 
             edited_tag = await Tag.edit(tagname, interaction.user.id, newtext=c)
+            tag_graphs.invalidate()
             if edited_tag:
                 new_tag = await Tag.get(tagname, ctx.guild.id)
                 await MessageTemplates.tag_message(
@@ -632,9 +568,9 @@ class Tags(commands.Cog):
                     mes = await mes.edit(content="Activating advanced utility...")
                     await self.bot.open_browser()
                     mes = await mes.edit(content="Javascript running")
-                browser = await self.bot.get_browser()
+                pool = await self.bot.get_page_pool()
 
-                to_send = await execute_javascript(to_send, browser)
+                to_send = await execute_javascript(to_send, pool)
                 if len(to_send) > 2000:
                     to_send = to_send[:1996] + "..."
 
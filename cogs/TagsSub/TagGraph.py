@@ -0,0 +1,184 @@
+import re
+from typing import Dict, List, Tuple
+
+from cogs.dat_Starboard import Tag
+
+"""
+Compiled tags and the graph of which tags reference which.
+
+Tag text can pull in other tags with {tagname}.  This used to be expanded
+with up to ten regex passes over the growing text, one database query per
+reference per pass, and cycles were looked for with a query per tag
+visited.  Each guild's visible tags are now loaded with one query and
+compiled once into literal and reference segments, so a tag renders in a
+single pass over its segments, and cycle checks walk the compiled graph.
+The graphs are dropped whenever a tag is written.
+"""
+
+REFERENCE = re.compile(r"\{(.*?)\}")
+# References deeper than this are left as {tagname}, like the old ten passes.
+MAX_DEPTH = 10
+RENDER_CACHE_SIZE = 256
+# Segments one render may visit before its output is cut off, so a guild
+# with a huge web of references can't hold up the event loop.
+SEGMENT_BUDGET = 50000
+
+
+def compile_template(text: str) -> List[str]:
+    """Split tag text into segments.
+
+    Even indexes are literal text, odd indexes are the names inside {}.
+    """
+    return REFERENCE.split(text)
+
+
+class TooLong(Exception):
+    """Raised with the start of the output once it passes maxsize."""
+
+
+class GuildTags:
+    """Every tag one guild can see, compiled.
+
+    Args:
+        texts (Dict[str, str]): Tag text by tag name.
+    """
+
+    def __init__(self, texts: Dict[str, str]):
+        self.templates: Dict[str, List[str]] = {
+            name: compile_template(text) for name, text in texts.items()
+        }
+        self.rendered: Dict[Tuple[str, int], str] = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    def references(self, template: List[str]) -> List[str]:
+        """Names in template that are tags."""
+        return [name for name in template[1::2] if name in self.templates]
+
+    def render(self, text: str, maxsize: int = 2000) -> str:
+        """Expand the tag references in text.
+
+        References to tags that don't exist stay as they are.  If the
+        result is longer than maxsize, it's cut to maxsize - 4 characters
+        and "..." added, as dynamic_tag_get always did.  It's cut the same
+        way where it had got to if it visits more than SEGMENT_BUDGET
+        segments.
+
+        Args:
+            text (str): Tag text.
+            maxsize (int, optional): Longest result before it's cut. Defaults to 2000.
+
+        Returns:
+            str: The expanded text.
+        """
+        key = (text, maxsize)
+        if key in self.rendered:
+            return self.rendered[key]
+        # A tag expands the same way wherever it appears at one depth, so
+        # each (tag, depth) is only expanded once per render.  Without this
+        # a chain of tags that each reference many short tags takes
+        # fan out ** depth steps while the output stays small.
+        expanded: Dict[Tuple[str, int], str] = {}
+        budget = SEGMENT_BUDGET
+
+        def expand(template: List[str], depth: int) -> str:
+            nonlocal budget
+            out: List[str] = []
+            size = 0
+            budget -= len(template)
+            if budget < 0:
+                raise TooLong("")
+            for i, part in enumerate(template):
+                if i % 2 and depth < MAX_DEPTH and part in self.templates:
+                    sub = expanded.get((part, depth + 1))
+                    if sub is None:
+                        try:
+                            sub = expand(self.templates[part], depth + 1)
+                        except TooLong as e:
+                            raise TooLong("".join(out) + e.args[0])
+                        expanded[(part, depth + 1)] = sub
+                    part = sub
+                elif i % 2:
+                    part = f"{{{part}}}"
+                out.append(part)
+                size += len(part)
+                if size > maxsize:
+                    raise TooLong("".join(out))
+            return "".join(out)
+
+        try:
+            result = expand(compile_template(text), 0)
+        except TooLong as e:
+            result = e.args[0][: maxsize - 4] + "..."
+        if len(self.rendered) >= RENDER_CACHE_SIZE:
+            self.rendered.clear()
+        self.rendered[key] = result
+        return result
+
+    def find_cycle(self, tagname: str, text: str) -> Tuple[bool, List[str]]:
+        """Check if giving tagname this text would make it expand forever.
+
+        Args:
+            tagname (str): The tag being created or edited.
+            text (str): Its new text.
+
+        Returns:
+            Tuple[bool, List[str]]: If there's a cycle, and the names along
+            it starting and ending with tagname.
+        """
+        start = self.references(compile_template(text))
+        parents: Dict[str, str] = {}
+        stack = []
+        for name in start:
+            if name not in parents:
+                parents[name] = tagname
+                stack.append(name)
+        while stack:
+            name = stack.pop()
+            if name == tagname:
+                steps = [tagname]
+                node = parents[tagname]
+                while node != tagname:
+                    steps.append(node)
+                    node = parents[node]
+                steps.append(tagname)
+                steps.reverse()
+                return True, steps
+            for child in self.references(self.templates[name]):
+                if child not in parents:
+                    parents[child] = name
+                    stack.append(child)
+        return False, []
+
+
+class TagGraphs:
+    """GuildTags for each guild, loaded on first use."""
+
+    def __init__(self):
+        self.guilds: Dict[int, GuildTags] = {}
+        self.generation = 0
+        self.loads = 0
+
+    async def get(self, guildid: int) -> GuildTags:
+        graph = self.guilds.get(guildid)
+        if graph is None:
+            generation = self.generation
+            graph = GuildTags(await Tag.get_visible_texts(guildid))
+            self.loads += 1
+            # Don't keep it if a tag was written while it loaded.
+            if generation == self.generation:
+                self.guilds[guildid] = graph
+        return graph
+
+    def invalidate(self):
+        """Forget every guild's tags.
+
+        Tags that aren't guild only are visible everywhere, so any write
+        can change any guild's graph.
+        """
+        self.generation += 1
+        self.guilds.clear()
+
+
+tag_graphs = TagGraphs()
@@ -0,0 +1,6 @@
+from .TagGraph import (
+    GuildTags,
+    TagGraphs,
+    compile_template,
+    tag_graphs,
+)
@@ -0,0 +1,67 @@
+import time
+from typing import Any, Dict
+
+from .TagGraph import MAX_DEPTH, GuildTags
+
+"""
+Check that rendering a wide, deep tag graph stays fast.
+
+Builds layers of tags where every tag in a layer references every tag in
+the next one, and the last layer is empty, so the output stays tiny while
+the number of paths through the graph is width ** depth.  A graph that
+fits in SEGMENT_BUDGET has to render in full, and a bigger one has to be
+cut off, both well inside the time limit:
+
+    python -m cogs.TagsSub.tag_benchmark
+"""
+
+
+def layered_tags(width: int, depth: int) -> GuildTags:
+    """Tags l0_* to l{depth}_*, each referencing every tag in the layer below."""
+    texts = {}
+    for layer in range(depth):
+        below = "".join(f"{{l{layer + 1}_{i}}}" for i in range(width))
+        for i in range(width):
+            texts[f"l{layer}_{i}"] = below
+    for i in range(width):
+        texts[f"l{depth}_{i}"] = ""
+    return GuildTags(texts)
+
+
+def render_fanout_benchmark(
+    width: int = 40,
+    wide_width: int = 600,
+    depth: int = MAX_DEPTH - 1,
+    limit: float = 0.5,
+) -> Dict[str, Any]:
+    """Render the top of a width by depth tag graph, then a much wider one.
+
+    Args:
+        width (int, optional): Tags in each layer of the graph that renders in full. Defaults to 40.
+        wide_width (int, optional): Tags in each layer of the graph that's cut off. Defaults to 600.
+        depth (int, optional): Layers of references, the deepest that still expands. Defaults to MAX_DEPTH - 1.
+        limit (float, optional): Seconds each render must finish in. Defaults to 0.5.
+
+    Raises:
+        AssertionError: If a render took longer than limit, or its output is wrong.
+
+    Returns:
+        Dict[str, Any]: Seconds taken and output for both graphs.
+    """
+    results = {}
+    for name, size, expected in (
+        ("full", width, "top  end"),
+        ("cut", wide_width, "top ..."),
+    ):
+        graph = layered_tags(size, depth)
+        start = time.perf_counter()
+        result = graph.render("top {l0_0} end")
+        seconds = time.perf_counter() - start
+        assert result == expected, result
+        assert seconds < limit, f"{name} render took {seconds:.2f}s"
+        results[name] = {"tags": len(graph), "seconds": round(seconds, 4)}
+    return results
+
+
+if __name__ == "__main__":
+    print(render_fanout_benchmark())
@@ -3,7 +3,7 @@ from sqlalchemy import Column, Integer, Boolean, BigInteger, String
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete, func, insert, and_, or_
 from database.database_singleton import DatabaseSingleton
-from database.database_utils import upsert_a
+from database.database_utils import upsert_all_a
 from database import ensure_session
 import discord
 from sqlalchemy.ext.declarative import declarative_base
@@ -34,6 +34,15 @@ class Starboard(Base):
             result = await session.execute(query)
             return result.scalar()
 
+    @classmethod
+    @ensure_session
+    async def get_starboards(
+        cls, guild_ids: list[int], session: OptionalSession = None
+    ) -> dict[int, "Starboard"]:
+        query = select(cls).where(cls.id.in_(guild_ids))
+        result = await session.execute(query)
+        return {starboard.id: starboard for starboard in result.scalars().all()}
+
     @classmethod
     async def add_starboard(cls, guild_id: int, channel_id: int, threshold: int):
         async with DatabaseSingleton.get_async_session() as session:
@@ -226,6 +235,16 @@ class StarboardEntryTable(Base):
             entry = result.scalar()
             return entry
 
+    @classmethod
+    @ensure_session
+    async def get_with_urls(
+        cls, bot_message_urls: list[str], session: OptionalSession = None
+    ) -> dict[str, "StarboardEntryTable"]:
+        result = await session.execute(
+            select(cls).where(cls.bot_message_url.in_(bot_message_urls))
+        )
+        return {entry.bot_message_url: entry for entry in result.scalars().all()}
+
     def __str__(self):
         return f"StarboardEntryTable(message_id={self.message_id}, channel_id={self.channel_id}, guild_id={self.guild_id}, author_id={self.author_id}, bot_message={self.bot_message}, bot_message_url={self.bot_message_url}, message_url={self.message_url}, total={self.total})"
 
@@ -256,6 +275,30 @@ class StarboardEntryGivers(Base):
             result = await session.execute(query)
             return result.scalars().all()
 
+    @classmethod
+    @ensure_session
+    async def list_emojis_for_messages(
+        cls, keys: list[tuple[int, int]], session: OptionalSession = None
+    ) -> dict[tuple[int, int], list[str]]:
+        """Get the starrer emojis of several messages at once.
+
+        Args:
+            keys (list[tuple[int, int]]): Guild and message id pairs.
+
+        Returns:
+            dict[tuple[int, int], list[str]]: Emojis by guild and message id.
+        """
+        emojis = {key: [] for key in keys}
+        query = select(cls.guild_id, cls.message_id, cls.emoji).where(
+            cls.guild_id.in_({guild_id for guild_id, _ in keys}),
+            cls.message_id.in_({message_id for _, message_id in keys}),
+        )
+        result = await session.execute(query)
+        for guild_id, message_id, emoji in result.all():
+            if (guild_id, message_id) in emojis:
+                emojis[(guild_id, message_id)].append(emoji)
+        return emojis
+
     @classmethod
     @ensure_session
     async def get_starrer(
@@ -273,6 +316,69 @@ class StarboardEntryGivers(Base):
         result = await session.execute(query)
         return result.scalar()
 
+    @classmethod
+    @ensure_session
+    async def get_starrers_by_ids(
+        cls,
+        guild_id: int,
+        message_id: int,
+        star_giver_ids: list[int],
+        session: OptionalSession = None,
+    ):
+        query = select(cls).where(
+            cls.message_id == message_id,
+            cls.guild_id == guild_id,
+            cls.star_giver_id.in_(star_giver_ids),
+        )
+        result = await session.execute(query)
+        return result.scalars().all()
+
+    @classmethod
+    async def apply_starrer_changes(
+        cls,
+        message_id: int,
+        guild_id: int,
+        added: dict[int, str],
+        removed: list[int],
+        source_message_url: str = None,
+        session: OptionalSession = None,
+    ):
+        """Upsert and delete the starrers of one message without committing.
+
+        Args:
+            message_id (int): The starred message.
+            guild_id (int): The message's guild.
+            added (dict[int, str]): Emoji by star giver id, to add or change.
+            removed (list[int]): Star giver ids to remove.
+            source_message_url (str, optional): Url of the starred message. Defaults to None.
+            session (OptionalSession, optional): Session the changes are made in.
+        """
+        if added:
+            await upsert_all_a(
+                session,
+                cls,
+                [
+                    {
+                        "message_id": message_id,
+                        "guild_id": guild_id,
+                        "star_giver_id": star_giver_id,
+                        "emoji": emoji,
+                        "source_message_url": source_message_url,
+                    }
+                    for star_giver_id, emoji in added.items()
+                ],
+                ["message_id", "guild_id", "star_giver_id"],
+                do_commit=False,
+            )
+        if removed:
+            await session.execute(
+                delete(cls).where(
+                    cls.message_id == message_id,
+                    cls.guild_id == guild_id,
+                    cls.star_giver_id.in_(removed),
+                )
+            )
+
     @classmethod
     async def count_starrers(
         cls, guild_id: int, message_id: int, session: OptionalSession = None
@@ -299,11 +405,11 @@ class StarboardEntryGivers(Base):
             }
             for message_id, guild_id, star_giver_id, emoji, source_message_url in starrers
         ]
-        await upsert_a(
+        await upsert_all_a(
             session,
             cls,
-            ["message_id", "guild_id", "star_giver_id"],
             new_starrers,
+            ["message_id", "guild_id", "star_giver_id"],
             do_commit=False,
         )
 
@@ -328,8 +434,8 @@ class StarboardEntryGivers(Base):
                 }
             ]
 
-            await upsert_a(
-                session, cls, ["message_id", "guild_id", "star_giver_id"], new_starrers
+            await upsert_all_a(
+                session, cls, new_starrers, ["message_id", "guild_id", "star_giver_id"]
             )
 
     @classmethod
@@ -554,6 +660,19 @@ class Tag(Base):
             )
             return tags.scalars().all()
 
+    @classmethod
+    @ensure_session
+    async def get_visible_texts(
+        cls, gid: int, session: OptionalSession = None
+    ) -> dict[str, str]:
+        """Text of every tag guild gid can use, by tag name, in one query."""
+        tags = await session.execute(
+            select(cls.tagname, cls.text).where(
+                or_(cls.guild_only == False, cls.guildid == gid)
+            )
+        )
+        return {tagname: text for tagname, text in tags}
+
     @staticmethod
     async def list_all_cat(gid: int):
         async with DatabaseSingleton.get_async_session() as session:
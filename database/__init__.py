@@ -4,7 +4,7 @@
 """Database Main stores some common tables."""
 print("importing database main")
 from .database_singleton import DatabaseSingleton, DSCTX
-from .database_utils import add_or_update_all, upsert_a
+from .database_utils import add_or_update_all, upsert_a, upsert_all, upsert_all_a
 from .database_main import (
     AwareDateTime,
     ServerData,
@@ -4,7 +4,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 
 from sqlalchemy import select, delete, func
 from sqlalchemy.dialects.sqlite import insert
-from typing import List, Type, Dict, Any
+from typing import List, Type, Dict, Any, Iterable, Optional, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql.expression import Insert
 
@@ -67,6 +67,115 @@ async def upsert_a(
         await session.commit()
 
 
+def get_primary_keys(model) -> List[str]:
+    """Return the names of every primary key column of model."""
+    return [col.name for col in model.__mapper__.primary_key]
+
+
+def model_to_dict(instance) -> Dict[str, Any]:
+    """Turn an ORM instance into a row dictionary keyed by column name.
+
+    Columns that were never set on the instance get their default the way
+    an INSERT would, scalars as they are and callables called for this row.
+    Columns whose default is a SQL expression or set by the server are left
+    out, so the database fills them in.  Any other column is None.
+    """
+    row = {}
+    for prop in instance.__mapper__.column_attrs:
+        column = prop.columns[0]
+        default = column.default
+        if prop.key in instance.__dict__:
+            row[column.name] = instance.__dict__[prop.key]
+        elif default is not None and default.is_scalar:
+            row[column.name] = default.arg
+        elif default is not None and default.is_callable:
+            # SQLAlchemy wraps callable defaults to take an execution context.
+            row[column.name] = default.arg(None)
+        elif default is None and column.server_default is None:
+            row[column.name] = None
+    return row
+
+
+def _build_upserts(
+    model,
+    values_list: Iterable[Union[Dict[str, Any], Any]],
+    index_elements: Optional[List[str]] = None,
+    update: bool = True,
+) -> List[Tuple[Insert, List[Dict[str, Any]]]]:
+    """Build INSERT ... ON CONFLICT statements and the rows to run each with.
+
+    One executemany needs the same keys in every row, so rows are grouped
+    by the columns they set, and each group gets one statement.  A group
+    isn't split up any further: executemany binds one row at a time, so
+    SQLite's limit on bound parameters is per row, not per group.
+    """
+    rows = [v if isinstance(v, dict) else model_to_dict(v) for v in values_list]
+    if not rows:
+        return []
+    if index_elements is None:
+        index_elements = get_primary_keys(model)
+    # Deduplicate on the conflict target, the last row wins.
+    deduped = {}
+    for row in rows:
+        deduped[tuple(row[k] for k in index_elements)] = row
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in deduped.values():
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    upserts = []
+    for keys, group in groups.items():
+        stmt: Insert = insert(model.__table__)
+        update_keys = [key for key in keys if key not in index_elements]
+        if update and update_keys:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={key: getattr(stmt.excluded, key) for key in update_keys},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        upserts.append((stmt, group))
+    return upserts
+
+
+def upsert_all(
+    session: Session,
+    model: Any,
+    values_list: Iterable[Union[Dict[str, Any], Any]],
+    index_elements: Optional[List[str]] = None,
+    update: bool = True,
+    do_commit: bool = False,
+) -> None:
+    """Insert or update many rows with executemany INSERT ... ON CONFLICT statements.
+
+    Args:
+        session (Session): The session to execute in.
+        model (Any): Declarative model class of the target table.
+        values_list: Row dictionaries or ORM instances of model.
+        index_elements (List[str], optional): Conflict target.  Defaults to every primary key column.
+        update (bool, optional): Update existing rows if True, leave them untouched if False.
+        do_commit (bool, optional): Commit once every row is sent.  Defaults to False.
+    """
+    for stmt, rows in _build_upserts(model, values_list, index_elements, update):
+        session.execute(stmt, rows)
+    if do_commit:
+        session.commit()
+
+
+async def upsert_all_a(
+    session: AsyncSession,
+    model: Any,
+    values_list: Iterable[Union[Dict[str, Any], Any]],
+    index_elements: Optional[List[str]] = None,
+    update: bool = True,
+    do_commit: bool = True,
+) -> None:
+    """async variant of upsert_all."""
+    for stmt, rows in _build_upserts(model, values_list, index_elements, update):
+        await session.execute(stmt, rows)
+    if do_commit:
+        await session.commit()
+
+
 def merge_metadata(*original_metadata) -> MetaData:
     merged = MetaData()
 
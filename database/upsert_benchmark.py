@@ -0,0 +1,91 @@
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from .database_utils import add_or_update_all, upsert_all
+
+"""
+Micro benchmark for upsert_all.
+
+Upserts rows shaped like ArchivedRPMessages, with a composite primary key and
+a callable default, into a scratch in-memory SQLite database.  Each size is
+timed as a fresh insert and as an update of every row, and the smaller sizes
+against add_or_update_all, which looked every row up one at a time:
+
+    python -m database.upsert_benchmark
+"""
+
+BenchBase = declarative_base()
+
+
+class BenchMessage(BenchBase):
+    __tablename__ = "BenchMessages"
+    message_id = Column(BigInteger, primary_key=True)
+    server_id = Column(BigInteger, primary_key=True)
+    author = Column(String)
+    content = Column(String)
+    edits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+def make_rows(count: int, content: str) -> List[BenchMessage]:
+    return [
+        BenchMessage(
+            message_id=i, server_id=i % 4, author=f"user{i % 50}", content=content
+        )
+        for i in range(count)
+    ]
+
+
+def upsert_benchmark(
+    sizes: Sequence[int] = (10000, 100000), legacy_max: int = 10000
+) -> Dict[int, Dict[str, Any]]:
+    """Time upsert_all inserting and then updating count rows for each size.
+
+    Args:
+        sizes (Sequence[int], optional): Row counts to try. Defaults to 10k and 100k.
+        legacy_max (int, optional): Largest size to also time add_or_update_all at,
+            since it makes one query per row. Defaults to 10000.
+
+    Returns:
+        Dict[int, Dict[str, Any]]: For each size, seconds for each way and
+        microseconds per row for upsert_all.
+    """
+    results = {}
+    for count in sizes:
+        engine = create_engine("sqlite://")
+        BenchBase.metadata.create_all(engine)
+        result: Dict[str, Any] = {}
+        with Session(engine) as session:
+            rows = make_rows(count, "first")
+            start = time.perf_counter()
+            upsert_all(session, BenchMessage, rows, do_commit=True)
+            result["insert_s"] = round(time.perf_counter() - start, 3)
+
+            rows = make_rows(count, "edited")
+            start = time.perf_counter()
+            upsert_all(session, BenchMessage, rows, do_commit=True)
+            result["update_s"] = round(time.perf_counter() - start, 3)
+        result["insert_us_per_row"] = round(result["insert_s"] / count * 1e6, 2)
+        result["update_us_per_row"] = round(result["update_s"] / count * 1e6, 2)
+        engine.dispose()
+
+        if count <= legacy_max:
+            engine = create_engine("sqlite://")
+            BenchBase.metadata.create_all(engine)
+            with Session(engine) as session:
+                rows = make_rows(count, "first")
+                start = time.perf_counter()
+                add_or_update_all(session, BenchMessage, rows)
+                session.commit()
+                result["legacy_insert_s"] = round(time.perf_counter() - start, 3)
+            engine.dispose()
+        results[count] = result
+    return results
+
+
+if __name__ == "__main__":
+    print(upsert_benchmark())
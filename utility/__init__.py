@@ -35,4 +35,4 @@ from .formatutil import (
 )
 from .views import ConfirmView, RRuleView
 from .manual_load import load_manual, load_json_with_substitutions
-from .debug import Timer
+from .debug import Timer, percentile
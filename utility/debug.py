@@ -1,4 +1,5 @@
 import time
+from typing import Iterable
 
 
 class Timer:
@@ -11,3 +12,19 @@ class Timer:
 
     def get_time(self):
         return self.end_time - self.start_time
+
+
+def percentile(values: Iterable[float], fraction: float) -> float:
+    """The value fraction of the way through values once sorted, nearest rank below.
+
+    Args:
+        values (Iterable[float]): Samples, in any order.
+        fraction (float): 0.5 for the median, 1.0 for the largest.
+
+    Returns:
+        float: The percentile, or 0.0 if there are no values.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[int((len(ordered) - 1) * fraction)]